@@ -7,9 +7,21 @@ from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 
 # Load data
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+snapshot_path = os.path.join(BASE_DIR, '../Data-Storage/processed/vehicles_cleaned.arrow')
+parquet_path = os.path.join(BASE_DIR, '../Data-Storage/processed/vehicles_cleaned.parquet')
 file_path = os.path.join(BASE_DIR, '../Data-Storage/processed/vehicles_cleaned.csv')
+# Only the columns the model uses, with Parquet the others are never read from disk
+columns = ['horse_power', 'model_year', 'purchase_price', 'fuel_type', 'manufacturer_name', 'model_name']
 
-data = pd.read_csv(file_path)
+if os.path.exists(snapshot_path):
+    # Memory mapped, the columns are used in place instead of being read and parsed
+    import pyarrow as pa
+    with pa.memory_map(snapshot_path) as source:
+        data = pa.ipc.open_file(source).read_all().select(columns).to_pandas(split_blocks=True)
+elif os.path.exists(parquet_path):
+    data = pd.read_parquet(parquet_path, columns=columns)
+else:
+    data = pd.read_csv(file_path, usecols=columns)
 
 data = pd.get_dummies(data, columns=['fuel_type', 'manufacturer_name', 'model_name'], drop_first=True)
 
@@ -1,12 +1,72 @@
+import argparse
+import operator
 import os
 import pandas as pd
 
-def load_data(file_path):
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # without pyarrow only the CSV can be read
+    pa = pq = None
+
+# Written by extract_transform_load.py, the CSV is the older output format
+SNAPSHOT_FILE = "../Data-Storage/processed/vehicles_cleaned.arrow"
+PARQUET_FILE = "../Data-Storage/processed/vehicles_cleaned.parquet"
+CSV_FILE = "../Data-Storage/processed/vehicles_cleaned.csv"
+COLUMNS = ["manufacturer_name", "model_name", "horse_power", "purchase_price", "fuel_type"]
+# The operators of pyarrow filters, applied to the CSV by filter_rows()
+OPERATORS = {"=": operator.eq, "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+             ">": operator.gt, ">=": operator.ge, "in": lambda values, value: values.isin(value),
+             "not in": lambda values, value: ~values.isin(value)}
+
+def filter_rows(df, filters):
+    """Keep the rows matching every (column, op, value) filter, like pyarrow does with them."""
+    for column, op, value in filters or []:
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported filter operator {op!r} on {column}")
+        matches = OPERATORS[op](df[column], value)
+        if op not in ("in", "not in"):
+            # a comparison with a missing value is null for pyarrow, the row is dropped
+            matches &= df[column].notna()
+        df = df[matches]
+    return df
+
+def load_data(file_path, columns=None, filters=None):
+    """
+    Load the cleaned vehicles. From a Parquet directory only `columns` are read, and `filters`
+    such as [("manufacturer_name", "=", "Kia")] skip the other partitions without opening them.
+    The Arrow snapshot is memory mapped, its columns are used in place, without a copy. Every
+    format takes the operators of pyarrow filters, see OPERATORS.
+    """
     script_dir = os.path.dirname(os.path.abspath(__file__)) 
     resolved_file_path = os.path.join(script_dir, file_path) 
     try:
-        df = pd.read_csv(resolved_file_path)
-        return df
+        if file_path.endswith(".arrow"):
+            with pa.memory_map(resolved_file_path) as source:
+                table = pa.ipc.open_file(source).read_all()
+            if filters:
+                # the expression pd.read_parquet builds from the filters
+                table = table.filter(pq.filters_to_expression(filters))
+            if columns is not None:
+                table = table.select(columns)
+            # split_blocks keeps every column on its own instead of copying them into 2D blocks
+            df = table.to_pandas(split_blocks=True)
+            if filters:
+                for column in df.select_dtypes("category"):
+                    df[column] = df[column].cat.remove_unused_categories()
+            return df
+        if file_path.endswith(".parquet"):
+            if not os.path.exists(resolved_file_path):
+                raise FileNotFoundError(resolved_file_path)
+            df = pd.read_parquet(resolved_file_path, columns=columns, filters=filters)
+            # the partition column is read back as a category of every partition, not only the filtered ones
+            if "manufacturer_name" in df:
+                df["manufacturer_name"] = df["manufacturer_name"].cat.remove_unused_categories()
+            return df
+        # the filtered columns are read as well, like pyarrow does
+        usecols = None if columns is None else list(dict.fromkeys(columns + [column for column, _, _ in filters or []]))
+        df = filter_rows(pd.read_csv(resolved_file_path, usecols=usecols), filters)
+        return df if columns is None else df[columns]
     except FileNotFoundError:
         print(f"Error: The file {resolved_file_path} does not exist.")
         return None
@@ -43,7 +103,15 @@ def analyze_data(df):
 
 
 if __name__ == "__main__":
-    file_path = "../Data-Storage/processed/vehicles_cleaned.csv"
-    df = load_data(file_path)
+    parser = argparse.ArgumentParser(description="Print insights about the cleaned vehicles")
+    parser.add_argument("--manufacturer", help="only analyze the vehicles of this manufacturer")
+    args = parser.parse_args()
+
+    filters = [("manufacturer_name", "=", args.manufacturer)] if args.manufacturer else None
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    # The first one the ETL wrote, the snapshot is the fastest to load
+    readable = [SNAPSHOT_FILE, PARQUET_FILE] if pa is not None else []
+    file_path = next((path for path in readable if os.path.exists(os.path.join(script_dir, path))), CSV_FILE)
+    df = load_data(file_path, columns=COLUMNS, filters=filters)
     if df is not None:
         analyze_data(df)
@@ -1,26 +1,197 @@
 import requests
+import numpy as np
 import pandas as pd
 import os
+import argparse
+import json
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import chain
+from pathlib import Path
+from types import MappingProxyType
+from pandas.api.types import union_categoricals
 
-def extract_data(api_url):
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        data = response.json()
-        print(f"Successfully fetched {len(data)} records.")
-        return data
-    else:
-        print(f"Failed to fetch data from API. Status code: {response.status_code}")
-        return []
+from vin_index import BLOOM_BITS_PER_KEY, VinIndex, output_fingerprint, vin_keys
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, without it the output can only be CSV
+    pa = pc = ds = pq = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The API project, the database source reads its SQLite file directly
+API_SERVER_DIR = os.path.join(BASE_DIR, "../../vehicle-api-server")
+# An output ending in .parquet is a directory of Parquet files partitioned by PARTITION_COLUMNS,
+# anything else is written as a single CSV file
+OUTPUT_FILE = os.path.join(BASE_DIR, "Data-Storage/processed/vehicles_cleaned.parquet")
+CSV_OUTPUT_FILE = os.path.join(BASE_DIR, "Data-Storage/processed/vehicles_cleaned.csv")
+PARTITION_COLUMNS = ["manufacturer_name"]
+# Uncompressed Arrow IPC copy of the output, that analytics and the model memory map instead of parsing
+SNAPSHOT_FILE = os.path.join(BASE_DIR, "Data-Storage/processed/vehicles_cleaned.arrow")
+
+# Incremental runs: the change log seq the output is up to date with, and the changes of the run in progress
+STATE_FILE = os.path.join(BASE_DIR, "Data-Storage/state/etl_state.json")
+STAGING_FILE = os.path.join(BASE_DIR, "Data-Storage/state/pending_changes.jsonl")
+# VINs in the output, append runs skip the vehicles already there
+VIN_INDEX_DIR = os.path.join(BASE_DIR, "Data-Storage/state/vin_index")
+CHANGES_PAGE_SIZE = 5000
+
+# Rows cleaned and written at a time, this is what bounds the memory of the transform and load steps
+CHUNK_SIZE = 50_000
+
+COLUMNS = ["vin", "manufacturer_name", "description", "horse_power",
+           "model_name", "model_year", "purchase_price", "fuel_type"]
+
+# Compact dtypes of the cleaned data, kept in the Parquet output and applied again when reading a CSV.
+# A few dozen distinct strings become categories, the numbers fit in 16 bits (Int16 is nullable, a
+# value that could not be parsed stays missing), and float32 keeps prices to the cent up to 131,072.
+# A chunk with a larger price keeps float64, see downcast_prices(). Read only: the price type of a
+# run, --price-dtype, is passed along as `price_dtype`
+DTYPES = MappingProxyType({
+    "manufacturer_name": "category",
+    "description": "category",
+    "horse_power": "Int16",
+    "model_name": "category",
+    "model_year": "Int16",
+    "purchase_price": "float32",
+    "fuel_type": "category",
+})
+PRICE_DTYPE = DTYPES["purchase_price"]
+# Largest change a downcast price may see, rounding to float32 must not move it to another cent
+PRICE_TOLERANCE = 0.005
+
+# Records per page of GET /vehicle
+PAGE_SIZE = 5000
+
+# Rows fetched from the database at a time by the database source
+FETCH_SIZE = 5000
+
+# Back off on rate limited responses
+MAX_RETRIES = 8
+MAX_BACKOFF_SECONDS = 60
+
+# One keep-alive session per worker thread, requests sessions are not thread safe
+_thread_local = threading.local()
+
+def get_session():
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
 
-def transform_data(raw_data):
-    df = pd.DataFrame(raw_data)
+class ResyncRequired(Exception):
+    """The change log was pruned past the watermark, only a full extraction can catch up."""
 
+def get_with_backoff(url, params):
+    """GET url, retrying 429 responses. Returns the last response."""
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        response = session.get(url, params=params)
+        if response.status_code != 429 or attempt == MAX_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else min(2 ** attempt * 0.5, MAX_BACKOFF_SECONDS)
+        print(f"Rate limited on {url}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+def fetch_page(api_url, cursor, per_page):
+    """GET one page of vehicles. Returns (records, cursor of the next page or None after the last one)."""
+    params = {"per_page": per_page}
+    if cursor is not None:
+        params["cursor"] = cursor
+    response = get_with_backoff(api_url, params)
+    response.raise_for_status()
+    return response.json(), response.headers.get("X-Next-Cursor")
+
+def extract_data(api_url, per_page=PAGE_SIZE):
+    """
+    Yield the vehicles of GET /vehicle one by one, in table order, following the cursor of every
+    page. The next page is fetched while the records of the current one are consumed, so memory
+    use depends on the page size and not on the size of the table. A failed request raises, a run
+    must never take a failed extraction for an empty table and write it over the output.
+    """
+    fetched = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # A server without pagination sends the whole listing and no cursor
+        page = executor.submit(fetch_page, api_url, None, per_page)
+        while page is not None:
+            records, cursor = page.result()
+            page = executor.submit(fetch_page, api_url, cursor, per_page) if cursor is not None else None
+            fetched += len(records)
+            yield from records
+    print(f"Successfully fetched {fetched} records.")
+
+def api_db():
+    # app.db of the API project, for the path and the queries the API itself uses
+    if API_SERVER_DIR not in sys.path:
+        sys.path.insert(0, API_SERVER_DIR)
+    from app import db
+    return db
+
+def default_database_path():
+    return api_db().DATABASE
+
+def connect_read_only(database=None):
+    database = os.path.abspath(database or default_database_path())
+    # mode=ro fails instead of creating an empty database when the path is wrong
+    return sqlite3.connect(f"{Path(database).as_uri()}?mode=ro", uri=True)
+
+def extract_from_database(database=None, fetch_size=FETCH_SIZE):
+    """
+    Yield the vehicles straight from the SQLite database of the API, in table order, like
+    extract_data does through GET /vehicle. The file is opened read only and the rows are
+    fetched `fetch_size` at a time, so neither the API nor the rate limiter is involved.
+    A database that cannot be opened or read raises sqlite3.Error, the output is then kept.
+    """
+    connection = connect_read_only(database)
+    fetched = 0
+    try:
+        # A single statement reads from a single snapshot, even while the API keeps writing
+        cursor = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM vehicles ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            fetched += len(rows)
+            for row in rows:
+                yield dict(zip(COLUMNS, row))
+    finally:
+        connection.close()
+    print(f"Successfully fetched {fetched} records.")
+
+def iter_chunks(records, chunk_size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def clean_chunk(df, seen_vins):
+    """
+    Clean one chunk in place. seen_vins is a VinIndex of the VINs of the rows already kept,
+    so a VIN is only kept once across all chunks, whatever its case, like the NOCASE primary key.
+    """
+    return drop_seen_vins(normalize_chunk(df), seen_vins)
+
+def normalize_chunk(df, price_dtype=PRICE_DTYPE):
+    """Everything clean_chunk does that only depends on the chunk itself."""
     # Handle missing values
     df.dropna(subset=["manufacturer_name", "fuel_type"], inplace=True)  # Drop rows with with important missing values
     df["description"] = df["description"].fillna("No description available")  # fill missing description
-    
-    # Remove duplicates
-    df.drop_duplicates(subset=["vin"], inplace=True)
 
     # Normalize columns
     df["manufacturer_name"] = df["manufacturer_name"].str.strip().str.title()
@@ -29,21 +200,700 @@ def transform_data(raw_data):
     # Ensure numeric values are valid
     df["horse_power"] = pd.to_numeric(df["horse_power"], errors="coerce")
     df["purchase_price"] = pd.to_numeric(df["purchase_price"], errors="coerce")
+    return optimize_dtypes(df, price_dtype)
 
-    print(f"Data cleaned. Remaining records: {len(df)}")
+def drop_seen_vins(df, seen_vins):
+    # Remove duplicates, within the chunk and with the previous chunks. The kept VINs are in an
+    # on-disk index, the memory does not grow with the number of rows cleaned so far
+    keys = vin_keys(df["vin"].tolist())
+    duplicated = np.ones(len(keys), dtype=bool)
+    duplicated[np.unique(keys, return_index=True)[1]] = False
+    duplicated |= seen_vins.contains(keys)
+    if duplicated.any():
+        df.drop(df.index[duplicated], inplace=True)
+    seen_vins.add(keys[~duplicated])
     return df
 
-def load_data(df, output_file):
+def normalize_records(records, price_dtype=PRICE_DTYPE):
+    # Runs in the worker processes of transform_chunks
+    return normalize_chunk(pd.DataFrame(records, columns=COLUMNS), price_dtype)
+
+def normalize_in_processes(raw_data, chunk_size, workers, price_dtype=PRICE_DTYPE):
+    """
+    Yield normalize_records() of every chunk, in input order, computed by `workers` processes.
+    At most two chunks per worker are in flight, so the memory stays bounded like the serial path.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for chunk in iter_chunks(raw_data, chunk_size):
+            in_flight.append(executor.submit(normalize_records, chunk, price_dtype))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def optimize_dtypes(df, price_dtype=PRICE_DTYPE):
+    """Convert the cleaned columns to DTYPES, prices to `price_dtype`, checking that no number changes on the way."""
+    for column in ("horse_power", "model_year"):
+        values = pd.to_numeric(df[column], errors="coerce")
+        info = np.iinfo(DTYPES[column].lower())
+        # out of range is as invalid as not a number, instead of silently wrapping around
+        out_of_range = values.notna() & ((values < info.min) | (values > info.max) | (values % 1 != 0))
+        if out_of_range.any():
+            print(f"{out_of_range.sum()} {column} values do not fit in {DTYPES[column]}, they are left empty")
+            values = values.mask(out_of_range)
+        df[column] = values.astype(DTYPES[column])
+
+    downcast_prices(df, price_dtype)
+
+    for column, dtype in DTYPES.items():
+        if dtype == "category":
+            df[column] = df[column].astype("category")
+    return df
+
+def downcast_prices(df, price_dtype=PRICE_DTYPE):
+    """
+    Convert purchase_price to `price_dtype` unless a price would move to another cent. Then the
+    chunk keeps float64, which the Parquet writers notice to widen what they already wrote.
+    """
+    prices = df["purchase_price"].astype("float64")
+    converted = prices.astype(price_dtype)
+    error = (converted.astype("float64") - prices).abs().max()
+    if error > PRICE_TOLERANCE:
+        print(f"purchase_price changes by up to {error:.4f} as {price_dtype}, using float64 instead")
+        converted = prices
+    df["purchase_price"] = converted
+
+def concat_chunks(chunks):
+    """pd.concat the cleaned chunks, keeping the categories although every chunk has its own."""
+    for column, dtype in DTYPES.items():
+        if dtype == "category":
+            categories = union_categoricals([df[column] for df in chunks]).categories
+            for df in chunks:
+                df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+def transform_chunks(raw_data, chunk_size=CHUNK_SIZE, seen_vins=None, workers=1, price_dtype=PRICE_DTYPE):
+    """
+    Clean the records `chunk_size` at a time and yield one DataFrame per chunk. Only one chunk
+    is in memory at any time, whatever the size of the input: the VINs kept so far go to
+    `seen_vins`, a VinIndex, in a temporary directory when none is given. Prices are `price_dtype`,
+    float64 in a chunk with a price that type cannot keep to the cent.
+
+    With several workers the chunks are normalized in a process pool. The VIN dedup stays
+    in this process and sees the chunks in input order, so the output is the same as with one.
+    """
+    if seen_vins is None:
+        with tempfile.TemporaryDirectory(prefix="seen-vins-") as tmp_dir:
+            yield from transform_chunks(raw_data, chunk_size, VinIndex(tmp_dir), workers, price_dtype)
+        return
+    if workers > 1:
+        normalized = normalize_in_processes(raw_data, chunk_size, workers, price_dtype)
+    else:
+        normalized = map(partial(normalize_records, price_dtype=price_dtype), iter_chunks(raw_data, chunk_size))
+    records = 0
+    for df in normalized:
+        df = drop_seen_vins(df, seen_vins)
+        records += len(df)
+        yield df
+    print(f"Data cleaned. Remaining records: {records}")
+
+def transform_data(raw_data, chunk_size=CHUNK_SIZE, workers=1):
+    """Clean the records into a single DataFrame, for callers that need all of them at once."""
+    chunks = list(transform_chunks(raw_data, chunk_size, workers=workers))
+    if not chunks:
+        return pd.DataFrame(columns=COLUMNS).astype(DTYPES)
+    return concat_chunks(chunks)
+
+def is_parquet(output_file):
+    return output_file.rstrip("/\\").endswith(".parquet")
+
+def arrow_schema(price_dtype=PRICE_DTYPE):
+    # Fixed types, so every chunk is written the same way. Categories are stored dictionary
+    # encoded and read back as categories
+    types = {"category": pa.dictionary(pa.int32(), pa.string()), "Int16": pa.int16(),
+             "float32": pa.float32(), "float64": pa.float64()}
+    dtypes = {**DTYPES, "purchase_price": price_dtype}
+    return pa.schema([("vin", pa.string())] + [(column, types[dtypes[column]]) for column in COLUMNS[1:]])
+
+def record_batches(chunks, schema):
+    # Through a Table, the Arrow backed string columns of a concatenated DataFrame are chunked
+    # arrays that RecordBatch.from_pandas() refuses
+    for df in chunks:
+        yield from pa.Table.from_pandas(df, schema=schema, preserve_index=False).to_batches()
+
+def replace_directory(tmp_dir, output_dir):
+    """Swap the freshly written directory in. Directories cannot be os.replace()d over, so the old one is moved aside first."""
+    old_dir = f"{output_dir}.old"
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(output_dir):
+        os.replace(output_dir, old_dir)
+    os.replace(tmp_dir, output_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+def recover_output(output_file):
+    # A run that died between the two renames of replace_directory left the previous output in .old
+    old_dir = f"{output_file}.old"
+    if not os.path.exists(output_file) and os.path.isdir(old_dir):
+        os.replace(old_dir, output_file)
+
+def write_dataset(chunks, directory, basename_template=None, partition_columns=PARTITION_COLUMNS,
+                  price_dtype=PRICE_DTYPE):
+    """
+    Stream the chunks into a new hive partitioned (manufacturer_name=Honda/part-0.parquet)
+    Parquet dataset, zstd compressed with column statistics. Every file gets the same schema:
+    prices are `price_dtype` until a chunk comes with float64 ones, then the files written so
+    far are widened and the rest is written as float64. Returns the price type of the files.
+    """
+    if pa is None:
+        raise RuntimeError("Writing Parquet requires pyarrow, install it or use a .csv output")
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    chunks = iter(chunks)
+    wider = []
+
+    def fitting_chunks(schema):
+        # The chunks up to the first one whose prices the schema cannot hold, which goes to `wider`
+        for df in chunks:
+            if df["purchase_price"].dtype == "float64" and schema.field("purchase_price").type != pa.float64():
+                wider.append(df)
+                return
+            yield df
+
+    schema = arrow_schema(price_dtype)
+    write_batches(record_batches(fitting_chunks(schema), schema), schema, directory, basename_template,
+                  partition_columns)
+    # write_dataset creates nothing for an empty input, readers still expect the directory
+    os.makedirs(directory, exist_ok=True)
+    if not wider:
+        return price_dtype
+    widen_prices(directory)
+    schema = arrow_schema("float64")
+    write_batches(record_batches(chain(wider, chunks), schema), schema, directory, unique_basename("part"),
+                  partition_columns)
+    return "float64"
+
+def write_batches(batches, schema, directory, basename_template, partition_columns):
+    ds.write_dataset(
+        pa.RecordBatchReader.from_batches(schema, batches), directory,
+        format="parquet",
+        partitioning=partition_columns, partitioning_flavor="hive",
+        basename_template=basename_template, existing_data_behavior="overwrite_or_ignore",
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        # a few large row groups per file, so the statistics let readers skip most of them.
+        # The files are capped as well, a merge only rewrites the files holding a changed VIN
+        min_rows_per_group=CHUNK_SIZE, max_rows_per_group=4 * CHUNK_SIZE, max_rows_per_file=4 * CHUNK_SIZE,
+    )
+
+def widen_prices(directory):
+    """
+    Rewrite the files of a Parquet directory that store purchase_price as float32 with float64,
+    which holds every float32 exactly. A file at a time, each one replaced with a rename.
+    """
+    for path in ds.dataset(directory, format="parquet").files:
+        if pq.read_schema(path).field("purchase_price").type == pa.float64():
+            continue
+        # the file only, its partition column is in the path
+        table = pq.ParquetFile(path).read()
+        index = table.schema.get_field_index("purchase_price")
+        table = table.set_column(index, "purchase_price", table["purchase_price"].cast(pa.float64()))
+        # hidden from the dataset readers until it is complete
+        tmp_file = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+        pq.write_table(table, tmp_file, compression="zstd")
+        os.replace(tmp_file, path)
+
+def match_output_dtypes(output_file, price_dtype=PRICE_DTYPE):
+    """
+    The price type a run with `price_dtype` writes to the Parquet output: float64 as soon as the
+    run or one of the output files has it. The output is then widened whole, which also completes
+    a widening that was interrupted, so that it keeps a single schema.
+    """
+    if not is_parquet(output_file) or not os.path.isdir(output_file):
+        return price_dtype
+    files = ds.dataset(output_file, format="parquet").files
+    if price_dtype == "float64" or any(
+            pq.read_schema(path).field("purchase_price").type == pa.float64() for path in files):
+        widen_prices(output_file)
+        return "float64"
+    return price_dtype
+
+def unique_basename(prefix):
+    # So the files of every append and merge live next to the ones already there
+    return f"{prefix}-{uuid.uuid4().hex}-{{i}}.parquet"
+
+def move_files(tmp_dir, output_dir):
+    # Move the files written aside into the output, in the same partition directories
+    for root, _, names in os.walk(tmp_dir):
+        target_dir = os.path.join(output_dir, os.path.relpath(root, tmp_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in names:
+            os.replace(os.path.join(root, name), os.path.join(target_dir, name))
+    shutil.rmtree(tmp_dir)
+
+def write_parquet(chunks, output_dir, price_dtype=PRICE_DTYPE):
+    """Write the chunks as a new Parquet dataset, then swap it in for the previous output."""
+    tmp_dir = f"{output_dir}.tmp"
+    write_dataset(chunks, tmp_dir, price_dtype=price_dtype)
+    replace_directory(tmp_dir, output_dir)
+
+def append_parquet(chunks, output_dir, price_dtype=PRICE_DTYPE):
+    """
+    Add the chunks to an existing Parquet output as new files, the files already there are not
+    read or rewritten. The new files are written aside and moved in once complete.
+    """
+    price_dtype = match_output_dtypes(output_dir, price_dtype)
+    tmp_dir = f"{output_dir}.tmp"
+    price_dtype = write_dataset(chunks, tmp_dir, unique_basename("append"), price_dtype=price_dtype)
+    # the new vehicles may have float64 prices
+    match_output_dtypes(output_dir, price_dtype)
+    move_files(tmp_dir, output_dir)
+
+def merge_parquet(output_dir, changes, upserts, price_dtype=PRICE_DTYPE):
+    """
+    Apply the staged changes to a Parquet output file by file. Only the VIN column is read to
+    find the files holding a changed vehicle, those are rewritten without it and `upserts`, the
+    cleaned current version of the upserted vehicles, is added as new files: the other files are not rewritten,
+    what is written follows the churn. Everything is written aside and moved in with renames.
+    Applying the same changes again gives the same output, an interrupted merge is just redone.
+    """
+    price_dtype = match_output_dtypes(output_dir, price_dtype)
+    keys = pa.array(sorted(changes), pa.string())
+    dataset = ds.dataset(output_dir, format="parquet", partitioning="hive")
+    touched = [fragment.path for fragment in dataset.get_fragments()
+               if pc.any(pc.is_in(pc.utf8_upper(fragment.to_table(columns=["vin"])["vin"]), value_set=keys)).as_py()]
+
+    tmp_dir = f"{output_dir}.tmp"
+    price_dtype = write_dataset(upserts, tmp_dir, unique_basename("merge"), price_dtype=price_dtype)
+    # the upserts may have float64 prices, the rewritten files are read after the output is widened
+    match_output_dtypes(output_dir, price_dtype)
+    emptied = []
+    for path in touched:
+        # the file only, its partition column is in the path
+        table = pq.ParquetFile(path).read()
+        table = table.filter(pc.invert(pc.is_in(pc.utf8_upper(table["vin"]), value_set=keys)))
+        if not table.num_rows:
+            emptied.append(path)
+            continue
+        target = os.path.join(tmp_dir, os.path.relpath(path, output_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        pq.write_table(table, target, compression="zstd")
+    move_files(tmp_dir, output_dir)
+    for path in emptied:
+        os.remove(path)
+    print(f"Rewrote {len(touched)} of {len(dataset.files)} files")
+
+def write_csv(chunks, output_file):
+    # Write next to the output and rename, readers never see a half written file
+    tmp_file = f"{output_file}.tmp"
+    header = True
+    for df in chunks:
+        df.to_csv(tmp_file, index=False, mode="w" if header else "a", header=header)
+        header = False
+    if header:
+        # no chunk at all, still write an output with the header
+        pd.DataFrame(columns=COLUMNS).to_csv(tmp_file, index=False)
+    os.replace(tmp_file, output_file)
+
+def load_chunks(chunks, output_file, price_dtype=PRICE_DTYPE):
+    """Write the DataFrames one after the other into the output, without holding them all in memory."""
     print(f"Saving cleaned data to {output_file}...")
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    df.to_csv(output_file, index=False)
+    if is_parquet(output_file):
+        write_parquet(chunks, output_file, price_dtype)
+    else:
+        write_csv(chunks, output_file)
     print("Data successfully saved!")
 
+def load_data(df, output_file):
+    load_chunks([df], output_file)
+
+def read_output(output_file, chunk_size=CHUNK_SIZE, price_dtype=PRICE_DTYPE):
+    """Iterate over the current output in DataFrames of at most chunk_size rows."""
+    recover_output(output_file)
+    if not is_parquet(output_file):
+        # VINs can be all digits, keep them as strings. A CSV has no types, so DTYPES are applied
+        # again, prices are read whole and downcast when they fit like when they were cleaned
+        for df in pd.read_csv(output_file, dtype={"vin": str, **DTYPES, "purchase_price": "float64"},
+                              chunksize=chunk_size):
+            downcast_prices(df, price_dtype)
+            yield df
+        return
+    dataset = ds.dataset(output_file, format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(batch_size=chunk_size):
+        # partition values are part of the path, they come back as a category of plain strings
+        yield batch.to_pandas()[COLUMNS].astype({column: "category" for column in PARTITION_COLUMNS})
+
+def output_batches(output_file, chunk_size=CHUNK_SIZE, columns=COLUMNS):
+    """Iterate over `columns` of the current output as Arrow record batches."""
+    recover_output(output_file)
+    if is_parquet(output_file):
+        dataset = ds.dataset(output_file, format="parquet", partitioning="hive")
+        yield from dataset.to_batches(columns=columns, batch_size=chunk_size)
+        return
+    for df in read_output(output_file, chunk_size):
+        # the prices of a CSV chunk are float64 when float32 cannot hold them
+        schema = arrow_schema(str(df["purchase_price"].dtype))
+        yield from record_batches([df[columns]], pa.schema([schema.field(column) for column in columns]))
+
+def encode_dictionary(column, dictionary):
+    # The values of a string or dictionary column as indices into `dictionary`
+    if pa.types.is_dictionary(column.type):
+        indices = pc.index_in(column.dictionary, value_set=dictionary).take(column.indices)
+    else:
+        indices = pc.index_in(column, value_set=dictionary)
+    return pa.DictionaryArray.from_arrays(indices.cast(pa.int32()), dictionary)
+
+def publish_snapshot(output_file, snapshot_file, chunk_size=CHUNK_SIZE):
+    """
+    Copy the output into an uncompressed Arrow IPC file. Readers memory map it and get the
+    columns without parsing or decompressing anything, all of them sharing the page cache.
+    """
+    price_dtype = match_output_dtypes(output_file)
+    categories = [column for column, dtype in DTYPES.items() if dtype == "category"]
+    # An IPC file holds a single dictionary per column, so the values of the categories are
+    # collected first, reading those columns only, and every batch is encoded against them.
+    # A CSV output is read whole anyway, its prices are float64 as soon as one of its chunks has them
+    values = {column: set() for column in categories}
+    columns = categories if is_parquet(output_file) else categories + ["purchase_price"]
+    for batch in output_batches(output_file, chunk_size, columns):
+        if "purchase_price" in batch.schema.names and batch.schema.field("purchase_price").type == pa.float64():
+            price_dtype = "float64"
+        for column in categories:
+            array = batch.column(column)
+            array = array.dictionary if pa.types.is_dictionary(array.type) else pc.unique(array)
+            values[column].update(value for value in array.to_pylist() if value is not None)
+    dictionaries = {column: pa.array(sorted(values[column]), pa.string()) for column in categories}
+    schema = arrow_schema(price_dtype)
+
+    tmp_file = f"{snapshot_file}.tmp"
+    with pa.OSFile(tmp_file, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in output_batches(output_file, chunk_size):
+            writer.write_batch(pa.RecordBatch.from_arrays([
+                encode_dictionary(batch.column(field.name), dictionaries[field.name])
+                if field.name in dictionaries else batch.column(field.name).cast(field.type)
+                for field in schema], schema=schema))
+    # Readers that still map the previous file keep it until they unmap it
+    os.replace(tmp_file, snapshot_file)
+    print(f"Published the Arrow snapshot {snapshot_file}")
+
+def snapshot_file(output_file, snapshot=None):
+    """The snapshot that mirrors the output: `snapshot` when given, else the default one of the default output."""
+    if snapshot:
+        return snapshot
+    if pa is not None and os.path.abspath(output_file) == os.path.abspath(OUTPUT_FILE):
+        return SNAPSHOT_FILE
+    return None
+
+def discard_snapshot(snapshot_file):
+    # Before the output changes: until a new one is published readers load the output itself, not an older copy
+    if snapshot_file and os.path.exists(snapshot_file):
+        os.remove(snapshot_file)
+        print(f"Removed the snapshot {snapshot_file}, it is published again after the run")
+
+def read_output_vins(output_file, chunk_size=CHUNK_SIZE):
+    """Iterate over the VIN column of the current output only, as Series of at most chunk_size VINs."""
+    recover_output(output_file)
+    if not is_parquet(output_file):
+        for df in pd.read_csv(output_file, usecols=["vin"], dtype={"vin": str}, chunksize=chunk_size):
+            yield df["vin"]
+        return
+    dataset = ds.dataset(output_file, format="parquet", partitioning="hive")
+    for batch in dataset.to_batches(columns=["vin"], batch_size=chunk_size):
+        yield batch.to_pandas()["vin"]
+
+def collect_vin_keys(chunks, keys):
+    # Pass the chunks through, appending vin_keys() of every chunk to `keys`
+    for df in chunks:
+        keys.append(vin_keys(df["vin"]))
+        yield df
+
+def new_vin_index(vin_index):
+    # An empty index next to `vin_index`, filled while the output is rewritten and swapped in after
+    path = f"{vin_index.path}.new"
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    return VinIndex(path, vin_index.bloom_bits_per_key)
+
+def rebuild_vin_index(vin_index, output_file, chunk_size=CHUNK_SIZE):
+    """Make the index hold the VINs of the output again, read back from it, a chunk at a time."""
+    print(f"Rebuilding the VIN index from {output_file}")
+    rebuilt = new_vin_index(vin_index)
+    for vins in read_output_vins(output_file, chunk_size):
+        rebuilt.add(vin_keys(vins))
+    vin_index.replace(rebuilt, output_fingerprint(output_file))
+
+def update_vin_index(vin_index, output_file, changes, written_keys):
+    """Apply a merge to the index: the upserts written are added, the other changed VINs removed."""
+    written = np.concatenate(written_keys) if written_keys else vin_keys([])
+    # deleted, or no longer valid once cleaned
+    changed = vin_keys(changes)
+    vin_index.update(add=written, remove=changed[~np.isin(changed, written)],
+                     fingerprint=output_fingerprint(output_file))
+
+def read_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+def write_state(state_file, state):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, state_file)
+
+def fetch_changes(changes_url, since, limit=CHANGES_PAGE_SIZE):
+    """One page of GET /vehicle/changes after `since`."""
+    response = get_with_backoff(changes_url, {"since": since, "limit": limit})
+    if response.status_code == 410:
+        raise ResyncRequired(response.json().get("error"))
+    response.raise_for_status()
+    return response.json()
+
+def get_latest_seq(changes_url):
+    # Also answered with a 410, which carries latest_seq as well
+    response = get_with_backoff(changes_url, {"since": 0, "limit": 1})
+    if response.status_code not in (200, 410):
+        response.raise_for_status()
+    return response.json()["latest_seq"]
+
+def fetch_database_changes(database, since, limit=CHANGES_PAGE_SIZE):
+    """The page GET /vehicle/changes would answer, read from the vehicle_changes table of the database."""
+    db = api_db()
+    connection = connect_read_only(database)
+    try:
+        pruned_seq = db.get_pruned_change_seq(connection)
+        if since < pruned_seq:
+            raise ResyncRequired(f"Changes up to seq {pruned_seq} were pruned, a full resync is required")
+        latest_seq = db.get_latest_change_seq(connection)
+        # One more row than requested tells whether there is another page
+        rows = connection.execute("SELECT seq, vin, operation, vehicle, changed_at FROM vehicle_changes "
+                                  "WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit + 1)).fetchall()
+    finally:
+        connection.close()
+    changes = [{"seq": seq, "vin": vin, "operation": operation, "changed_at": changed_at,
+                "vehicle": json.loads(vehicle) if vehicle is not None else None}
+               for seq, vin, operation, vehicle, changed_at in rows[:limit]]
+    return {"changes": changes, "next_since": changes[-1]["seq"] if changes else since,
+            "has_more": len(rows) > limit, "latest_seq": latest_seq}
+
+def get_database_latest_seq(database):
+    connection = connect_read_only(database)
+    try:
+        return api_db().get_latest_change_seq(connection)
+    finally:
+        connection.close()
+
+def stage_changes(changes_url, state, state_file, staging_file, database=None):
+    """
+    Append the changes after the watermark to the staging file, page by page, from the API or
+    from the change log of `database`. The state records how far the staging file goes after
+    every page, so an interrupted run resumes from there instead of from the watermark.
+    """
+    since = state.get("fetched_until", state["since"])
+    os.makedirs(os.path.dirname(staging_file), exist_ok=True)
+    while True:
+        page = fetch_database_changes(database, since) if database else fetch_changes(changes_url, since)
+        with open(staging_file, "a") as f:
+            for change in page["changes"]:
+                f.write(json.dumps(change) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        since = page["next_since"]
+        write_state(state_file, {**state, "fetched_until": since})
+        print(f"Staged changes up to seq {since} of {page['latest_seq']}")
+        if not page["has_more"]:
+            return since
+
+def read_staged_changes(staging_file):
+    """Latest staged change of every VIN, keyed by the upper case VIN like the NOCASE column."""
+    changes = {}
+    if not os.path.exists(staging_file):
+        return changes
+    with open(staging_file) as f:
+        for line in f:
+            change = json.loads(line)
+            key = change["vin"].upper()
+            # a page staged twice after a crash holds the same seqs again, the highest seq wins
+            if key not in changes or change["seq"] > changes[key]["seq"]:
+                changes[key] = change
+    return changes
+
+def upserted_vehicles(changes):
+    deleted = sum(change["operation"] == "delete" for change in changes.values())
+    print(f"Applying {len(changes)} changes, {deleted} of them deletes")
+    return (change["vehicle"] for change in changes.values() if change["operation"] != "delete")
+
+def apply_changes(output_file, changes, upserts, price_dtype=PRICE_DTYPE):
+    """
+    Yield the output with every changed VIN dropped, chunk by chunk, followed by `upserts`, the
+    cleaned current version of the changed vehicles that were not deleted. A CSV output is a
+    single file, this is how it is merged: read and rewritten whole.
+    """
+    for df in read_output(output_file, price_dtype=price_dtype):
+        yield df[~df["vin"].str.upper().isin(changes.keys())]
+    yield from upserts
+
+def load_all(extract, output_file, chunk_size=CHUNK_SIZE, workers=1, vin_index=None, price_dtype=PRICE_DTYPE):
+    """
+    Extract, clean and write every vehicle. The VINs kept by the dedup go to a new index, which
+    replaces `vin_index` once the output is written.
+    """
+    seen_vins = new_vin_index(vin_index) if vin_index is not None else None
+    load_chunks(transform_chunks(extract(), chunk_size, seen_vins, workers, price_dtype), output_file, price_dtype)
+    if vin_index is not None:
+        vin_index.replace(seen_vins, output_fingerprint(output_file))
+
+def run_full(extract, changes_url, output_file, state_file, staging_file, chunk_size=CHUNK_SIZE, workers=1,
+             vin_index=None, database=None, price_dtype=PRICE_DTYPE):
+    """
+    Extract, clean and write every vehicle. `extract` is called without arguments and yields the records.
+    The watermark is read from the change log of `database` when given, from the API otherwise.
+    Prices are written as `price_dtype`, or float64 when that type cannot keep them to the cent.
+    """
+    # Read the watermark first, changes made during the extraction are applied again by the next run
+    latest_seq = get_database_latest_seq(database) if database else get_latest_seq(changes_url)
+    load_all(extract, output_file, chunk_size, workers, vin_index, price_dtype)
+    if os.path.exists(staging_file):
+        os.remove(staging_file)
+    write_state(state_file, {"since": latest_seq})
+
+def run_incremental(extract, changes_url, output_file, state_file, staging_file, chunk_size=CHUNK_SIZE, workers=1,
+                    vin_index=None, database=None, price_dtype=PRICE_DTYPE):
+    """
+    Apply the changes made since the last run to the output instead of extracting everything. They
+    are read from the change log of `database` when given, through GET /vehicle/changes otherwise.
+    A Parquet output only has the files holding a changed vehicle rewritten, see merge_parquet().
+    Falls back to a full run when there is no watermark or output yet, or when the change log no
+    longer goes back to the watermark.
+    """
+    state = read_state(state_file)
+    recover_output(output_file)
+    if "since" not in state or not os.path.exists(output_file):
+        print("No previous run to continue from, running a full extraction")
+        return run_full(extract, changes_url, output_file, state_file, staging_file, chunk_size, workers, vin_index,
+                        database, price_dtype)
+    if "fetched_until" in state:
+        print(f"Resuming the interrupted run from seq {state['fetched_until']}")
+
+    try:
+        fetched_until = stage_changes(changes_url, state, state_file, staging_file, database)
+    except ResyncRequired as e:
+        print(f"{e}, running a full extraction")
+        return run_full(extract, changes_url, output_file, state_file, staging_file, chunk_size, workers, vin_index,
+                        database, price_dtype)
+
+    changes = read_staged_changes(staging_file)
+    if not changes:
+        print("No changes since the last run")
+    else:
+        # Before the output changes: an index that no longer matched it is rebuilt instead of updated
+        index_matches = vin_index is not None and vin_index.fingerprint == output_fingerprint(output_file)
+        written_keys = []
+        upserts = collect_vin_keys(transform_chunks(upserted_vehicles(changes), chunk_size, price_dtype=price_dtype),
+                                   written_keys)
+        if is_parquet(output_file):
+            merge_parquet(output_file, changes, upserts, price_dtype)
+        else:
+            load_chunks(apply_changes(output_file, changes, upserts, price_dtype), output_file, price_dtype)
+        if index_matches:
+            update_vin_index(vin_index, output_file, changes, written_keys)
+        elif vin_index is not None:
+            rebuild_vin_index(vin_index, output_file, chunk_size)
+    # Applying the staged changes again is harmless, so a crash before this point just redoes the merge
+    write_state(state_file, {"since": fetched_until})
+    if os.path.exists(staging_file):
+        os.remove(staging_file)
+
+def run_append(extract, output_file, vin_index, chunk_size=CHUNK_SIZE, workers=1, price_dtype=PRICE_DTYPE):
+    """
+    Merge the extracted vehicles into the output: the ones whose VIN is already there, whatever
+    its case, are skipped, and the others are added as new Parquet files. The existing output is
+    not read: the VIN index is the dedup's set of VINs already seen, so the VINs of the output
+    are dropped like duplicates, in time proportional to the batch, not to the history.
+    """
+    recover_output(output_file)
+    if not os.path.exists(output_file):
+        print("No output to append to yet, writing a new one")
+        return load_all(extract, output_file, chunk_size, workers, vin_index, price_dtype)
+    if vin_index.fingerprint != output_fingerprint(output_file):
+        # Written by a run without the index, or interrupted between the output and the index
+        rebuild_vin_index(vin_index, output_file, chunk_size)
+
+    appended = 0
+
+    def new_vehicles():
+        nonlocal appended
+        # The index takes the new VINs as they are kept, with no fingerprint until the files are
+        # moved in: after an interruption the next run rebuilds it from the output
+        for df in transform_chunks(extract(), chunk_size, vin_index, workers, price_dtype):
+            appended += len(df)
+            yield df
+
+    print(f"Appending to {output_file}...")
+    append_parquet(new_vehicles(), output_file, price_dtype)
+    print(f"Appended {appended} vehicles whose VIN was not in the output yet")
+    vin_index.add(vin_keys([]), output_fingerprint(output_file))
+
 if __name__ == "__main__":
-    # Extract
-    API_URL = "http://127.0.0.1:5000/vehicle"
-    OUTPUT_FILE = "Data-Storage/processed/vehicles_cleaned.csv"
-    raw_data = extract_data(API_URL)
-    if raw_data: 
-        cleaned_data = transform_data(raw_data)
-        load_data(cleaned_data, OUTPUT_FILE)
+    parser = argparse.ArgumentParser(description="Extract the vehicles from the API, clean them and save them")
+    parser.add_argument("--mode", choices=["full", "incremental", "append"], default="incremental",
+                        help="incremental applies the changes since the last run, it falls back to full when needed. "
+                             "append adds the vehicles whose VIN is not in the output yet")
+    parser.add_argument("--api-url", default="http://127.0.0.1:5000/vehicle")
+    parser.add_argument("--source", choices=["api", "database"], default="api",
+                        help="read the vehicles and the changes of incremental runs through the API, "
+                             "or straight from its SQLite file, then the run needs no API")
+    parser.add_argument("--database", help="SQLite file of the database source, the one of app.db by default")
+    parser.add_argument("--output", default=OUTPUT_FILE if pa is not None else CSV_OUTPUT_FILE,
+                        help="a .parquet directory partitioned by manufacturer_name, or a .csv file")
+    parser.add_argument("--snapshot",
+                        help="Arrow IPC copy of the output published after every run, for the analytics and the model. "
+                             "Data-Storage/processed/vehicles_cleaned.arrow for the default output, none for another one")
+    parser.add_argument("--no-snapshot", dest="publish_snapshot", action="store_false",
+                        help="do not publish the snapshot, the previous one is removed as it no longer matches the output")
+    parser.add_argument("--state", default=STATE_FILE, help="watermark and checkpoint file of incremental runs")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="rows cleaned and written at a time, bounds the peak memory")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes cleaning the chunks of a full extraction, in parallel with the extraction itself")
+    parser.add_argument("--vin-index", default=VIN_INDEX_DIR, help="directory of the index of the VINs in the output")
+    parser.add_argument("--bloom-bits-per-key", type=int, default=BLOOM_BITS_PER_KEY,
+                        help="size of the Bloom filters in front of the VIN index, 0 (the default) disables them")
+    parser.add_argument("--price-dtype", choices=["float32", "float64"], default=PRICE_DTYPE,
+                        help="float32 halves the memory of the prices, a run with a price it cannot keep to the cent uses float64")
+    args = parser.parse_args()
+    if args.mode == "append" and not is_parquet(args.output):
+        parser.error("--mode append writes new files into a .parquet output")
+
+    changes_url = f"{args.api_url.rstrip('/')}/changes"
+    staging_file = os.path.join(os.path.dirname(args.state), os.path.basename(STAGING_FILE))
+    vin_index = VinIndex(args.vin_index, args.bloom_bits_per_key)
+    snapshot = snapshot_file(args.output, args.snapshot)
+    discard_snapshot(snapshot)
+    if args.source == "database":
+        # the database also holds the change log, the run needs no API
+        database = args.database or default_database_path()
+        extract = partial(extract_from_database, database)
+    else:
+        database = None
+        extract = partial(extract_data, args.api_url)
+    try:
+        if args.mode == "append":
+            run_append(extract, args.output, vin_index, args.chunk_size, args.workers, args.price_dtype)
+        else:
+            run = run_full if args.mode == "full" else run_incremental
+            run(extract, changes_url, args.output, args.state, staging_file, args.chunk_size, args.workers, vin_index,
+                database, args.price_dtype)
+    except requests.RequestException as e:
+        # The output, the index and the state are only replaced after a complete extraction
+        sys.exit(f"Failed to fetch data from API: {e}")
+    except sqlite3.Error as e:
+        sys.exit(f"Failed to read the database {database}: {e}")
+    if snapshot and args.publish_snapshot:
+        publish_snapshot(args.output, snapshot, args.chunk_size)
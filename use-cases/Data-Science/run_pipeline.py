@@ -0,0 +1,207 @@
+"""
+Run the data science scripts as one pipeline: extract_transform_load.py, then analytics.py and
+predict_purchase_price.py in parallel, as both only read the ETL output.
+
+Every stage declares its code, inputs and outputs. A stage's cache key is a hash of its command,
+code and the content of its inputs; when a run with the same key is in the cache its outputs are
+restored and its saved output printed instead of running it. Editing analytics.py only reruns
+the analytics, and a new ETL output with the same content does not retrain the model.
+
+    python run_pipeline.py                        # ETL through the API, which always runs
+    python run_pipeline.py --source database      # no API needed, the ETL is cached while the database is unchanged
+    python run_pipeline.py --force model
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from extract_transform_load import (API_SERVER_DIR, CSV_OUTPUT_FILE, OUTPUT_FILE, SNAPSHOT_FILE, STATE_FILE,
+                                    VIN_INDEX_DIR, default_database_path, pa)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# The ETL imports the database path and the change log queries from the API project
+ETL_CODE = ["extract_transform_load.py", "vin_index.py",
+            os.path.relpath(os.path.join(API_SERVER_DIR, "app/db.py"), BASE_DIR)]
+CACHE_DIR = os.path.join(BASE_DIR, "Data-Storage/cache")
+
+def define_stages(args):
+    """The stages, a stage runs after the stages whose outputs are among its inputs."""
+    output = OUTPUT_FILE if pa is not None else CSV_OUTPUT_FILE
+    etl = [sys.executable, "extract_transform_load.py", "--mode", args.etl_mode, "--output", output,
+           "--api-url", args.api_url, "--source", args.source]
+    # What analytics and the model read, see their loading code
+    etl_outputs, read = ([output, SNAPSHOT_FILE], SNAPSHOT_FILE) if pa is not None else ([output], output)
+    # and what the next ETL run starts from, restored with the output or it would not match it
+    etl_outputs += [STATE_FILE, VIN_INDEX_DIR]
+    if args.source == "database":
+        database = args.database or default_database_path()
+        etl += ["--database", database]
+        # the -wal file holds the last commits until they are checkpointed into the database file
+        etl_inputs = [database, f"{database}-wal"]
+    else:
+        # nothing to hash on the other side of the API, the incremental ETL finds out what changed itself
+        etl_inputs = None
+    return [
+        {"name": "etl", "command": etl, "code": ETL_CODE,
+         "inputs": etl_inputs, "outputs": etl_outputs},
+        {"name": "analytics", "command": [sys.executable, "Data-Analytics/analytics.py"],
+         "code": ["Data-Analytics/analytics.py"], "inputs": [read], "outputs": []},
+        {"name": "model", "command": [sys.executable, "AI-Models/predict_purchase_price.py"],
+         "code": ["AI-Models/predict_purchase_price.py"], "inputs": [read], "outputs": []},
+    ]
+
+def hash_path(path):
+    """sha256 of a file, or of the names and contents of the files of a directory, None when missing."""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        files = [(os.path.basename(path), path)]
+    else:
+        files = sorted((os.path.relpath(os.path.join(root, name), path), os.path.join(root, name))
+                       for root, _, names in os.walk(path) for name in names)
+    for name, file_path in files:
+        digest.update(name.encode() + b"\0")
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def stage_key(stage):
+    """The cache key of a stage, None for a stage without declared inputs, which always runs."""
+    if stage["inputs"] is None:
+        return None
+    digest = hashlib.sha256(json.dumps([sys.version, stage["command"]]).encode())
+    for path in stage["code"] + stage["inputs"]:
+        digest.update(f"{path}={hash_path(os.path.join(BASE_DIR, path))}\n".encode())
+    return digest.hexdigest()
+
+def copy_tree(source, target):
+    # Hard links when possible, the ETL never modifies an output file in place, it writes new ones
+    def link(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    if os.path.isdir(source):
+        shutil.copytree(source, target, copy_function=link)
+    else:
+        link(source, target)
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def restore_outputs(stage, entry_dir, manifest):
+    # An output the run did not leave behind (digest None) is removed
+    for i, (path, digest) in enumerate(zip(stage["outputs"], manifest["outputs"])):
+        if hash_path(path) != digest:
+            remove_path(path)
+            if digest is not None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                copy_tree(os.path.join(entry_dir, str(i)), path)
+
+def save_entry(stage, entry_dir, log):
+    """Store the outputs and the log of a successful run under its key."""
+    tmp_dir = f"{entry_dir}.tmp"
+    remove_path(tmp_dir)
+    os.makedirs(tmp_dir)
+    for i, path in enumerate(stage["outputs"]):
+        if os.path.exists(path):
+            copy_tree(path, os.path.join(tmp_dir, str(i)))
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({"outputs": [hash_path(path) for path in stage["outputs"]], "log": log}, f)
+    remove_path(entry_dir)
+    os.replace(tmp_dir, entry_dir)
+
+def run_stage(stage, cache_dir, force):
+    """Run or restore one stage. Returns (status, seconds, log)."""
+    start = time.perf_counter()
+    key = stage_key(stage)
+    entry_dir = os.path.join(cache_dir, stage["name"], key) if key else None
+    if entry_dir and not force and os.path.exists(os.path.join(entry_dir, "manifest.json")):
+        with open(os.path.join(entry_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        restore_outputs(stage, entry_dir, manifest)
+        return "cached", time.perf_counter() - start, manifest["log"]
+
+    result = subprocess.run(stage["command"], cwd=BASE_DIR, capture_output=True, text=True)
+    log = result.stdout + result.stderr
+    if result.returncode != 0:
+        return "failed", time.perf_counter() - start, log
+    if entry_dir:
+        save_entry(stage, entry_dir, log)
+    return "ran", time.perf_counter() - start, log
+
+def run_pipeline(stages, cache_dir=CACHE_DIR, jobs=2, force=()):
+    """
+    Run the stages as soon as the stages they depend on are done, `jobs` at a time. Stages
+    that wait on each other in a cycle fail instead of waiting forever.
+    """
+    producers = {path: stage["name"] for stage in stages for path in stage["outputs"]}
+    # a stage may read what it wrote itself the previous time
+    depends_on = {stage["name"]: {producers[path] for path in stage["inputs"] or [] if path in producers}
+                  - {stage["name"]} for stage in stages}
+    results = {}
+    pending = list(stages)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+        while pending or running:
+            for stage in list(pending):
+                if any(results.get(name, ("",))[0] in ("failed", "skipped") for name in depends_on[stage["name"]]):
+                    results[stage["name"]] = ("skipped", 0.0, "")
+                    pending.remove(stage)
+                elif all(name in results for name in depends_on[stage["name"]]):
+                    running[executor.submit(run_stage, stage, cache_dir, stage["name"] in force)] = stage["name"]
+                    pending.remove(stage)
+            if not running:
+                # nothing runs and nothing could start, the pending stages wait on each other
+                blocked = {stage["name"] for stage in pending}
+                for stage in pending:
+                    waits_on = ", ".join(sorted(depends_on[stage["name"]] & blocked))
+                    results[stage["name"]] = ("failed", 0.0, f"waits on {waits_on}, which cannot run first")
+                    print(f"--- {stage['name']} (failed) ---")
+                    print(results[stage["name"]][2])
+                pending.clear()
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                status, seconds, log = results[name]
+                print(f"--- {name} ({status}) ---")
+                print(log.rstrip())
+    return results
+
+def format_report(stages, results):
+    lines = [f"{'stage':<12} {'status':<8} {'seconds':>8}"]
+    for stage in stages:
+        status, seconds, _ = results[stage["name"]]
+        lines.append(f"{stage['name']:<12} {status:<8} {seconds:>8.2f}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ETL, analytics and model stages, skipping the cached ones")
+    parser.add_argument("--source", choices=["api", "database"], default="api",
+                        help="source of the ETL stage, with database the stage is cached while the database is unchanged")
+    parser.add_argument("--database", help="SQLite file of the database source, the one of app.db by default")
+    parser.add_argument("--api-url", default="http://127.0.0.1:5000/vehicle")
+    parser.add_argument("--etl-mode", choices=["full", "incremental"], default="incremental")
+    parser.add_argument("--jobs", type=int, default=2, help="stages run at the same time")
+    parser.add_argument("--force", nargs="+", default=[], help="stages to run even when they are cached")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+
+    stages = define_stages(args)
+    results = run_pipeline(stages, args.cache_dir, args.jobs, set(args.force))
+    print()
+    print(format_report(stages, results))
+    sys.exit(1 if any(status == "failed" for status, _, _ in results.values()) else 0)
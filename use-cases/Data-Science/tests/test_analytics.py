@@ -0,0 +1,44 @@
+from unittest import TestCase
+import os
+import sys
+import tempfile
+import extract_transform_load as etl
+from tests.test_extract_transform_load import vehicle
+
+sys.path.insert(0, os.path.join(os.path.dirname(etl.__file__), 'Data-Analytics'))
+import analytics  # noqa: E402
+
+
+class TestLoadData(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.tmp.name, 'vehicles_cleaned.csv')
+        self.parquet = os.path.join(self.tmp.name, 'vehicles_cleaned.parquet')
+        self.snapshot = os.path.join(self.tmp.name, 'vehicles_cleaned.arrow')
+        for output in (self.csv, self.parquet):
+            etl.load_chunks(etl.transform_chunks([vehicle(i) for i in range(12)], chunk_size=5), output)
+        etl.publish_snapshot(self.parquet, self.snapshot)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def vins(self, path, filters):
+        df = analytics.load_data(path, columns=['vin', 'purchase_price'], filters=filters)
+        assert list(df.columns) == ['vin', 'purchase_price']
+        return sorted(df['vin'])
+
+    def test_filters_use_their_operator_in_every_format(self):
+        for path in (self.csv, self.parquet, self.snapshot):
+            expected = [vehicle(i)['vin'] for i in range(12) if i % 3 != 1 and i > 4]
+            filters = [('manufacturer_name', '!=', 'Kia'), ('horse_power', '>', 104)]
+            assert self.vins(path, filters) == expected
+            filters = [('manufacturer_name', 'in', ['Honda', 'Ford']), ('horse_power', '>=', 105)]
+            assert self.vins(path, filters) == expected
+            filters = [('manufacturer_name', 'not in', ['Kia']), ('model_year', '==', 2020),
+                       ('purchase_price', '<=', 30000)]
+            assert self.vins(path, filters) == [vehicle(i)['vin'] for i in range(12) if i % 3 != 1]
+
+    def test_unknown_operator_is_refused(self):
+        for path in (self.csv, self.parquet, self.snapshot):
+            with self.assertRaises(ValueError):
+                analytics.load_data(path, filters=[('horse_power', '~', 100)])
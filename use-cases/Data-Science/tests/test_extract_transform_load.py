@@ -0,0 +1,339 @@
+from unittest import TestCase
+from functools import partial
+import logging
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+from unittest import mock
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import requests
+from werkzeug.serving import make_server
+import extract_transform_load as etl
+import vin_index
+
+
+def start_api(database):
+    """Serve the vehicle API of the database on a free port, returns (GET /vehicle url, server)."""
+    etl.default_database_path()  # puts the API project on sys.path
+    from app.server import create_app
+    app = create_app({'TESTING': True, 'DATABASE': database, 'LOG_FILE': None, 'LOG_LEVEL': logging.WARNING,
+                      'RATELIMIT_ENABLED': False})
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}/vehicle', server
+
+
+def vehicle(i, **fields):
+    return {'vin': f'1HGCM82633A{i:06d}', 'manufacturer_name': ['Honda', 'Kia', 'Ford'][i % 3],
+            'description': 'Sedan', 'horse_power': 100 + i, 'model_name': 'Accord', 'model_year': 2020,
+            'purchase_price': 20000.5 + i, 'fuel_type': 'Gasoline', **fields}
+
+
+def dead_url():
+    # nothing listens on the port of a closed socket
+    with socket.socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{closed.getsockname()[1]}/vehicle'
+
+
+class TestTransformChunks(TestCase):
+    def test_duplicates_across_chunks_are_dropped(self):
+        records = [vehicle(i) for i in range(10)] + [vehicle(2, vin=vehicle(2)['vin'].lower()), vehicle(0)]
+        chunks = list(etl.transform_chunks(records, chunk_size=3))
+        assert [vin for df in chunks for vin in df['vin']] == [vehicle(i)['vin'] for i in range(10)]
+
+    def test_large_prices_fall_back_to_float64(self):
+        records = [vehicle(i) for i in range(5)] + [vehicle(5, purchase_price=200000.01)]
+        chunks = list(etl.transform_chunks(records, chunk_size=3))
+        assert [str(df['purchase_price'].dtype) for df in chunks] == ['float32', 'float64']
+        assert chunks[1]['purchase_price'].iloc[-1] == 200000.01
+        # nothing is left behind for the next run
+        assert [str(df['purchase_price'].dtype) for df in etl.transform_chunks(records[:3])] == ['float32']
+        chunks = etl.transform_chunks(records[:3], price_dtype='float64')
+        assert [str(df['purchase_price'].dtype) for df in chunks] == ['float64']
+
+    def test_memory_does_not_grow_with_the_vins_kept(self):
+        def peak_memory(count):
+            # every fourth record repeats a VIN of an earlier chunk
+            records = (vehicle(i % (count * 3 // 4)) for i in range(count))
+            tracemalloc.start()
+            try:
+                kept = sum(len(df) for df in etl.transform_chunks(records, chunk_size=1000))
+                return kept, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        with mock.patch.object(vin_index, 'MERGE_BLOCK', 1000):
+            small, large = peak_memory(8_000), peak_memory(64_000)
+        assert small[0] == 6_000 and large[0] == 48_000
+        # a set of the 48 000 kept VINs alone would take several times the peak of the small run
+        assert large[1] < small[1] * 1.25
+
+
+class TestExtractTransformLoad(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp.name, 'vehicles.db')
+        self.api_url, self.server = start_api(self.database)
+        self.changes_url = f'{self.api_url}/changes'
+        self.output = os.path.join(self.tmp.name, 'vehicles_cleaned.parquet')
+        self.state = os.path.join(self.tmp.name, 'state', 'etl_state.json')
+        self.staging = os.path.join(self.tmp.name, 'state', 'pending_changes.jsonl')
+        self.insert(*(vehicle(i) for i in range(10)))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.tmp.cleanup()
+
+    def insert(self, *vehicles):
+        with sqlite3.connect(self.database) as db:
+            db.executemany('INSERT INTO vehicles VALUES (:vin, :manufacturer_name, :description, :horse_power, '
+                           ':model_name, :model_year, :purchase_price, :fuel_type)', vehicles)
+
+    def execute(self, sql, parameters=()):
+        with sqlite3.connect(self.database) as db:
+            db.execute(sql, parameters)
+
+    def output_vins(self):
+        return sorted(vin for df in etl.read_output(self.output) for vin in df['vin'])
+
+    def run_etl(self, mode='full', extract=None, chunk_size=4, vin_index=None, price_dtype=etl.PRICE_DTYPE):
+        extract = extract or partial(etl.extract_data, self.api_url, per_page=3)
+        if mode == 'append':
+            return etl.run_append(extract, self.output, vin_index, chunk_size, price_dtype=price_dtype)
+        run = etl.run_full if mode == 'full' else etl.run_incremental
+        run(extract, self.changes_url, self.output, self.state, self.staging, chunk_size, vin_index=vin_index,
+            price_dtype=price_dtype)
+
+    def test_full_run(self):
+        self.run_etl()
+        assert self.output_vins() == [vehicle(i)['vin'] for i in range(10)]
+        assert etl.read_state(self.state) == {'since': 10}
+
+    def test_failed_extraction_keeps_the_output(self):
+        self.run_etl()
+        with self.assertRaises(requests.ConnectionError):
+            self.run_etl(extract=partial(etl.extract_data, dead_url()))
+        # GET /vehicle answers 500 while GET /vehicle/changes still works
+        self.execute('ALTER TABLE vehicles RENAME TO vehicles_moved')
+        with self.assertRaises(requests.HTTPError):
+            self.run_etl()
+        assert len(self.output_vins()) == 10
+        assert etl.read_state(self.state) == {'since': 10}
+
+    def test_unreadable_database_keeps_the_output(self):
+        self.run_etl()
+        with self.assertRaises(sqlite3.OperationalError):
+            self.run_etl(extract=partial(etl.extract_from_database, os.path.join(self.tmp.name, 'missing.db')))
+        self.execute('ALTER TABLE vehicles RENAME TO vehicles_moved')
+        with self.assertRaises(sqlite3.OperationalError):
+            self.run_etl(extract=partial(etl.extract_from_database, self.database))
+        assert len(self.output_vins()) == 10
+        assert etl.read_state(self.state) == {'since': 10}
+
+
+    def output_files(self):
+        return {os.path.relpath(os.path.join(root, name), self.output): os.stat(os.path.join(root, name)).st_ino
+                for root, _, names in os.walk(self.output) for name in names}
+
+    def test_incremental_run_applies_the_changes(self):
+        self.run_etl()
+        self.execute('UPDATE vehicles SET purchase_price = 1000 WHERE vin = ?', (vehicle(0)['vin'],))
+        self.execute('DELETE FROM vehicles WHERE vin = ?', (vehicle(3)['vin'],))
+        self.insert(vehicle(12))
+        self.run_etl('incremental')
+        vins = [vehicle(i)['vin'] for i in range(10) if i != 3] + [vehicle(12)['vin']]
+        assert self.output_vins() == sorted(vins)
+        prices = {vin: price for df in etl.read_output(self.output) for vin, price in zip(df['vin'], df['purchase_price'])}
+        assert prices[vehicle(0)['vin']] == 1000
+        assert etl.read_state(self.state) == {'since': 13}
+        assert not os.path.exists(self.staging)
+
+    def test_merge_only_rewrites_the_changed_partition(self):
+        self.run_etl()
+        before = self.output_files()
+        # all Honda
+        self.execute('UPDATE vehicles SET horse_power = 1 WHERE vin = ?', (vehicle(0)['vin'],))
+        self.execute('DELETE FROM vehicles WHERE vin = ?', (vehicle(6)['vin'],))
+        self.run_etl('incremental')
+        after = self.output_files()
+        untouched = {name: inode for name, inode in before.items() if not name.startswith('manufacturer_name=Honda')}
+        assert untouched and all(after.get(name) == inode for name, inode in untouched.items())
+        assert len(self.output_vins()) == 9
+
+    def test_no_changes_keeps_the_output(self):
+        self.run_etl()
+        before = self.output_files()
+        self.run_etl('incremental')
+        assert self.output_files() == before
+        assert etl.read_state(self.state) == {'since': 10}
+
+    def test_interrupted_run_resumes_from_the_staged_changes(self):
+        self.run_etl()
+        self.insert(*(vehicle(i) for i in range(10, 15)))
+        fetch_changes = etl.fetch_changes
+        calls = []
+
+        def fail_on_second_page(changes_url, since):
+            calls.append(since)
+            if len(calls) > 1:
+                raise requests.ConnectionError('lost the API')
+            return fetch_changes(changes_url, since, limit=2)
+
+        with mock.patch.object(etl, 'fetch_changes', fail_on_second_page):
+            with self.assertRaises(requests.ConnectionError):
+                self.run_etl('incremental')
+        assert etl.read_state(self.state) == {'since': 10, 'fetched_until': 12}
+        assert len(self.output_vins()) == 10
+
+        with mock.patch.object(etl, 'fetch_changes', wraps=fetch_changes) as resumed:
+            self.run_etl('incremental')
+        assert resumed.call_args_list[0].args[1] == 12
+        assert self.output_vins() == [vehicle(i)['vin'] for i in range(15)]
+        assert etl.read_state(self.state) == {'since': 15}
+
+    def test_pruned_change_log_falls_back_to_a_full_run(self):
+        self.run_etl()
+        self.insert(vehicle(10))
+        self.execute("UPDATE vehicle_changes SET changed_at = '2000-01-01T00:00:00.000Z'")
+        from app.db import prune_change_log
+        with sqlite3.connect(self.database) as db:
+            assert prune_change_log(db, 1) == 11
+        self.run_etl('incremental')
+        assert self.output_vins() == [vehicle(i)['vin'] for i in range(11)]
+        assert etl.read_state(self.state) == {'since': 11}
+        with self.assertRaises(etl.ResyncRequired):
+            etl.fetch_database_changes(self.database, 10)
+
+    def price_types(self):
+        return {pq.read_schema(path).field('purchase_price').type for path in ds.dataset(self.output).files}
+
+    def prices(self):
+        return {vin: price for df in etl.read_output(self.output) for vin, price in zip(df['vin'], df['purchase_price'])}
+
+    def test_large_price_in_a_later_chunk_widens_the_output(self):
+        self.execute('UPDATE vehicles SET purchase_price = 200000.01 WHERE vin = ?', (vehicle(9)['vin'],))
+        self.run_etl()
+        assert self.price_types() == {pa.float64()}
+        assert self.prices()[vehicle(9)['vin']] == 200000.01
+        assert self.prices()[vehicle(0)['vin']] == 20000.5
+
+    def test_large_price_in_a_merge_widens_the_output(self):
+        self.run_etl()
+        assert self.price_types() == {pa.float32()}
+        self.insert(vehicle(10, purchase_price=200000.01))
+        self.run_etl('incremental')
+        assert self.price_types() == {pa.float64()}
+        assert self.prices()[vehicle(10)['vin']] == 200000.01
+        # a later run in float32 keeps to the output's type
+        self.insert(vehicle(11))
+        self.run_etl('incremental')
+        assert self.price_types() == {pa.float64()}
+        assert len(self.prices()) == 12
+
+    def test_float64_run_widens_the_output(self):
+        self.run_etl()
+        self.insert(vehicle(10))
+        self.run_etl('append', extract=lambda: iter([vehicle(10)]), vin_index=etl.VinIndex(self.tmp.name + '/index'),
+                     price_dtype='float64')
+        assert self.price_types() == {pa.float64()}
+        self.run_etl('full')
+        assert self.price_types() == {pa.float32()}
+
+    def test_large_price_in_a_csv_output_widens_the_snapshot(self):
+        self.output = os.path.join(self.tmp.name, 'vehicles_cleaned.csv')
+        self.execute('UPDATE vehicles SET purchase_price = 200000.01 WHERE vin = ?', (vehicle(9)['vin'],))
+        self.run_etl()
+        snapshot = os.path.join(self.tmp.name, 'vehicles_cleaned.arrow')
+        etl.publish_snapshot(self.output, snapshot, chunk_size=4)
+        table = pa.ipc.open_file(snapshot).read_all()
+        assert table.schema.field('purchase_price').type == pa.float64()
+        assert 200000.01 in table['purchase_price'].to_pylist()
+
+    def assert_index_matches_the_output(self, index):
+        vins = self.output_vins()
+        assert len(index) == len(vins) and index.contains(etl.vin_keys(vins)).all()
+        assert index.fingerprint == etl.output_fingerprint(self.output)
+
+    def test_vin_index_is_updated_in_every_mode(self):
+        index = etl.VinIndex(os.path.join(self.tmp.name, 'state', 'vin_index'))
+        self.run_etl(vin_index=index)
+        self.assert_index_matches_the_output(index)
+        assert not os.path.exists(f'{index.path}.new')
+
+        # from now on the index follows the changes, the output is never read back for it
+        with mock.patch.object(etl, 'rebuild_vin_index', side_effect=AssertionError('rebuilt')):
+            self.execute('DELETE FROM vehicles WHERE vin = ?', (vehicle(4)['vin'],))
+            self.execute('UPDATE vehicles SET horse_power = 1 WHERE vin = ?', (vehicle(5)['vin'],))
+            self.insert(vehicle(10))
+            self.run_etl('incremental', vin_index=index)
+            assert vehicle(4)['vin'] not in index
+            assert vehicle(5)['vin'] in index and vehicle(10)['vin'] in index
+            self.assert_index_matches_the_output(index)
+
+            # the output's VINs, whatever their case, are skipped like duplicates, the deleted one is new again
+            records = [vehicle(1, vin=vehicle(1)['vin'].lower()), vehicle(4), vehicle(11), vehicle(11)]
+            self.run_etl('append', extract=lambda: iter(records), vin_index=index)
+            self.assert_index_matches_the_output(index)
+            assert self.output_vins() == [vehicle(i)['vin'] for i in range(12)]
+
+    def test_vin_index_is_rebuilt_when_it_does_not_match_the_output(self):
+        index = etl.VinIndex(os.path.join(self.tmp.name, 'state', 'vin_index'))
+        self.run_etl()
+        self.run_etl('append', extract=lambda: iter([vehicle(3), vehicle(12)]), vin_index=index)
+        self.assert_index_matches_the_output(index)
+        assert len(self.output_vins()) == 11
+        # an append interrupted before its files were moved in
+        with mock.patch.object(etl, 'move_files', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.run_etl('append', extract=lambda: iter([vehicle(13)]), vin_index=index)
+        assert vehicle(13)['vin'] in index and index.fingerprint is None
+        self.run_etl('append', extract=lambda: iter([vehicle(13)]), vin_index=index)
+        assert vehicle(13)['vin'] in self.output_vins()
+        self.assert_index_matches_the_output(index)
+
+    def run_script(self, *arguments, api_url=None):
+        subprocess.run([sys.executable, 'extract_transform_load.py', '--api-url', api_url or self.api_url,
+                        '--output', self.output, '--state', self.state,
+                        '--vin-index', os.path.join(self.tmp.name, 'state', 'vin_index'),
+                        *arguments], cwd=os.path.dirname(etl.__file__), check=True, capture_output=True)
+
+    def test_database_source_needs_no_api(self):
+        arguments = ['--source', 'database', '--database', self.database, '--no-snapshot']
+        self.execute("DELETE FROM vehicles WHERE vin = ?", (vehicle(9)['vin'],))
+        self.run_script('--mode', 'full', *arguments, api_url=dead_url())
+        assert self.output_vins() == [vehicle(i)['vin'] for i in range(9)]
+        assert etl.read_state(self.state) == {'since': 11}
+        self.insert(vehicle(10))
+        self.execute("UPDATE vehicles SET horse_power = 1 WHERE vin = ?", (vehicle(0)['vin'],))
+        self.run_script('--mode', 'incremental', *arguments, api_url=dead_url())
+        assert self.output_vins() == [vehicle(i)['vin'] for i in range(11) if i != 9]
+        assert etl.read_state(self.state) == {'since': 13}
+
+    def test_database_change_log_pages_match_the_api(self):
+        self.insert(*(vehicle(i) for i in range(10, 15)))
+        self.execute("DELETE FROM vehicles WHERE vin = ?", (vehicle(3)['vin'],))
+        for since in (0, 7, 14, 16):
+            assert etl.fetch_database_changes(self.database, since, limit=4) == etl.fetch_changes(
+                self.changes_url, since, limit=4)
+
+    def test_snapshot_is_removed_when_it_is_not_published(self):
+        snapshot = os.path.join(self.tmp.name, 'vehicles_cleaned.arrow')
+        self.run_script('--snapshot', snapshot)
+        assert pa.ipc.open_file(snapshot).read_all().num_rows == 10
+        self.insert(vehicle(10))
+        self.run_script('--snapshot', snapshot, '--no-snapshot')
+        assert not os.path.exists(snapshot)
+        assert len(self.output_vins()) == 11
+
+    def test_only_the_default_output_has_the_default_snapshot(self):
+        assert etl.snapshot_file(etl.OUTPUT_FILE) == etl.SNAPSHOT_FILE
+        assert etl.snapshot_file(self.output) is None
+        assert etl.snapshot_file(self.output, 'other.arrow') == 'other.arrow'
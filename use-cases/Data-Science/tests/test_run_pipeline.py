@@ -0,0 +1,102 @@
+from unittest import TestCase
+from argparse import Namespace
+import os
+import sys
+import tempfile
+import threading
+import run_pipeline
+from extract_transform_load import STATE_FILE, VIN_INDEX_DIR
+
+# Copies its first file argument to the second, a directory gets a copy in part-0
+COPY = '''
+import os, shutil, sys
+source, target = sys.argv[1:]
+if target.endswith(".dir"):
+    os.makedirs(target, exist_ok=True)
+    target = os.path.join(target, "part-0")
+shutil.copyfile(source, target)
+'''
+
+
+class TestRunPipeline(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.script = self.path('copy.py')
+        self.write('copy.py', COPY)
+        self.write('input.txt', 'vehicles')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write(self, name, content):
+        with open(self.path(name), 'w') as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def stage(self, name, source, target, inputs=None):
+        return {'name': name, 'command': [sys.executable, self.script, self.path(source), self.path(target)],
+                'code': [self.script], 'inputs': [self.path(source)] if inputs is None else inputs,
+                'outputs': [self.path(target)]}
+
+    def run_stages(self, stages, force=()):
+        return {name: status for name, (status, _, _) in
+                run_pipeline.run_pipeline(stages, self.cache_dir, jobs=2, force=set(force)).items()}
+
+    def test_stages_are_cached_on_their_inputs(self):
+        stages = [self.stage('etl', 'input.txt', 'output.dir'),
+                  self.stage('analytics', 'output.dir/part-0', 'report.txt', inputs=[self.path('output.dir')])]
+        assert self.run_stages(stages) == {'etl': 'ran', 'analytics': 'ran'}
+        assert self.read('report.txt') == 'vehicles'
+        assert self.run_stages(stages) == {'etl': 'cached', 'analytics': 'cached'}
+        assert self.run_stages(stages, force=['analytics']) == {'etl': 'cached', 'analytics': 'ran'}
+        self.write('input.txt', 'more vehicles')
+        assert self.run_stages(stages) == {'etl': 'ran', 'analytics': 'ran'}
+        assert self.read('report.txt') == 'more vehicles'
+
+    def test_cache_hit_restores_the_outputs(self):
+        stages = [self.stage('etl', 'input.txt', 'output.dir')]
+        self.run_stages(stages)
+        run_pipeline.remove_path(self.path('output.dir'))
+        assert self.run_stages(stages) == {'etl': 'cached'}
+        assert self.read('output.dir/part-0') == 'vehicles'
+
+    def test_failed_stage_skips_the_stages_after_it(self):
+        stages = [self.stage('etl', 'missing.txt', 'output.dir'),
+                  self.stage('analytics', 'output.dir/part-0', 'report.txt', inputs=[self.path('output.dir')]),
+                  self.stage('other', 'input.txt', 'other.txt')]
+        assert self.run_stages(stages) == {'etl': 'failed', 'analytics': 'skipped', 'other': 'ran'}
+
+    def test_stages_waiting_on_each_other_fail(self):
+        stages = [self.stage('a', 'b.txt', 'a.txt'), self.stage('b', 'a.txt', 'b.txt'),
+                  self.stage('c', 'b.txt', 'c.txt'), self.stage('other', 'input.txt', 'other.txt')]
+        results = {}
+        thread = threading.Thread(target=lambda: results.update(self.run_stages(stages)), daemon=True)
+        thread.start()
+        thread.join(timeout=30)
+        assert not thread.is_alive()
+        assert results == {'other': 'ran', 'a': 'failed', 'b': 'failed', 'c': 'failed'}
+
+    def test_stage_may_read_its_own_output(self):
+        # like the ETL reading its previous state
+        stages = [self.stage('etl', 'input.txt', 'state.txt', inputs=[self.path('input.txt'), self.path('state.txt')])]
+        assert self.run_stages(stages) == {'etl': 'ran'}
+        # the state it left is part of the key of the next run
+        assert self.run_stages(stages) == {'etl': 'ran'}
+        assert self.run_stages(stages) == {'etl': 'cached'}
+
+    def test_etl_stage_restores_its_state_and_vin_index(self):
+        args = Namespace(etl_mode='incremental', api_url='http://127.0.0.1:5000/vehicle', source='database',
+                         database=self.path('vehicles.db'))
+        etl, analytics, model = run_pipeline.define_stages(args)
+        assert STATE_FILE in etl['outputs'] and VIN_INDEX_DIR in etl['outputs']
+        assert os.path.isfile(os.path.join(run_pipeline.BASE_DIR, etl['code'][-1]))
+        assert os.path.basename(etl['code'][-1]) == 'db.py'
+        assert etl['inputs'] == [self.path('vehicles.db'), self.path('vehicles.db-wal')]
+        assert analytics['inputs'] == model['inputs'] and analytics['inputs'][0] in etl['outputs']
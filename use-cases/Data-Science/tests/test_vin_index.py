@@ -0,0 +1,105 @@
+from unittest import TestCase, mock
+import os
+import tempfile
+import numpy as np
+import vin_index
+from vin_index import VinIndex, vin_keys
+
+
+def vins(numbers):
+    return [f'1HGCM82633A{i:06d}' for i in numbers]
+
+
+class TestVinIndex(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'vin_index')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def members(self, index, numbers):
+        return [int(vin[-6:]) for vin, found in zip(vins(numbers), index.contains(vin_keys(vins(numbers)))) if found]
+
+    def test_segments_are_merged(self):
+        index = VinIndex(self.path)
+        for start in range(0, 1000, 10):
+            index.add(vin_keys(vins(range(start, start + 10))))
+        assert len(index) == 1000
+        # every segment is more than twice the size of the next one, O(log n) of them
+        counts = [segment['count'] for segment in index.manifest['segments']]
+        assert sum(counts) == 1000 and all(older > 2 * newer for older, newer in zip(counts, counts[1:]))
+        assert self.members(VinIndex(self.path), range(990, 1010)) == list(range(990, 1000))
+        # the merged segments' files are gone
+        assert len(os.listdir(self.path)) == len(counts) + 1
+
+    def test_merges_do_not_load_the_segments(self):
+        with mock.patch.object(vin_index, 'MERGE_BLOCK', 7):
+            index = VinIndex(self.path)
+            # interleaved batches, every block of a merge takes keys of both segments
+            for start in range(8):
+                index.add(vin_keys(vins(range(start, 200, 8))))
+            keys = np.load(os.path.join(self.path, index.manifest['segments'][0]['keys']))
+        assert index.manifest['segments'][0]['count'] == 200
+        assert list(keys) == sorted(set(keys))
+        assert self.members(index, range(400)) == list(range(200))
+
+    def test_lookups_ignore_case(self):
+        index = VinIndex(self.path)
+        index.add(vin_keys(['1hgcm82633a000001']))
+        assert '1HGCM82633A000001' in index
+        assert '1HgCm82633A000001' in index
+        assert '1HGCM82633A000002' not in index
+        index.add(vin_keys(['1HGCM82633A000001']))
+        assert len(index) == 1
+
+    def test_removed_vins_are_tombstoned(self):
+        index = VinIndex(self.path)
+        index.add(vin_keys(vins(range(100))))
+        index.remove(vin_keys(vins(range(0, 100, 2)) + vins([500])))
+        assert len(index) == 50
+        assert self.members(index, range(6)) == [1, 3, 5]
+        index.update(add=vin_keys(vins([0, 500])), remove=vin_keys(vins([1])))
+        assert len(index) == 51
+        assert self.members(index, range(6)) == [0, 3, 5]
+        assert '1HGCM82633A000500' in index
+        # enough updates for the merges to reach the oldest segment, where no tombstone is kept
+        for i in range(100, 300):
+            index.add(vin_keys(vins([i])))
+        assert len(index) == 251
+        assert self.members(VinIndex(self.path), range(6)) == [0, 3, 5]
+        oldest = index.manifest['segments'][0]
+        assert 'deleted' not in oldest and oldest['count'] >= 51
+
+    def test_bloom_filters_give_the_same_answers(self):
+        plain = VinIndex(os.path.join(self.tmp.name, 'plain'))
+        bloom = VinIndex(self.path, bloom_bits_per_key=10)
+        for index in (plain, bloom):
+            for start in range(0, 300, 30):
+                index.add(vin_keys(vins(range(start, start + 30))))
+            index.remove(vin_keys(vins(range(0, 300, 3))))
+        assert all(segment.get('bloom') for segment in bloom.manifest['segments'])
+        assert self.members(bloom, range(600)) == self.members(plain, range(600))
+        assert self.members(VinIndex(self.path, bloom_bits_per_key=10), range(600)) == self.members(plain, range(600))
+
+    def test_interrupted_update_keeps_the_previous_index(self):
+        index = VinIndex(self.path)
+        index.add(vin_keys(vins(range(10))), fingerprint=[['part-0.parquet', 100]])
+        with mock.patch.object(VinIndex, 'write_manifest', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                index.update(add=vin_keys(vins(range(10, 20))), remove=vin_keys(vins([0])))
+        reopened = VinIndex(self.path)
+        assert len(reopened) == 10
+        assert self.members(reopened, range(20)) == list(range(10))
+        assert reopened.fingerprint == [['part-0.parquet', 100]]
+
+    def test_replace_takes_over_the_other_index(self):
+        index = VinIndex(self.path)
+        index.add(vin_keys(vins(range(10))))
+        other = VinIndex(os.path.join(self.tmp.name, 'vin_index.new'))
+        other.add(vin_keys(vins(range(5, 15))))
+        index.replace(other, fingerprint=[['vehicles.csv', 1, 2]])
+        assert not os.path.exists(other.path)
+        assert self.members(VinIndex(self.path), range(20)) == list(range(5, 15))
+        assert index.fingerprint == [['vehicles.csv', 1, 2]]
+        assert len(os.listdir(self.path)) == 2
@@ -0,0 +1,282 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+# Bits of Bloom filter per VIN, 10 gives about 1% of false positives. Off by default: with the
+# segments in the page cache the binary searches are faster than hashing the batch, the filters
+# pay off when the segments are cold, on slow or remote storage
+BLOOM_BITS_PER_KEY = 0
+
+# Keys merged at a time, merging two segments does not load them in memory
+MERGE_BLOCK = 1 << 16
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+def vin_keys(vins):
+    """
+    The index keys of a sequence of VINs: upper case UTF-8 bytes in a fixed width numpy array,
+    so the index matches VINs case-insensitively like the NOCASE collation of the database.
+    """
+    keys = np.array([str(vin).upper().encode() for vin in vins], dtype=bytes)
+    return keys if len(keys) else np.array([], dtype="S1")
+
+def hash_keys(keys):
+    # FNV-1a over the bytes of every key at once. The zero padding of the fixed width is skipped,
+    # a key hashes the same in arrays of any width
+    data = keys.view(np.uint8).reshape(len(keys), keys.dtype.itemsize)
+    hashes = np.full(len(keys), FNV_OFFSET)
+    with np.errstate(over="ignore"):
+        for column in data.T:
+            byte = column.astype(np.uint64)
+            hashes = np.where(column != 0, (hashes ^ byte) * FNV_PRIME, hashes)
+    return hashes
+
+def bloom_positions(hashes, bits, hash_count):
+    # Double hashing, the two halves of the 64 bit hash give every probe of a key
+    first, second = hashes & np.uint64(0xffffffff), hashes >> np.uint64(32)
+    return [(first + np.uint64(i) * second) % np.uint64(bits) for i in range(hash_count)]
+
+def build_bloom(arrays, bits_per_key):
+    # whole bytes, bloom_contains() takes the number of bits from the saved array
+    bits = (max(sum(len(keys) for keys in arrays) * bits_per_key, 64) + 7) // 8 * 8
+    hash_count = max(1, round(bits_per_key * 0.69))
+    bloom = np.zeros(bits // 8, dtype=np.uint8)
+    for keys in arrays:
+        for start in range(0, len(keys), MERGE_BLOCK):
+            for positions in bloom_positions(hash_keys(keys[start:start + MERGE_BLOCK]), bits, hash_count):
+                np.bitwise_or.at(bloom, positions // np.uint64(8),
+                                 np.left_shift(1, positions % np.uint64(8)).astype(np.uint8))
+    return bloom, hash_count
+
+def bloom_contains(bloom, hash_count, hashes):
+    bits = len(bloom) * 8
+    found = np.ones(len(hashes), dtype=bool)
+    for positions in bloom_positions(hashes, bits, hash_count):
+        found &= (bloom[positions // np.uint64(8)] >> (positions % np.uint64(8)).astype(np.uint8)) & 1 == 1
+    return found
+
+def in_sorted(sorted_keys, keys):
+    """Boolean array, True for the `keys` found in the sorted array `sorted_keys`."""
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.searchsorted(sorted_keys, keys)
+    return sorted_keys[np.minimum(positions, len(sorted_keys) - 1)] == keys
+
+def merge_blocks(older, newer, drop):
+    """
+    Sorted blocks of about MERGE_BLOCK keys of the union of the sorted arrays `older`, without
+    the keys of `drop`, and `newer`, which have no key in common.
+    """
+    i = j = 0
+    while i < len(older) or j < len(newer):
+        a, b = older[i:i + MERGE_BLOCK], newer[j:j + MERGE_BLOCK]
+        if len(a) and len(b):
+            # up to the smaller last key, the keys after it may sort after keys of the next blocks
+            last = min(a[-1], b[-1])
+            a, b = a[:np.searchsorted(a, last, "right")], b[:np.searchsorted(b, last, "right")]
+        i, j = i + len(a), j + len(b)
+        yield np.sort(np.concatenate([a[~in_sorted(drop, a)], b]))
+
+def write_merged(path, older, newer, drop):
+    """Write merge_blocks() to a new .npy file a block at a time, returns it memory mapped."""
+    dropped = sum(int(in_sorted(older, drop[start:start + MERGE_BLOCK]).sum())
+                  for start in range(0, len(drop), MERGE_BLOCK))
+    width = max(older.dtype.itemsize, newer.dtype.itemsize)
+    merged = np.lib.format.open_memmap(path, mode="w+", dtype=f"S{width}",
+                                       shape=(len(older) + len(newer) - dropped,))
+    position = 0
+    for block in merge_blocks(older, newer, drop):
+        merged[position:position + len(block)] = block
+        position += len(block)
+    merged.flush()
+    return merged
+
+EMPTY = vin_keys([])
+
+class VinIndex:
+    """
+    Persistent set of the VINs in the ETL output, in a directory of sorted, memory mapped segments.
+
+    Every update writes one more segment: the VINs removed, as tombstones, and the VINs added.
+    Segments of about the same size are merged like the digits of a binary counter, so there
+    are O(log n) segments and every VIN is rewritten O(log n) times; a merge streams both
+    segments a block at a time, the tombstones drop the VINs of the older one. Looking up a
+    batch goes from the newest segment to the oldest, the first one that added or removed a VIN
+    decides, after the segment's Bloom filter, when there is one, has ruled out most of the
+    batch: the cost follows the batch and not the size of the history. manifest.json lists the
+    segments, it is replaced last, so an interrupted update leaves the previous index intact.
+    """
+
+    def __init__(self, path, bloom_bits_per_key=BLOOM_BITS_PER_KEY):
+        self.path = path
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self.manifest = self.read_manifest()
+        self.segments = [self.load_segment(segment) for segment in self.manifest["segments"]]
+
+    def __len__(self):
+        # a tombstone only ever removes a VIN an older segment added
+        return sum(segment["count"] - segment.get("deleted_count", 0) for segment in self.manifest["segments"])
+
+    def __contains__(self, vin):
+        return bool(self.contains(vin_keys([vin]))[0])
+
+    @property
+    def fingerprint(self):
+        """What the last update was told the output looked like, see output_fingerprint()."""
+        return self.manifest.get("fingerprint")
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.path, "manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": []}
+
+    def write_manifest(self, manifest):
+        tmp_file = os.path.join(self.path, "manifest.json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, os.path.join(self.path, "manifest.json"))
+        self.manifest = manifest
+
+    def load_segment(self, segment):
+        def load(name):
+            return np.load(os.path.join(self.path, name), mmap_mode="r") if name else None
+        deleted = load(segment.get("deleted"))
+        return load(segment["keys"]), EMPTY if deleted is None else deleted, load(segment.get("bloom")), \
+            segment.get("hash_count")
+
+    def write_segment(self, keys, deleted=EMPTY):
+        """Save sorted unique added keys and tombstones as a new segment, returns its manifest entry."""
+        name = f"segment-{uuid.uuid4().hex}"
+        np.save(os.path.join(self.path, f"{name}.npy"), keys)
+        if len(deleted):
+            np.save(os.path.join(self.path, f"{name}.deleted.npy"), deleted)
+        return self.segment_entry(name, keys, deleted)
+
+    def merge_segments(self, older, newer):
+        """Merge two segments into a new one without loading them, returns its manifest entry."""
+        name = f"segment-{uuid.uuid4().hex}"
+        older_keys, older_deleted, _, _ = self.load_segment(older)
+        newer_keys, newer_deleted, _, _ = self.load_segment(newer)
+        keys = write_merged(os.path.join(self.path, f"{name}.npy"), older_keys, newer_keys, newer_deleted)
+        # The tombstones of both, but the ones of VINs the older segment added themselves cancel
+        # out: those VINs were in no segment before. Once nothing older is left there are none
+        deleted = EMPTY
+        if len(newer_deleted) or len(older_deleted):
+            deleted_file = os.path.join(self.path, f"{name}.deleted.npy")
+            deleted = write_merged(deleted_file, newer_deleted, older_deleted, older_keys)
+            if not len(deleted):
+                os.remove(deleted_file)
+        return self.segment_entry(name, keys, deleted)
+
+    def segment_entry(self, name, keys, deleted):
+        segment = {"keys": f"{name}.npy", "count": len(keys)}
+        if len(deleted):
+            segment.update(deleted=f"{name}.deleted.npy", deleted_count=len(deleted))
+        if self.bloom_bits_per_key:
+            bloom, hash_count = build_bloom([keys, deleted], self.bloom_bits_per_key)
+            np.save(os.path.join(self.path, f"{name}.bloom.npy"), bloom)
+            segment.update(bloom=f"{name}.bloom.npy", hash_count=hash_count)
+        return segment
+
+    def contains(self, keys):
+        """Boolean array, True for the keys (see vin_keys()) in the index."""
+        found = np.zeros(len(keys), dtype=bool)
+        decided = np.zeros(len(keys), dtype=bool)
+        hashes = None
+        for segment_keys, deleted, bloom, hash_count in reversed(self.segments):
+            candidates = np.flatnonzero(~decided)
+            if not len(candidates):
+                break
+            if bloom is not None:
+                if hashes is None:
+                    hashes = hash_keys(keys)
+                candidates = candidates[bloom_contains(bloom, hash_count, hashes[candidates])]
+            added = in_sorted(segment_keys, keys[candidates])
+            removed = ~added & in_sorted(deleted, keys[candidates])
+            found[candidates[added]] = True
+            decided[candidates[added | removed]] = True
+        return found
+
+    def add(self, keys, fingerprint=None):
+        """Add the keys that are not in the index yet, then record the output `fingerprint`."""
+        self.update(add=keys, fingerprint=fingerprint)
+
+    def remove(self, keys, fingerprint=None):
+        """Remove the keys that are in the index, then record the output `fingerprint`."""
+        self.update(remove=keys, fingerprint=fingerprint)
+
+    def update(self, add=EMPTY, remove=EMPTY, fingerprint=None):
+        """
+        Add the keys of `add` that are not in the index and remove the keys of `remove` that are,
+        two distinct sets, in a single segment, then record the output `fingerprint`.
+        """
+        add, remove = np.unique(add), np.unique(remove)
+        add = add[~self.contains(add)]
+        remove = remove[self.contains(remove)]
+        os.makedirs(self.path, exist_ok=True)
+        segments = list(self.manifest["segments"])
+        if len(add) or len(remove):
+            segments.append(self.write_segment(add, remove))
+        # Merge the newest segment into the previous one while they are about the same size
+        obsolete = []
+        while len(segments) > 1 and segment_size(segments[-1]) * 2 >= segment_size(segments[-2]):
+            older, newer = segments[-2], segments[-1]
+            segments[-2:] = [self.merge_segments(older, newer)]
+            obsolete += [older, newer]
+        self.write_manifest({"segments": segments, "fingerprint": fingerprint})
+        self.segments = [self.load_segment(segment) for segment in segments]
+        for segment in obsolete:
+            self.remove_segment_files(segment)
+
+    def replace(self, other, fingerprint=None):
+        """
+        Take over the segments of `other`, an index filled in another directory while the
+        output was rewritten, and remove that directory. Its files are moved in first and the
+        manifest replaced last, like for an update.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for segment in other.manifest["segments"]:
+            for name in segment_files(segment):
+                os.replace(os.path.join(other.path, name), os.path.join(self.path, name))
+        old_segments = self.manifest["segments"]
+        self.write_manifest({"segments": other.manifest["segments"], "fingerprint": fingerprint})
+        self.segments = [self.load_segment(segment) for segment in self.manifest["segments"]]
+        for segment in old_segments:
+            self.remove_segment_files(segment)
+        shutil.rmtree(other.path)
+
+    def remove_segment_files(self, segment):
+        for name in segment_files(segment):
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+
+def segment_size(segment):
+    return segment["count"] + segment.get("deleted_count", 0)
+
+def segment_files(segment):
+    return [segment[field] for field in ("keys", "deleted", "bloom") if segment.get(field)]
+
+def output_fingerprint(output_file):
+    """
+    Names and sizes of the output files (with the modification time of a single file), compared
+    with the one stored in the index to notice an output written without updating the index.
+    """
+    if not os.path.exists(output_file):
+        return None
+    if os.path.isfile(output_file):
+        stat = os.stat(output_file)
+        return [[os.path.basename(output_file), stat.st_size, stat.st_mtime_ns]]
+    files = []
+    for root, _, names in os.walk(output_file):
+        for name in names:
+            path = os.path.join(root, name)
+            files.append([os.path.relpath(path, output_file), os.path.getsize(path)])
+    return sorted(files)
@@ -15,7 +15,8 @@ function App(){
   useEffect( ()=>{
     const loadVehicles = async()=>{
       try {
-        let response = await fetch('http://127.0.0.1:5000/vehicle')
+        // the pages only need these columns, so skip the description
+        let response = await fetch('http://127.0.0.1:5000/vehicle?fields=vin,manufacturer_name,model_name,model_year,horse_power,purchase_price,fuel_type')
         let data_got_back = await response.json()
         setVehicles(data_got_back)
       }catch(e){
@@ -40,7 +41,7 @@ function App(){
           <Routes>
             <Route path="/" element={<HomePage />} />
             <Route path="/vehicles" element={<VehicleListPage vehicles={vehicles} />} />
-            <Route path="/analytics" element={<AnalyticsPage vehicles={vehicles} />} />
+            <Route path="/analytics" element={<AnalyticsPage />} />
             <Route path="/add-vehicle" element={<AddVehiclePage />} />
             <Route path="/edit-vehicle" element={<EditVehiclePage vehicles={vehicles} />} />
           </Routes>
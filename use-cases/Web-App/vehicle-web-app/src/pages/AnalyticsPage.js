@@ -1,118 +1,48 @@
-import React from "react";
+import React, {useState, useEffect} from "react";
 import AnalyticsCard from "../components/AnalyticsCard";
 import AnalyticsChart from "../components/AnalyticsChart";
 
 
-const AnalyticsPage = ({ vehicles }) => {
-    // Calculate total vehicles
-    const totalVehicles = vehicles.length;
-
-
-    // Find the most common manufacturer
-    const manufacturerCount = {};
-    vehicles.forEach((vehicle) => {
-    const manufacturer = vehicle.manufacturer_name;
-    if (!manufacturerCount[manufacturer]) {
-        manufacturerCount[manufacturer] = 0;
-    }
-    manufacturerCount[manufacturer] += 1;
-    });
-
-
-    let mostCommonManufacturer = "";
-    let highestCount = 0;
-
-
-    for (const manufacturer in manufacturerCount) {
-    if (manufacturerCount[manufacturer] > highestCount) {
-        highestCount = manufacturerCount[manufacturer];
-        mostCommonManufacturer = manufacturer;
-    }
-    }
-
-
-    // Calculate the average purchase price
-    let totalPurchasePrice = 0;
-    vehicles.forEach((vehicle) => {
-    totalPurchasePrice += vehicle.purchase_price;
-    });
-    const avgPurchasePrice = totalPurchasePrice / totalVehicles;
-
-
-    // Calculate fuel type distribution
-    const fuelTypeDistribution = {};
-    vehicles.forEach((vehicle) => {
-    const fuelType = vehicle.fuel_type;
-    if (!fuelTypeDistribution[fuelType]) {
-        fuelTypeDistribution[fuelType] = 0;
-    }
-    fuelTypeDistribution[fuelType] += 1;
-    });
-
-
-    // Calculate average horsepower by manufacturer
-    let totalHorsePowerbyManufacturer = {}
-    for (let i=0;i<totalVehicles;i++){
-      let hp = vehicles[i]['horse_power']
-      let manu = vehicles[i]['manufacturer_name']
-
-      if (!(manu in totalHorsePowerbyManufacturer)){
-        totalHorsePowerbyManufacturer[manu] = hp
-      }else{
-        totalHorsePowerbyManufacturer[manu] += hp
+const AnalyticsPage = () => {
+    const [stats, setStats] = useState(null);
+    const [error, setError] = useState(null);
+
+    // The server computes every metric with SQL aggregates, so we don't download the whole table
+    useEffect( ()=>{
+      const loadStats = async()=>{
+        try {
+          let response = await fetch('http://127.0.0.1:5000/vehicle/stats')
+          if (!response.ok) {
+            // a 500 carries a JSON error, a 429 from the rate limiter an HTML page
+            let errorData = await response.json().catch(() => ({}))
+            setError(errorData.error || `${response.status} ${response.statusText}`)
+            return
+          }
+          let data_got_back = await response.json()
+          setStats(data_got_back)
+        }catch(e){
+          setError("error connecting to server : " + e)
+        }
       }
-    }
-
-    let avgHorsepowerByManufacturer = {}
-    for (let i=0;i<totalVehicles;i++){
-      let manu = vehicles[i]['manufacturer_name']
-      let avgHorsepower = totalHorsePowerbyManufacturer[manu] / manufacturerCount[manu]
-      avgHorsepowerByManufacturer[manu] = avgHorsepower
-    }
-
-    console.log('avg HP is ')
-    for (let manu in avgHorsepowerByManufacturer){
-      console.log(manu + ' has avg: ' + avgHorsepowerByManufacturer[manu])
-    }
-
-    // avg purchase price by year
-    let totalPurchasePriceByYear = {}
-    let avgPurchasePriceByYear = {}
-    let yearCount = {}
-    for (let i =0;i < totalVehicles; i++){
-      let year = vehicles[i]['model_year']
-      let purchase_price = vehicles[i]['purchase_price']
-      if (! (year in totalPurchasePriceByYear)){
-        totalPurchasePriceByYear[year] = purchase_price
-      }else{
-        totalPurchasePriceByYear[year] += purchase_price
-      }
-      if (! (year in yearCount)){
-        yearCount[year] = 1
-      }else{
-        yearCount[year] += 1
+      loadStats()
       }
+      , [])
+
+    if (error) {
+      return <p>error: {error}</p>
     }
-    for (let year in totalPurchasePriceByYear){
-      console.log(year + ' has total PP '+ totalPurchasePriceByYear[year])
-    }
-    for (let year in totalPurchasePriceByYear){
-      let avgPurchasePrice = totalPurchasePriceByYear[year] / yearCount[year]
-      avgPurchasePriceByYear[year] = avgPurchasePrice
+    if (!stats) {
+      return <p>Loading... </p>
     }
 
-    console.log('avg purchase price by year :')
-    for (let year in avgPurchasePriceByYear){
-      console.log(year + ' has avg purchase price '+ avgPurchasePriceByYear[year])
-    }
-    
+    const avgPurchasePrice = stats.average_purchase_price || 0;
 
   return (
     <div>
       <h1>Analytics</h1>
       <div style={{ display: "flex", justifyContent: "space-between", marginBottom: "20px" }}>
-        <AnalyticsCard title="Total Vehicles" value={totalVehicles} />
-        <AnalyticsCard title="Most Common Manufacturer" value={mostCommonManufacturer} />
+        <AnalyticsCard title="Total Vehicles" value={stats.total_vehicles} />
+        <AnalyticsCard title="Most Common Manufacturer" value={stats.most_common_manufacturer || ""} />
         <AnalyticsCard
           title="Average Purchase Price"
           value={`$${avgPurchasePrice.toFixed(2)}`}
@@ -120,17 +50,17 @@ const AnalyticsPage = ({ vehicles }) => {
       </div>
       <AnalyticsChart
         title="Fuel Type Distribution"
-        data={fuelTypeDistribution}
+        data={stats.fuel_type_distribution}
         type="pie"
       />
       <AnalyticsChart
         title="Average Horsepower by Manufacturer"
-        data={avgHorsepowerByManufacturer}
+        data={stats.average_horse_power_by_manufacturer}
         type="bar"
       />
         <AnalyticsChart
         title="Average Purchase Price by Year"
-        data={avgPurchasePriceByYear}
+        data={stats.average_purchase_price_by_year}
         type="line"
       />
     </div>
@@ -138,4 +68,4 @@ const AnalyticsPage = ({ vehicles }) => {
 };
 
 
-export default AnalyticsPage;
\ No newline at end of file
+export default AnalyticsPage;
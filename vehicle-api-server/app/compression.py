@@ -0,0 +1,142 @@
+import zlib
+
+from flask import current_app, request
+
+from .timing import timed
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional
+    zstandard = None
+
+
+DEFAULT_CONFIG = {
+    "COMPRESS_ENABLED": True,
+    # Responses smaller than this (in bytes) are sent uncompressed
+    "COMPRESS_MIN_SIZE": 1024,
+    "COMPRESS_MIMETYPES": ["application/json", "text/html", "text/plain", "text/css", "application/javascript"],
+    "COMPRESS_GZIP_LEVEL": 6,
+    "COMPRESS_BROTLI_QUALITY": 4,
+    "COMPRESS_ZSTD_LEVEL": 3,
+}
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        # wbits=31 writes a gzip header and trailer instead of a raw zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def available_encodings():
+    """
+    Content codings we can produce, in order of preference when the client rates several of them equally.
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def get_compressor(encoding, config):
+    if encoding == "zstd":
+        return ZstdCompressor(config["COMPRESS_ZSTD_LEVEL"])
+    if encoding == "br":
+        return BrotliCompressor(config["COMPRESS_BROTLI_QUALITY"])
+    if encoding == "gzip":
+        return GzipCompressor(config["COMPRESS_GZIP_LEVEL"])
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def compress_stream(chunks, compressor):
+    # Flush after every chunk so a chunked response reaches the client as it is produced
+    for chunk in chunks:
+        if chunk:
+            yield compressor.compress(chunk) + compressor.flush()
+    yield compressor.finish()
+
+
+def compress_response(response):
+    config = current_app.config
+    if not config["COMPRESS_ENABLED"]:
+        return response
+    if response.mimetype not in config["COMPRESS_MIMETYPES"]:
+        return response
+
+    # The body depends on Accept-Encoding from here on, so caches must key on it
+    response.vary.add("Accept-Encoding")
+
+    if (request.method == "HEAD"
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    compressor = get_compressor(encoding, config)
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), compressor)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESS_MIN_SIZE"]:
+            return response
+        with timed("compress"):
+            response.set_data(compressor.compress(data) + compressor.finish())
+
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_compression(app):
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    app.after_request(compress_response)
@@ -1,16 +1,175 @@
 import sqlite3
 import os
+import re
+import time
+import logging
+from itertools import chain
+
+from flask import current_app, has_app_context
 
 DATABASE = os.path.join(os.path.dirname(__file__), 'vehicles.db')
 
+# Statements slower than this are logged with their query plan, a negative value disables the instrumentation.
+# The SLOW_QUERY_THRESHOLD_MS setting of the app, this value outside of an app
+SLOW_QUERY_THRESHOLD_MS = 100
+
+slow_query_logger = logging.getLogger('app.db.slow_queries')
+
+def get_database_path():
+    # The DATABASE setting of the app handling the request, the module default outside of an app
+    if has_app_context():
+        return current_app.config.get('DATABASE') or DATABASE
+    return DATABASE
+
+def get_slow_query_threshold_ms():
+    if has_app_context():
+        return current_app.config.get('SLOW_QUERY_THRESHOLD_MS', SLOW_QUERY_THRESHOLD_MS)
+    return SLOW_QUERY_THRESHOLD_MS
+
 def get_db():
-    db_path = os.path.abspath(DATABASE)
-    connection = sqlite3.connect(db_path)
+    db_path = os.path.abspath(get_database_path())
+    threshold_ms = get_slow_query_threshold_ms()
+    if threshold_ms >= 0:
+        connection = sqlite3.connect(db_path, factory=InstrumentedConnection)
+        connection.slow_query_threshold_ms = threshold_ms
+    else:
+        connection = sqlite3.connect(db_path)
     connection.row_factory = sqlite3.Row
     return connection
 
-def init_db():
-    db_path = os.path.abspath(DATABASE)
+def normalize_sql(sql):
+    """Replace literals with ? and collapse whitespace, so the same statement always logs the same way."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())
+
+def parameter_shape(parameters):
+    """Types of the bound parameters, never their values."""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+def explain_query_plan(connection, sql, parameters):
+    # A plain cursor, so explaining a statement is not instrumented itself
+    try:
+        plan = sqlite3.Cursor(connection).execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+    except sqlite3.Error:
+        return []
+    return [row[3] for row in plan]
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that times each statement, from execute() until its results are consumed or the
+    cursor is closed, and logs the ones slower than the slow_query_threshold_ms of its connection
+    with their normalized SQL, parameter shape, row count and EXPLAIN QUERY PLAN.
+    """
+
+    _pending = False
+
+    def execute(self, sql, parameters=()):
+        self._report()
+        return self._timed_execute(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._report()
+        # Only the first parameters are kept for the log, the others stream through to SQLite
+        seq_of_parameters = iter(seq_of_parameters)
+        first = next(seq_of_parameters, None)
+        if first is None:
+            return self._timed_execute(super().executemany, sql, seq_of_parameters, ())
+        return self._timed_execute(super().executemany, sql, chain([first], seq_of_parameters), first)
+
+    def _timed_execute(self, execute, sql, parameters, sample):
+        self._sql, self._parameters, self._rows, self._elapsed = sql, sample, 0, 0.0
+        start = time.perf_counter()
+        try:
+            return execute(sql, parameters)
+        finally:
+            self._elapsed += time.perf_counter() - start
+            self._pending = True
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._count(start, 1 if row is not None else 0, done=row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count(start, len(rows), done=len(rows) < (self.arraysize if size is None else size))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._count(start, len(rows), done=True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._count(start, 0, done=True)
+            raise
+        self._count(start, 1, done=False)
+        return row
+
+    def close(self):
+        self._report()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._report()
+        except Exception:
+            pass
+
+    def _count(self, start, rows, done):
+        if self._pending:
+            self._elapsed += time.perf_counter() - start
+            self._rows += rows
+            if done:
+                self._report()
+
+    def _report(self):
+        if not self._pending:
+            return
+        self._pending = False
+        elapsed_ms = self._elapsed * 1000
+        if elapsed_ms < self.connection.slow_query_threshold_ms:
+            return
+
+        # rowcount is only meaningful for INSERT/UPDATE/DELETE, SELECTs count the rows fetched
+        rows = self.rowcount if self.rowcount >= 0 else self._rows
+        plan = explain_query_plan(self.connection, self._sql, self._parameters)
+        full_scan = any(step.startswith('SCAN') for step in plan)
+        slow_query_logger.warning(
+            f'Slow query ({elapsed_ms:.1f} ms, {rows} rows{", full scan" if full_scan else ""}): '
+            f'{normalize_sql(self._sql)} | params: {parameter_shape(self._parameters)} | plan: {"; ".join(plan)}'
+        )
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the implicit ones of execute(), are InstrumentedCursors."""
+
+    slow_query_threshold_ms = SLOW_QUERY_THRESHOLD_MS
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        cursor = self.cursor()
+        cursor.execute(sql, parameters)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        cursor = self.cursor()
+        cursor.executemany(sql, seq_of_parameters)
+        return cursor
+
+def init_db(database=None):
+    db_path = os.path.abspath(database or DATABASE)
     if not os.path.exists(db_path):
         print(f"Database at {db_path} does not exist. It will be created.")
     print(f"Using database at: {db_path}")
@@ -26,4 +185,78 @@ def init_db():
             purchase_price REAL NOT NULL,
             fuel_type TEXT NOT NULL
         )''')
-        db.commit()
\ No newline at end of file
+        db.commit()
+        init_change_log(db)
+
+def init_change_log(db):
+    """
+    Create the append-only vehicle_changes log and the triggers that fill it.
+    Every insert, update and delete on vehicles gets a new, monotonically increasing seq,
+    whichever server (or script) wrote it. vehicle holds the row after the change as JSON,
+    it is NULL for deletes.
+    """
+    vehicle_json = '''json_object('vin', NEW.vin, 'manufacturer_name', NEW.manufacturer_name,
+        'description', NEW.description, 'horse_power', NEW.horse_power, 'model_name', NEW.model_name,
+        'model_year', NEW.model_year, 'purchase_price', NEW.purchase_price, 'fuel_type', NEW.fuel_type)'''
+    db.executescript(f'''
+        CREATE TABLE IF NOT EXISTS vehicle_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            vin TEXT NOT NULL COLLATE NOCASE,
+            operation TEXT NOT NULL,
+            vehicle TEXT,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+        );
+        CREATE INDEX IF NOT EXISTS vehicle_changes_vin ON vehicle_changes (vin, seq);
+
+        -- highest seq removed by prune_change_log, consumers behind it have to resync
+        CREATE TABLE IF NOT EXISTS vehicle_changes_pruned (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        );
+
+        CREATE TRIGGER IF NOT EXISTS vehicles_log_insert AFTER INSERT ON vehicles BEGIN
+            INSERT INTO vehicle_changes (vin, operation, vehicle) VALUES (NEW.vin, 'insert', {vehicle_json});
+        END;
+        CREATE TRIGGER IF NOT EXISTS vehicles_log_update AFTER UPDATE ON vehicles BEGIN
+            INSERT INTO vehicle_changes (vin, operation, vehicle) VALUES (NEW.vin, 'update', {vehicle_json});
+        END;
+        CREATE TRIGGER IF NOT EXISTS vehicles_log_delete AFTER DELETE ON vehicles BEGIN
+            INSERT INTO vehicle_changes (vin, operation, vehicle) VALUES (OLD.vin, 'delete', NULL);
+        END;
+    ''')
+
+def get_latest_change_seq(db):
+    row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'vehicle_changes'").fetchone()
+    return row[0] if row else 0
+
+def get_pruned_change_seq(db):
+    row = db.execute('SELECT seq FROM vehicle_changes_pruned WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+def compact_change_log(db):
+    """
+    Keep only the latest change for each VIN. Safe for every consumer: whatever seq they
+    resume from, they still get the final state of each vehicle that changed after it.
+    Returns the number of removed entries.
+    """
+    cursor = db.execute('''DELETE FROM vehicle_changes
+        WHERE seq NOT IN (SELECT MAX(seq) FROM vehicle_changes GROUP BY vin)''')
+    db.commit()
+    return cursor.rowcount
+
+def prune_change_log(db, retention_days):
+    """
+    Remove changes older than retention_days and remember the highest removed seq,
+    so consumers that are further behind are told to do a full resync.
+    Returns the number of removed entries.
+    """
+    cutoff = f'-{int(retention_days)} days'
+    row = db.execute('''SELECT MAX(seq) FROM vehicle_changes
+        WHERE changed_at < strftime('%Y-%m-%dT%H:%M:%fZ', 'now', ?)''', (cutoff,)).fetchone()
+    if row[0] is None:
+        return 0
+    cursor = db.execute('DELETE FROM vehicle_changes WHERE seq <= ?', (row[0],))
+    db.execute('''INSERT INTO vehicle_changes_pruned (id, seq) VALUES (1, ?)
+        ON CONFLICT (id) DO UPDATE SET seq = MAX(seq, excluded.seq)''', (row[0],))
+    db.commit()
+    return cursor.rowcount
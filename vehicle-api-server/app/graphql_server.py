@@ -1,19 +1,64 @@
-from flask import Flask, g
+from flask import Flask, g, current_app
 from strawberry.flask.views import GraphQLView
+from strawberry.http.exceptions import HTTPException
 import strawberry
-from .db import get_db, init_db
-from flask_cors import CORS
+from strawberry.extensions import SchemaExtension
+import json
+from functools import cache
+from .db import DATABASE, get_db, init_db
+from .json_provider import VehicleJSONProvider
+from .timing import init_server_timing, timed
 import sqlite3
 from typing import Optional
 
 
-app = Flask(__name__)
-CORS(app)
+DEFAULT_CONFIG = {
+    # SQLite database file, get_db() connects to it while handling a request
+    'DATABASE': DATABASE,
+}
+
+
+def create_app(config=None):
+    """
+    Build the GraphQL app. `config` overrides DEFAULT_CONFIG and the extension defaults.
+    Nothing happens at import time, the extensions, the schema and the database
+    initialization all run here.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+
+    # Imported here, they pull in optional compression and CORS libraries that importing
+    # this module (tests, CLI tools, benchmarks) does not need
+    from flask_cors import CORS
+    from .compression import init_compression
+    from .profiling import init_profiling
+    from .memory import init_memory_diagnostics
+
+    init_profiling(app)
+    init_server_timing(app)
+    app.json = VehicleJSONProvider(app)
+    init_compression(app)
+    init_memory_diagnostics(app)
+    CORS(app)
+    app.teardown_appcontext(teardown)
+    app.add_url_rule(
+        "/graphql",
+        view_func=VehicleGraphQLView.as_view("graphql_view", schema=get_schema(), graphiql=True),
+    )
+
+    init_db(app.config['DATABASE'])
+    return app
+
+
+def __getattr__(name):
+    # `from app.graphql_server import app` still works: the default app is built on first access
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-with app.app_context():
-    init_db()
 
-@app.teardown_appcontext
 def teardown(exception):
     db = getattr(g, '_database', None)
     if db is not None:
@@ -245,11 +290,36 @@ class Mutation:
     update_vehicle: Vehicle = strawberry.mutation(resolver=resolve_update_vehicle)
     delete_vehicle: bool = strawberry.mutation(resolver=resolve_delete_vehicle)
 
-schema = strawberry.Schema(query=Query, mutation=Mutation)
-app.add_url_rule(
-    "/graphql",
-    view_func=GraphQLView.as_view("graphql_view", schema=schema, graphiql=True),
-)
+# GraphQL view that parses and encodes JSON with the app's JSON provider instead of the stdlib
+class VehicleGraphQLView(GraphQLView):
+    def parse_json(self, data):
+        try:
+            return current_app.json.loads(data)
+        except json.JSONDecodeError as e:
+            raise HTTPException(400, "Unable to parse request body as JSON") from e
+
+    def encode_json(self, response_data):
+        with timed('serialize'):
+            return current_app.json.dumps(response_data)
+
+# Reports the GraphQL stages of a request in its Server-Timing header
+class ServerTimingExtension(SchemaExtension):
+    def on_parse(self):
+        with timed('parse'):
+            yield
+
+    def on_validate(self):
+        with timed('validate'):
+            yield
+
+    def on_execute(self):
+        with timed('resolve'):
+            yield
+
+@cache
+def get_schema():
+    # Built once, by the first create_app() call rather than at import
+    return strawberry.Schema(query=Query, mutation=Mutation, extensions=[ServerTimingExtension])
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,63 @@
+import sqlite3
+
+from flask.json.provider import DefaultJSONProvider
+
+from .timing import timed
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, we fall back to the stdlib json module
+    orjson = None
+
+
+def _default(o):
+    # sqlite3.Row objects are serialized one at a time while encoding,
+    # so routes can hand cursor results straight to jsonify()
+    if isinstance(o, sqlite3.Row):
+        return dict(zip(o.keys(), o))
+    return DefaultJSONProvider.default(o)
+
+
+class VehicleJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider used by both servers.
+    Uses orjson when it is installed and falls back to the stdlib json module otherwise.
+    It also knows how to serialize sqlite3.Row, so query results do not need to be
+    copied into a list of dicts before calling jsonify().
+    """
+
+    default = staticmethod(_default)
+
+    def _orjson_options(self, indent=False):
+        options = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        # orjson only supports a subset of json.dumps options, anything else goes to the stdlib
+        if orjson is None or set(kwargs) - {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        options = self._orjson_options(indent=bool(kwargs.get('indent')))
+        return orjson.dumps(obj, default=self.default, option=options).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        with timed('serialize'):
+            return self._response(*args, **kwargs)
+
+    def _response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        # Build the body as bytes directly, this skips the bytes -> str -> bytes round trip
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,191 @@
+import gc
+import hmac
+import linecache
+import logging
+import os
+import sqlite3
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from flask import current_app, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "MEMORY_DIAGNOSTICS": os.environ.get("MEMORY_DIAGNOSTICS", "").lower() in ("1", "true", "yes"),
+    # Stack depth recorded by tracemalloc for every allocation, deeper is more precise but slower
+    "MEMORY_TRACE_FRAMES": int(os.environ.get("MEMORY_TRACE_FRAMES", 10)),
+    # Seconds between memory log lines, 0 disables the periodic log
+    "MEMORY_LOG_INTERVAL": float(os.environ.get("MEMORY_LOG_INTERVAL", 300)),
+    "MEMORY_TOP_N": 10,
+    # GET /admin/memory requires it in the X-Admin-Token header, without a token it is not served
+    "MEMORY_ADMIN_TOKEN": os.environ.get("MEMORY_ADMIN_TOKEN"),
+}
+
+# Allocations made by the diagnostics themselves are not interesting
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+]
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # not Linux, fall back to the peak RSS
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def sqlite_object_counts():
+    """Live sqlite3 connections (open and closed but not yet collected) and cursors."""
+    connections = cursors = open_connections = 0
+    for obj in gc.get_objects():
+        if isinstance(obj, sqlite3.Connection):
+            connections += 1
+            try:
+                obj.in_transaction
+                open_connections += 1
+            except sqlite3.ProgrammingError:
+                pass
+        elif isinstance(obj, sqlite3.Cursor):
+            cursors += 1
+    return {"open_connections": open_connections, "connections": connections, "cursors": cursors}
+
+
+def object_type_counts():
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def format_statistic(stat):
+    frame = stat.traceback[0]
+    return {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "size_kib": round(stat.size / 1024, 1),
+        "count": stat.count,
+    }
+
+
+def format_diff(stat):
+    return {**format_statistic(stat), "size_diff_kib": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff}
+
+
+class MemoryTracker:
+    """
+    Keeps tracemalloc snapshots and object counts so every report can say what grew since
+    the baseline (taken at startup or on ?reset=1) and since the previous report.
+    """
+
+    def __init__(self, top_n):
+        self.top_n = top_n
+        self.lock = threading.Lock()
+        self.baseline = self.previous = self.take_snapshot()
+        self.baseline_types = self.previous_types = object_type_counts()
+
+    @staticmethod
+    def take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def reset(self):
+        with self.lock:
+            self.baseline = self.previous = self.take_snapshot()
+            self.baseline_types = self.previous_types = object_type_counts()
+
+    def report(self):
+        with self.lock:
+            snapshot = self.take_snapshot()
+            types = object_type_counts()
+            traced, peak = tracemalloc.get_traced_memory()
+            type_growth = types.copy()
+            type_growth.subtract(self.baseline_types)
+            report = {
+                "rss_mib": round(current_rss_bytes() / 2 ** 20, 1),
+                "traced_mib": round(traced / 2 ** 20, 1),
+                "traced_peak_mib": round(peak / 2 ** 20, 1),
+                "sqlite": sqlite_object_counts(),
+                "top_allocations": [format_statistic(s) for s in snapshot.statistics("lineno")[:self.top_n]],
+                "growth_since_previous": [
+                    format_diff(s) for s in snapshot.compare_to(self.previous, "lineno")[:self.top_n]],
+                "growth_since_baseline": [
+                    format_diff(s) for s in snapshot.compare_to(self.baseline, "lineno")[:self.top_n]],
+                "object_types": dict(types.most_common(self.top_n)),
+                "object_type_growth_since_baseline": {
+                    name: count for name, count in type_growth.most_common(self.top_n) if count > 0},
+            }
+            self.previous, self.previous_types = snapshot, types
+            return report
+
+
+def log_memory(tracker):
+    report = tracker.report()
+    growth = ", ".join(
+        f"{stat['location']} {stat['size_diff_kib']:+.1f} KiB" for stat in report["growth_since_previous"][:3])
+    logger.info(
+        f"Memory: rss={report['rss_mib']} MiB traced={report['traced_mib']} MiB "
+        f"sqlite_connections={report['sqlite']['open_connections']} open/{report['sqlite']['connections']} alive "
+        f"top growth: {growth or 'none'}"
+    )
+
+
+_log_thread = None
+
+
+def start_periodic_log(tracker, interval):
+    """Start the log thread, once per process even when several apps enable the diagnostics."""
+    global _log_thread
+    if _log_thread is not None:
+        return _log_thread
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                log_memory(tracker)
+            except Exception as e:
+                logger.error(f"Memory diagnostics failed: {e}")
+
+    _log_thread = threading.Thread(target=run, name="memory-diagnostics", daemon=True)
+    _log_thread.start()
+    return _log_thread
+
+
+def memory_report():
+    token = current_app.config["MEMORY_ADMIN_TOKEN"]
+    # constant time, like the signature check of the profiling hook
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", "").encode(), token.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+
+    tracker = current_app.extensions["memory_diagnostics"]
+    if request.args.get("reset") == "1":
+        tracker.reset()
+    return jsonify(tracker.report()), 200
+
+
+def init_memory_diagnostics(app):
+    """
+    Opt-in memory diagnostics (MEMORY_DIAGNOSTICS): starts tracemalloc, serves a report on
+    GET /admin/memory when MEMORY_ADMIN_TOKEN is set and logs a summary every
+    MEMORY_LOG_INTERVAL seconds. Nothing is started or registered when the mode is off.
+    """
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    if not app.config["MEMORY_DIAGNOSTICS"]:
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(app.config["MEMORY_TRACE_FRAMES"])
+    tracker = MemoryTracker(app.config["MEMORY_TOP_N"])
+    app.extensions["memory_diagnostics"] = tracker
+    if app.config["MEMORY_ADMIN_TOKEN"]:
+        app.add_url_rule("/admin/memory", "memory_report", memory_report, methods=["GET"])
+    else:
+        logger.warning("MEMORY_ADMIN_TOKEN is not set, GET /admin/memory is not served")
+
+    if app.config["MEMORY_LOG_INTERVAL"] > 0:
+        start_periodic_log(tracker, app.config["MEMORY_LOG_INTERVAL"])
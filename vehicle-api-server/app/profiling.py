@@ -0,0 +1,99 @@
+import cProfile
+import hashlib
+import hmac
+import logging
+import os
+import random
+import re
+import time
+
+from flask import current_app, g, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile-Signature"
+
+DEFAULT_CONFIG = {
+    # Requests carrying a valid X-Profile-Signature header are profiled when this is set
+    "PROFILE_SECRET": os.environ.get("PROFILE_SECRET"),
+    # Fraction of all requests to profile, between 0 and 1
+    "PROFILE_SAMPLE_RATE": float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    "PROFILE_DIR": os.environ.get("PROFILE_DIR", "profiles"),
+}
+
+
+def sign_request(secret, method, path):
+    """Signature a client puts in the X-Profile-Signature header to have METHOD path profiled."""
+    return hmac.new(secret.encode(), f"{method.upper()} {path}".encode(), hashlib.sha256).hexdigest()
+
+
+def should_profile():
+    secret = current_app.config["PROFILE_SECRET"]
+    signature = request.headers.get(PROFILE_HEADER)
+    if secret and signature:
+        return hmac.compare_digest(signature, sign_request(secret, request.method, request.path))
+    sample_rate = current_app.config["PROFILE_SAMPLE_RATE"]
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def start_profiling():
+    if not should_profile():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is already active in this process
+        return
+    g._profiler = profiler
+    g._profile_start = time.perf_counter()
+
+
+def request_vin():
+    vin = (request.view_args or {}).get("vin")
+    if vin is None and request.is_json:
+        # GraphQL requests pass the VIN as a variable
+        variables = (request.get_json(silent=True) or {}).get("variables") or {}
+        vin = variables.get("vin") if isinstance(variables, dict) else None
+    return vin
+
+
+def profile_filename(elapsed_ms):
+    route = request.url_rule.rule if request.url_rule else request.path
+    route = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    vin = re.sub(r"[^A-Za-z0-9]+", "", str(request_vin() or "")) or "novin"
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+    return f"{timestamp}_{request.method}_{route}_{vin}_{elapsed_ms:.0f}ms_{os.getpid()}.prof"
+
+
+def stop_profiling(exception=None):
+    profiler = g.pop("_profiler", None)
+    if profiler is None:
+        return
+    profiler.disable()
+    elapsed_ms = (time.perf_counter() - g.pop("_profile_start")) * 1000
+
+    profile_dir = current_app.config["PROFILE_DIR"]
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, profile_filename(elapsed_ms))
+        profiler.dump_stats(path)
+        logger.info(f"Saved profile of {request.method} {request.path} to {path}")
+    except OSError as e:
+        logger.error(f"Could not save profile of {request.method} {request.path}: {e}")
+
+
+def init_profiling(app):
+    """
+    Profile single requests with cProfile and save the stats (pstats format, which snakeviz and
+    flameprof can render) to PROFILE_DIR. A request is profiled when it carries a valid
+    X-Profile-Signature header or is picked by PROFILE_SAMPLE_RATE.
+    Nothing is registered when neither is configured, so the disabled mode costs nothing.
+    Call this before the other extensions so their hooks are part of the profile.
+    """
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    if not app.config["PROFILE_SECRET"] and not app.config["PROFILE_SAMPLE_RATE"]:
+        return
+    app.before_request(start_profiling)
+    app.teardown_request(stop_profiling)
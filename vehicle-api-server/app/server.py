@@ -1,61 +1,213 @@
-from flask import Flask, jsonify, request, g
-from app.db import get_db, init_db
+from flask import Blueprint, Flask, current_app, jsonify, request, g
+from app.db import (DATABASE, SLOW_QUERY_THRESHOLD_MS, get_db, init_db, get_latest_change_seq,
+                    get_pruned_change_seq, compact_change_log, prune_change_log)
+from app.json_provider import VehicleJSONProvider
+from app.timing import init_server_timing, phase
 import sqlite3
+import math
 import re
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits import parse as parse_rate_limit
 import logging
-from flask_cors import CORS
 
 
-# Setup Logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
-    handlers=[
-        logging.StreamHandler(), 
-        logging.FileHandler("app.log"),  
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)
-limiter = Limiter(get_remote_address, app=app)
+DEFAULT_CONFIG = {
+    # SQLite database file, get_db() connects to it while handling a request
+    'DATABASE': DATABASE,
+    # Statements slower than this are logged with their query plan, a negative value disables it
+    'SLOW_QUERY_THRESHOLD_MS': SLOW_QUERY_THRESHOLD_MS,
+    'LOG_LEVEL': logging.DEBUG,
+    # None only logs to the console
+    'LOG_FILE': 'app.log',
+    'CORS_ORIGINS': 'http://localhost:3000',
+    # Change log settings for GET /vehicle/changes and the compact-changes command
+    'CHANGE_LOG_PAGE_SIZE': 500,
+    'CHANGE_LOG_MAX_PAGE_SIZE': 5000,
+    'CHANGE_LOG_RETENTION_DAYS': 30,
+    # Pagination of GET /vehicle. Pages share the rate limit of the full listing, see listing_cost()
+    'VEHICLE_MAX_PAGE_SIZE': 5000,
+    'VEHICLE_LISTING_RATE_LIMIT': '100/hour',
+}
 
 REQUIRED_FIELDS = ["vin","manufacturer_name", "description", "horse_power",
                    "model_name", "model_year", "purchase_price", "fuel_type"]
+STATS_GROUP_BY_FIELDS = ["manufacturer_name", "model_name", "model_year", "fuel_type"]
+MAX_STATS_TOP = 100
+# Units of the listing rate limit a full listing costs, a page costs its share of the table
+LISTING_COST = 1000
+
+# The routes live on a blueprint so every app built by create_app() gets them.
+# cli_group=None keeps the commands at the top level: `flask compact-changes`
+vehicles = Blueprint('vehicles', __name__, cli_group=None)
+
+
+def rate_limit(limit_value, **options):
+    """Declare the rate limit of a route, init_rate_limits() applies it with the limiter of each app."""
+    def decorator(view):
+        view.rate_limit = (limit_value, options)
+        return view
+    return decorator
 
-with app.app_context():
-    init_db()
+
+def init_rate_limits(app):
+    """
+    Give the app its own Limiter (in app.extensions['rate_limiter']) and attach the route limits
+    to it, so the RATELIMIT_* settings and the counters of one app never apply to another.
+    """
+    limiter = app.extensions['rate_limiter'] = Limiter(get_remote_address, app=app)
+    for endpoint, view in list(app.view_functions.items()):
+        if hasattr(view, 'rate_limit'):
+            limit_value, options = view.rate_limit
+            app.view_functions[endpoint] = limiter.limit(limit_value, **options)(view)
+    return limiter
+
+
+def configure_logging(app):
+    # Only when logging is not configured yet, e.g. by a previous app: the handlers are not even
+    # built for the other apps, a FileHandler opens its file
+    if logging.getLogger().handlers:
+        return
+    handlers = [logging.StreamHandler()]
+    if app.config['LOG_FILE']:
+        handlers.append(logging.FileHandler(app.config['LOG_FILE']))
+    logging.basicConfig(
+        level=app.config['LOG_LEVEL'],
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=handlers,
+    )
+
+
+def create_app(config=None):
+    """
+    Build the REST API app. `config` overrides DEFAULT_CONFIG and the extension defaults.
+    Nothing happens at import time, the logging setup, the extensions and the database
+    initialization all run here.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    configure_logging(app)
+
+    # Imported here, they pull in optional compression and CORS libraries that importing
+    # this module (tests, CLI tools, benchmarks) does not need
+    from flask_cors import CORS
+    from app.compression import init_compression
+    from app.profiling import init_profiling
+    from app.memory import init_memory_diagnostics
+
+    init_profiling(app)
+    init_server_timing(app)
+    app.json = VehicleJSONProvider(app)
+    init_compression(app)
+    init_memory_diagnostics(app)
+    CORS(app, resources={r"/*": {"origins": app.config['CORS_ORIGINS']}}, supports_credentials=True)
+    app.register_blueprint(vehicles)
+    # the limiter checks every request in its own before_request hook, time it from both sides
+    app.before_request(lambda: phase('ratelimit'))
+    init_rate_limits(app)
+    app.before_request(lambda: phase(None))
+
+    init_db(app.config['DATABASE'])
     logger.info("Database initialized.")
+    return app
+
+
+def __getattr__(name):
+    # `from app.server import app` still works: the default app is built on first access
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-@app.teardown_appcontext
+@vehicles.teardown_app_request
 def close_db_connection(exception):
-    db = getattr(g, '_database', None)
+    # popped, a test that keeps an app context pushed shares its g between requests
+    db = g.pop('_database', None)
     if db is not None:
         db.close()
 
-@app.route('/vehicle', methods=['GET'])
-@limiter.limit("100/hour")
+def request_db():
+    # One connection for the whole request, the rate limit cost and the view share it, closed on teardown
+    if '_database' not in g:
+        g._database = get_db()
+    return g._database
+
+def listing_rate_limit():
+    # VEHICLE_LISTING_RATE_LIMIT in units of LISTING_COST
+    limit = parse_rate_limit(current_app.config['VEHICLE_LISTING_RATE_LIMIT'])
+    return f"{limit.amount * LISTING_COST} per {limit.multiples} {limit.GRANULARITY.name}"
+
+
+def listing_cost():
+    """
+    A full listing costs LISTING_COST, a page of n rows n / (rows in the table) of it, rounded up,
+    so paginating does not get around the listing limit. The highest rowid stands for the size of
+    the table: unlike COUNT(*) it is read without scanning the table, so every page costs the
+    same to price. It overestimates the rows by the rowids deleted vehicles left unused, then a
+    walk of every page costs COUNT(*) / MAX(rowid) of a full listing.
+    """
+    _, per_page, page_error = parse_page(request.args.get('cursor'), request.args.get('per_page'),
+                                         current_app.config['VEHICLE_MAX_PAGE_SIZE'])
+    if page_error:
+        # answered with a 400
+        return 1
+    if per_page is None:
+        return LISTING_COST
+    try:
+        rows = request_db().execute('SELECT MAX(rowid) FROM vehicles').fetchone()[0]
+    except sqlite3.Error:
+        return LISTING_COST
+    return min(math.ceil(LISTING_COST * per_page / rows), LISTING_COST) if rows else 1
+
+
+@vehicles.route('/vehicle', methods=['GET'])
+@rate_limit(listing_rate_limit, cost=listing_cost)
 def get_all_vehicles():
     logger.debug("Fetching all vehicles")
+    phase('validate')
 
     # Reject GET requests with any body data
     if request.content_length and request.content_length > 0:
         logger.error("GET request must not include a request body")
         return jsonify({'error': 'Request body is not allowed in GET request'}), 422
 
-    # per_page = int(request.args.get('per_page', 3))
-    # page = int(request.args.get('page', 1))
-    # offset = (page-1) * per_page
+    # Optional pagination, a page starts at the cursor the previous one returned
+    cursor, per_page, page_error = parse_page(request.args.get('cursor'), request.args.get('per_page'),
+                                              current_app.config['VEHICLE_MAX_PAGE_SIZE'])
+    if page_error:
+        logger.error(page_error)
+        return jsonify({'error': page_error}), 400
 
+    # Only read the columns the client asked for
+    fields, fields_error = parse_fields(request.args.get('fields'))
+    if fields_error:
+        logger.error(fields_error)
+        return jsonify({'error': fields_error}), 400
+
+    phase('db')
     try:
-        db = get_db()
-        cursor = db.execute("SELECT * FROM vehicles ",)
-        vehicles = [dict(row) for row in cursor.fetchall()]
-        return jsonify(vehicles), 200
+        db = request_db()
+        if per_page is None:
+            cursor = db.execute(f"SELECT {', '.join(fields)} FROM vehicles ",)
+            # rows are serialized directly by the JSON provider, no need to copy them into dicts
+            return jsonify(cursor.fetchall()), 200
+
+        # Keyset pagination: the cursor is the rowid a page starts at, found in the rowid b-tree,
+        # so every page costs the same however deep the walk. Pages are in rowid order, a vehicle
+        # inserted or deleted during a walk does not shift the other ones
+        rows = db.execute(f"SELECT {', '.join(fields)} FROM vehicles WHERE rowid >= ? ORDER BY rowid LIMIT ?",
+                          (cursor, per_page)).fetchall()
+        # the rowid of the first vehicle after the page, absent on the last page
+        next_row = db.execute('SELECT rowid FROM vehicles WHERE rowid >= ? ORDER BY rowid LIMIT 1 OFFSET ?',
+                              (cursor, per_page)).fetchone()
+        response = jsonify(rows)
+        if next_row is not None:
+            response.headers['X-Next-Cursor'] = str(next_row[0])
+        return response, 200
     except sqlite3.Error as e:
         logger.error('Database error')
         return jsonify({"error": "Internal server error. Please try again later."}), 500
@@ -64,10 +216,163 @@ def get_all_vehicles():
         return jsonify({"error": "Internal server error. Please try again later."}), 500
 
 
-@app.route('/vehicle', methods=['POST'])
-@limiter.limit("100/minute")
+@vehicles.route('/vehicle/stats', methods=['GET'])
+@rate_limit("100/minute")
+def get_vehicle_stats():
+    logger.debug('Computing vehicle statistics')
+    phase('validate')
+
+    # Optional grouping dimension
+    group_by = request.args.get('group_by')
+    if group_by is not None and group_by not in STATS_GROUP_BY_FIELDS:
+        logger.error(f'Invalid group_by field: {group_by}')
+        return jsonify({'error': f'group_by must be one of {STATS_GROUP_BY_FIELDS}'}), 400
+
+    # Optional top N vehicles by purchase price
+    top = request.args.get('top')
+    if top is not None:
+        if not top.isdigit() or not 1 <= int(top) <= MAX_STATS_TOP:
+            logger.error(f'Invalid top value: {top}')
+            return jsonify({'error': f'top must be an integer between 1 and {MAX_STATS_TOP}'}), 400
+        top = int(top)
+
+    phase('db')
+    try:
+        db = get_db()
+        total_vehicles, average_purchase_price = db.execute(
+            'SELECT COUNT(*), AVG(purchase_price) FROM vehicles').fetchone()
+
+        # Count and average horsepower per manufacturer, the most common one comes first
+        manufacturers = db.execute('''
+            SELECT manufacturer_name, COUNT(*) AS vehicle_count, AVG(horse_power) AS average_horse_power
+            FROM vehicles
+            GROUP BY manufacturer_name
+            ORDER BY vehicle_count DESC, manufacturer_name
+        ''').fetchall()
+        fuel_types = db.execute(
+            'SELECT fuel_type, COUNT(*) FROM vehicles GROUP BY fuel_type ORDER BY fuel_type').fetchall()
+        years = db.execute(
+            'SELECT model_year, AVG(purchase_price) FROM vehicles GROUP BY model_year ORDER BY model_year').fetchall()
+
+        stats = {
+            'total_vehicles': total_vehicles,
+            'most_common_manufacturer': manufacturers[0]['manufacturer_name'] if manufacturers else None,
+            'average_purchase_price': average_purchase_price,
+            'fuel_type_distribution': {fuel_type: count for fuel_type, count in fuel_types},
+            'average_horse_power_by_manufacturer': {
+                row['manufacturer_name']: row['average_horse_power'] for row in manufacturers},
+            'average_purchase_price_by_year': {str(year): price for year, price in years},
+        }
+
+        if group_by:
+            # group_by was checked against STATS_GROUP_BY_FIELDS, so it is safe to put in the SQL text
+            stats['groups'] = db.execute(f'''
+                SELECT {group_by} AS value, COUNT(*) AS count,
+                       AVG(purchase_price) AS average_purchase_price, AVG(horse_power) AS average_horse_power
+                FROM vehicles
+                GROUP BY {group_by}
+                ORDER BY {group_by}
+            ''').fetchall()
+
+        if top:
+            stats['top_by_price'] = db.execute('''
+                SELECT vin, manufacturer_name, model_name, model_year, purchase_price
+                FROM vehicles
+                ORDER BY purchase_price DESC
+                LIMIT ?
+            ''', (top,)).fetchall()
+
+        return jsonify(stats), 200
+
+    except sqlite3.Error as e:
+        logger.error(f'Database error while computing vehicle statistics: {e}')
+        return jsonify({'error': 'Database error'}), 500
+
+    except Exception as e:
+        logger.error(f'Server error while computing vehicle statistics: {e}')
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@vehicles.route('/vehicle/changes', methods=['GET'])
+@rate_limit("100/minute")
+def get_vehicle_changes():
+    logger.debug('Fetching vehicle changes')
+    phase('validate')
+
+    # Return the changes with a seq greater than `since`, oldest first
+    since = request.args.get('since', '0')
+    limit = request.args.get('limit', str(current_app.config['CHANGE_LOG_PAGE_SIZE']))
+    if not since.isdigit():
+        logger.error(f'Invalid since value: {since}')
+        return jsonify({'error': 'since must be a non-negative integer'}), 400
+    if not limit.isdigit() or not 1 <= int(limit) <= current_app.config['CHANGE_LOG_MAX_PAGE_SIZE']:
+        logger.error(f'Invalid limit value: {limit}')
+        return jsonify({'error': f'limit must be an integer between 1 and {current_app.config["CHANGE_LOG_MAX_PAGE_SIZE"]}'}), 400
+    since, limit = int(since), int(limit)
+
+    phase('db')
+    try:
+        db = get_db()
+        latest_seq = get_latest_change_seq(db)
+
+        # Changes the consumer has not seen were removed by retention, it has to re-fetch GET /vehicle
+        pruned_seq = get_pruned_change_seq(db)
+        if since < pruned_seq:
+            logger.error(f'Changes after {since} were pruned, the oldest available seq is {pruned_seq}')
+            return jsonify({'error': f'Changes up to seq {pruned_seq} were pruned, a full resync is required',
+                            'latest_seq': latest_seq}), 410
+
+        # Read one more row than requested to know whether there is another page
+        rows = db.execute('''
+            SELECT seq, vin, operation, vehicle, changed_at
+            FROM vehicle_changes
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?
+        ''', (since, limit + 1)).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        changes = [{
+            'seq': row['seq'],
+            'vin': row['vin'],
+            'operation': row['operation'],
+            'vehicle': current_app.json.loads(row['vehicle']) if row['vehicle'] is not None else None,
+            'changed_at': row['changed_at'],
+        } for row in rows]
+        return jsonify({
+            'changes': changes,
+            'next_since': changes[-1]['seq'] if changes else since,
+            'has_more': has_more,
+            'latest_seq': latest_seq,
+        }), 200
+
+    except sqlite3.Error as e:
+        logger.error(f'Database error while fetching vehicle changes: {e}')
+        return jsonify({'error': 'Database error'}), 500
+
+    except Exception as e:
+        logger.error(f'Server error while fetching vehicle changes: {e}')
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@vehicles.cli.command('compact-changes')
+def compact_changes_command():
+    """Compact the vehicle change log and prune changes older than CHANGE_LOG_RETENTION_DAYS."""
+    db = get_db()
+    try:
+        compacted = compact_change_log(db)
+        pruned = prune_change_log(db, current_app.config['CHANGE_LOG_RETENTION_DAYS'])
+    finally:
+        db.close()
+    logger.info(f'Change log compacted: {compacted} superseded and {pruned} expired changes removed')
+
+
+@vehicles.route('/vehicle', methods=['POST'])
+@rate_limit("100/minute")
 def add_vehicle():
     logger.debug('Received POST request')
+    phase('validate')
 
     # Ensure Content-Type is application/json
     if not request.is_json:
@@ -103,6 +408,7 @@ def add_vehicle():
         logger.error(f'Field validation errors: {field_errors}')
         return jsonify({'error': f'Error validate fields: {field_errors}'}), 422
 
+    phase('db')
     try:
         db = get_db()
 
@@ -136,26 +442,33 @@ def add_vehicle():
         return jsonify({'error': 'Internal server error'}), 500
 
 
-@app.route('/vehicle/<vin>', methods=['GET'])
-@limiter.limit("100/minute")  
+@vehicles.route('/vehicle/<vin>', methods=['GET'])
+@rate_limit("100/minute")  
 def get_vehicle(vin):
     logger.debug(f'Fetching a vehicle with VIN: {vin}')
+    phase('validate')
 
     # Validate VIN
     if not validate_vin(vin):
         logger.error('Invalid VIN format ')
         return jsonify({'error': 'VIN format is not valid'}), 400
+
+    # Only read the columns the client asked for
+    fields, fields_error = parse_fields(request.args.get('fields'))
+    if fields_error:
+        logger.error(fields_error)
+        return jsonify({'error': fields_error}), 400
     
+    phase('db')
     try:
         db = get_db()
-        cursor = db.execute('SELECT * FROM vehicles WHERE vin = ? LIMIT 1', (vin,))
+        cursor = db.execute(f'SELECT {", ".join(fields)} FROM vehicles WHERE vin = ? LIMIT 1', (vin,))
         row = cursor.fetchone()
         if not row:
             logger.error(f'VIN not found: {vin}')
             return jsonify({'error': 'Vehicle not found'}), 404
-        data = dict(row)
         logger.info(f'Successfully fetched vehicle with VIN: {vin}')
-        return jsonify(data), 200
+        return jsonify(row), 200
     
     except sqlite3.Error as e:
         logger.error(f'Database error when fetching vehicle with VIN {vin}: {e}')
@@ -166,10 +479,11 @@ def get_vehicle(vin):
         return jsonify({'error': 'Internal server error'}), 500
     
 
-@app.route('/vehicle/<vin>', methods=['PUT'])
-@limiter.limit("100/minute")
+@vehicles.route('/vehicle/<vin>', methods=['PUT'])
+@rate_limit("100/minute")
 def update_vehicle(vin):
     logger.debug(f'Received PUT request for VIN: {vin}')
+    phase('validate')
 
     # Ensure Content-Type is application/json
     if not request.is_json:
@@ -209,6 +523,7 @@ def update_vehicle(vin):
         logger.error(f'Field validation errors: {field_errors}')
         return jsonify({'error': field_errors}), 422
 
+    phase('db')
     try:
         db = get_db()
 
@@ -240,10 +555,11 @@ def update_vehicle(vin):
         logger.error(f'Server error: {e}')
         return jsonify({'error': 'Server error'}), 500
 
-@app.route('/vehicle/<vin>', methods=['DELETE'])
-@limiter.limit("10/minute") 
+@vehicles.route('/vehicle/<vin>', methods=['DELETE'])
+@rate_limit("10/minute") 
 def delete_vehicle(vin):
     logger.debug(f'Received DELETE request for vehicle with VIN: {vin}')
+    phase('validate')
 
     # Validate VIN
     if not validate_vin(vin):
@@ -255,6 +571,7 @@ def delete_vehicle(vin):
         logger.error('DELETE request must not include a request body')
         return jsonify({'error': 'Request body is not allowed in DELETE request'}), 422
 
+    phase('db')
     try:
         db = get_db()
 
@@ -278,8 +595,9 @@ def delete_vehicle(vin):
         return jsonify({'error': 'Internal server error'}), 500
 
 
-@app.route('/vehicle/<vin>' , methods=['PATCH'])
+@vehicles.route('/vehicle/<vin>' , methods=['PATCH'])
 def patch_vehicle(vin):
+    phase('validate')
     #validate vin
     if not validate_vin(vin):
         return jsonify({'error':{'Error validating vin '}}),400
@@ -318,6 +636,7 @@ def patch_vehicle(vin):
     set_clauses = ','.join(set_clauses)   #convert to string and get rid of trailing comma
     params.append(data['vin'])
 
+    phase('db')
     try:
         query = f'update vehicles set {set_clauses} where vin = ?'
         db = get_db()
@@ -341,6 +660,44 @@ def validate_vin(vin):
     return True
 
 
+def parse_fields(fields_param):
+    """
+    Parse the ?fields=vin,model_name,... query parameter into the list of columns to SELECT.
+    Every requested field is checked against REQUIRED_FIELDS (the vehicles columns), which is
+    what makes it safe to put them in the SQL text. Returns (fields, error message or None).
+    When the parameter is missing every column is returned.
+    """
+    if fields_param is None:
+        return REQUIRED_FIELDS, None
+
+    # keep the order the client asked for, drop duplicates
+    fields = list(dict.fromkeys(field.strip() for field in fields_param.split(',') if field.strip()))
+    if not fields:
+        return None, 'fields parameter must list at least one field'
+
+    unknown_fields = [field for field in fields if field not in REQUIRED_FIELDS]
+    if unknown_fields:
+        return None, f'Unknown fields: {unknown_fields}'
+    return fields, None
+
+
+def parse_page(cursor_param, per_page_param, max_per_page):
+    """
+    Parse the ?cursor= and ?per_page= query parameters. Returns (cursor, per_page, error message or None),
+    per_page is None when the listing is not paginated. The first page has no cursor, per_page
+    defaults to max_per_page when only a cursor is given.
+    """
+    if cursor_param is None and per_page_param is None:
+        return None, None, None
+    cursor_param = '0' if cursor_param is None else cursor_param
+    per_page_param = str(max_per_page) if per_page_param is None else per_page_param
+    if not cursor_param.isdigit():
+        return None, None, 'cursor must be the X-Next-Cursor of the previous page'
+    if not per_page_param.isdigit() or not 1 <= int(per_page_param) <= max_per_page:
+        return None, None, f'per_page must be an integer between 1 and {max_per_page}'
+    return int(cursor_param), int(per_page_param), None
+
+
 def find_missing_fields(data, required_fields):
     missing_fields = [field for field in required_fields if field not in data]
     return missing_fields
@@ -392,4 +749,4 @@ def get_field_errors(data):
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,81 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "SERVER_TIMING_ENABLED": os.environ.get("SERVER_TIMING_ENABLED", "1").lower() in ("1", "true", "yes"),
+    # Also log the phases of every request, not only send them to the client
+    "SERVER_TIMING_LOG": os.environ.get("SERVER_TIMING_LOG", "").lower() in ("1", "true", "yes"),
+}
+
+
+def phase(name):
+    """
+    End the running phase of the current request and start `name` (None just ends it).
+    A request goes through its phases one after the other, so they never overlap and
+    a phase entered several times adds up. Does nothing outside of a timed request.
+    """
+    if not has_request_context():
+        return
+    timings = g.get("_server_timings")
+    if timings is None:
+        return
+    now = time.perf_counter()
+    running, start = g._server_phase
+    if running is not None:
+        timings[running] = timings.get(running, 0.0) + now - start
+    g._server_phase = (name, now)
+
+
+@contextmanager
+def timed(name):
+    """Time the block as the `name` phase, then go back to the phase that was running before."""
+    previous = g._server_phase[0] if has_request_context() and g.get("_server_timings") is not None else None
+    phase(name)
+    try:
+        yield
+    finally:
+        phase(previous)
+
+
+def start_request_timer():
+    g._server_timings = {}
+    g._server_phase = (None, 0.0)
+    g._server_timing_start = time.perf_counter()
+
+
+def format_server_timing(timings, total):
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+def add_server_timing_header(response):
+    if g.get("_server_timings") is None:
+        return response
+    phase(None)
+    timings, g._server_timings = g._server_timings, None
+    header = format_server_timing(timings, time.perf_counter() - g._server_timing_start)
+    response.headers["Server-Timing"] = header
+    if current_app.config["SERVER_TIMING_LOG"]:
+        logger.info(f"{request.method} {request.path} {response.status_code} {header}")
+    return response
+
+
+def init_server_timing(app):
+    """
+    Send a Server-Timing header (https://www.w3.org/TR/server-timing/) with the duration of
+    each phase of the request, as marked with phase() and timed(), plus the total.
+    Register this before init_compression so compressing the body is part of the total.
+    """
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    if not app.config["SERVER_TIMING_ENABLED"]:
+        return
+    app.before_request(start_request_timer)
+    app.after_request(add_server_timing_header)
@@ -0,0 +1,78 @@
+"""
+Compare serialization of GET /vehicle listings with Flask's default JSON provider
+and the app's VehicleJSONProvider.
+
+Run from vehicle-api-server:
+    python -m benchmarks.bench_json_provider --rows 1000 100000 1000000
+"""
+import argparse
+import random
+import sqlite3
+import string
+import time
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from app import json_provider
+from app.json_provider import VehicleJSONProvider
+
+
+def build_rows(count, seed=0):
+    rng = random.Random(seed)
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    db.execute('''CREATE TABLE vehicles (
+        vin TEXT PRIMARY KEY COLLATE NOCASE,
+        manufacturer_name TEXT NOT NULL,
+        description TEXT NOT NULL,
+        horse_power INTEGER NOT NULL,
+        model_name TEXT NOT NULL,
+        model_year INTEGER NOT NULL,
+        purchase_price REAL NOT NULL,
+        fuel_type TEXT NOT NULL
+    )''')
+    manufacturers = ["Toyota", "Honda", "Ford", "Chevrolet", "Nissan"]
+    db.executemany(
+        'INSERT OR IGNORE INTO vehicles VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (
+            (''.join(rng.choices(string.ascii_uppercase + string.digits, k=17)),
+             manufacturer, f"A reliable {manufacturer} vehicle", rng.randint(100, 400),
+             "Model", rng.randint(2000, 2025), round(rng.uniform(15000, 50000), 2), "Gasoline")
+            for manufacturer in (rng.choice(manufacturers) for _ in range(count))
+        ),
+    )
+    return db.execute('SELECT * FROM vehicles').fetchall()
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(row_counts, repeat):
+    app = Flask(__name__)
+    stdlib = DefaultJSONProvider(app)
+    fast = VehicleJSONProvider(app)
+
+    print(f"orjson available: {json_provider.orjson is not None}")
+    print(f"{'rows':>10} {'stdlib + dict(row)':>20} {'provider':>12} {'speedup':>8}")
+    with app.app_context():
+        for count in row_counts:
+            rows = build_rows(count)
+            # The old code path: copy every row into a dict, then serialize with the stdlib provider
+            baseline = best_of(lambda: stdlib.response([dict(row) for row in rows]), repeat)
+            provider = best_of(lambda: fast.response(rows), repeat)
+            print(f"{count:>10} {baseline * 1000:>18.1f}ms {provider * 1000:>10.1f}ms {baseline / provider:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization of vehicle listings")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
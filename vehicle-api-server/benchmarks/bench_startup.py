@@ -0,0 +1,80 @@
+"""
+Startup time of both servers: importing the module, create_app() and the first request.
+Every sample runs in a fresh interpreter so nothing is cached between them, and the median
+of the samples is compared against a saved baseline like the microbenchmarks.
+
+Run from vehicle-api-server:
+    python -m benchmarks.bench_startup --save     # record a baseline
+    python -m benchmarks.bench_startup            # compare against it, exit 1 on regression
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.microbench import check_baseline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'startup_baseline.json')
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter, prints the phase timings in nanoseconds as JSON
+CHILD = '''
+import json, sys, time
+start = time.perf_counter_ns()
+from app.{module} import create_app
+imported = time.perf_counter_ns()
+app = create_app({{'DATABASE': sys.argv[1], 'LOG_FILE': None, 'LOG_LEVEL': 'WARNING'}})
+created = time.perf_counter_ns()
+response = app.test_client().{request}
+assert response.status_code == 200, response.status_code
+requested = time.perf_counter_ns()
+print(json.dumps({{'import': imported - start, 'create_app': created - imported,
+                  'first_request': requested - created, 'total': requested - start}}))
+'''
+
+SERVERS = {
+    'rest': CHILD.format(module='server', request="get('/vehicle?fields=vin')"),
+    'graphql': CHILD.format(module='graphql_server', request="post('/graphql', json={'query': '{ vehicles { vin } }'})"),
+}
+
+
+def sample(code, database):
+    """One cold start. Besides the phases, `process` is the wall time of the whole interpreter."""
+    start = time.perf_counter_ns()
+    result = subprocess.run([sys.executable, '-c', code, database], cwd=PROJECT_DIR,
+                            capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process'] = time.perf_counter_ns() - start
+    return timings
+
+
+def run(samples, database):
+    """benchmark name -> median nanoseconds over `samples` cold starts"""
+    results = {}
+    for server, code in SERVERS.items():
+        timings = [sample(code, database) for _ in range(samples)]
+        for phase in timings[0]:
+            results[f'{server}.{phase}'] = statistics.median(t[phase] for t in timings)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start time of the servers")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file to compare against or save to")
+    parser.add_argument('--save', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="fail when a phase is slower than the baseline by more than this fraction")
+    parser.add_argument('--samples', type=int, default=9, help="cold starts per server")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args.samples, os.path.join(tmp, 'vehicles.db'))
+    return check_baseline(results, args.baseline, args.save, args.threshold, label='phase', width=24)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
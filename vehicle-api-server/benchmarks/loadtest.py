@@ -0,0 +1,327 @@
+"""
+Load test the REST and GraphQL servers with a weighted mix of operations.
+
+Start the server(s) first, the REST one without its rate limits, which would otherwise answer
+most of the requests with a 429 (list is limited to 100 an hour and delete to 10 a minute):
+    python restAPI_run.py --no-rate-limit
+    python graphql_run.py
+then from vehicle-api-server:
+    python -m benchmarks.loadtest --target rest --concurrency 16 --duration 30 \
+        --mix list=1,get=10,create=3,update=2,patch=2,delete=1 --output loadtest.json
+
+The report (throughput, p50/p95/p99 latency and error rates, overall and per operation)
+is printed as JSON and optionally written to --output. Rate limited (429) responses are counted
+apart from the errors and left out of the throughput and latencies, they measure the limiter.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from fire_data_into_database import generate_vehicle
+
+OPERATIONS = ["list", "get", "create", "update", "patch", "delete"]
+# GraphQL has no partial update mutation
+GRAPHQL_OPERATIONS = ["list", "get", "create", "update", "delete"]
+
+VEHICLE_FIELDS = "vin manufacturerName description horsePower modelName modelYear purchasePrice fuelType"
+
+
+def make_vehicle(rng, vin=None):
+    vehicle = generate_vehicle(rng)
+    if vin:
+        vehicle["vin"] = vin
+    return vehicle
+
+
+class VinPool:
+    """
+    VINs created during the run, shared by the workers so reads and writes hit existing rows.
+    A worker takes a VIN out of the pool for the time of its request and adds it back after,
+    unless it deleted it: no other worker can delete a vehicle while it is being read or
+    updated, which would turn that request into a 404 counted as an error.
+    """
+
+    def __init__(self):
+        self._vins = []
+        self._lock = threading.Lock()
+
+    def add(self, vin):
+        with self._lock:
+            self._vins.append(vin)
+
+    def take(self, rng):
+        with self._lock:
+            if not self._vins:
+                return None
+            index = rng.randrange(len(self._vins))
+            self._vins[index], self._vins[-1] = self._vins[-1], self._vins[index]
+            return self._vins.pop()
+
+
+class RestClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def list(self, rng, vin):
+        return self.session.get(f"{self.base_url}/vehicle")
+
+    def get(self, rng, vin):
+        return self.session.get(f"{self.base_url}/vehicle/{vin}")
+
+    def create(self, rng, vin):
+        return self.session.post(f"{self.base_url}/vehicle", json=make_vehicle(rng, vin))
+
+    def update(self, rng, vin):
+        return self.session.put(f"{self.base_url}/vehicle/{vin}", json=make_vehicle(rng, vin))
+
+    def patch(self, rng, vin):
+        return self.session.patch(f"{self.base_url}/vehicle/{vin}",
+                                  json={"vin": vin, "horse_power": rng.randint(100, 400)})
+
+    def delete(self, rng, vin):
+        return self.session.delete(f"{self.base_url}/vehicle/{vin}")
+
+    @staticmethod
+    def is_error(response):
+        return response.status_code >= 400
+
+
+class GraphQLClient:
+    def __init__(self, url):
+        self.url = url
+        self.session = requests.Session()
+
+    def _execute(self, query, variables=None):
+        return self.session.post(self.url, json={"query": query, "variables": variables or {}})
+
+    def _vehicle_mutation(self, name, vehicle):
+        return self._execute(
+            f"""mutation($vin: String!, $manufacturerName: String!, $description: String!, $horsePower: Int!,
+                         $modelName: String!, $modelYear: Int!, $purchasePrice: Float!, $fuelType: String!) {{
+                {name}(vin: $vin, manufacturerName: $manufacturerName, description: $description,
+                       horsePower: $horsePower, modelName: $modelName, modelYear: $modelYear,
+                       purchasePrice: $purchasePrice, fuelType: $fuelType) {{ vin }}
+            }}""",
+            {
+                "vin": vehicle["vin"], "manufacturerName": vehicle["manufacturer_name"],
+                "description": vehicle["description"], "horsePower": vehicle["horse_power"],
+                "modelName": vehicle["model_name"], "modelYear": vehicle["model_year"],
+                "purchasePrice": vehicle["purchase_price"], "fuelType": vehicle["fuel_type"],
+            },
+        )
+
+    def list(self, rng, vin):
+        return self._execute(f"{{ vehicles {{ {VEHICLE_FIELDS} }} }}")
+
+    def get(self, rng, vin):
+        return self._execute(f"query($vin: String!) {{ vehicle(vin: $vin) {{ {VEHICLE_FIELDS} }} }}", {"vin": vin})
+
+    def create(self, rng, vin):
+        return self._vehicle_mutation("createVehicle", make_vehicle(rng, vin))
+
+    def update(self, rng, vin):
+        return self._vehicle_mutation("updateVehicle", make_vehicle(rng, vin))
+
+    def delete(self, rng, vin):
+        return self._execute("mutation($vin: String!) { deleteVehicle(vin: $vin) }", {"vin": vin})
+
+    @staticmethod
+    def is_error(response):
+        if response.status_code >= 400:
+            return True
+        try:
+            return bool(response.json().get("errors"))
+        except ValueError:
+            return True
+
+
+def parse_mix(mix, allowed):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}, expected one of {OPERATIONS}")
+        if name in allowed and float(weight or 1) > 0:
+            weights[name] = float(weight or 1)
+    if not weights:
+        raise argparse.ArgumentTypeError("The operation mix is empty")
+    return weights
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def parse_server_timing(header):
+    """Server-Timing header -> {phase: milliseconds}, e.g. "db;dur=1.2, total;dur=3.4"."""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
+
+
+def summarize_server_timing(results):
+    # mean and p95 of every phase the server reported, in milliseconds
+    by_phase = defaultdict(list)
+    for result in results:
+        for name, duration in result[4].items():
+            by_phase[name].append(duration)
+    summary = {}
+    for name, durations in by_phase.items():
+        durations.sort()
+        summary[name] = {"mean": round(sum(durations) / len(durations), 3),
+                         "p95": round(percentile(durations, 95), 3)}
+    return summary
+
+
+def summarize_results(results, elapsed):
+    # results are (operation, latency in seconds, error, rate limited, server timing) tuples,
+    # a rate limited request is not an error and is not served
+    served = [result for result in results if not result[3]]
+    latencies = sorted(result[1] for result in served)
+    errors = sum(result[2] for result in served)
+    rate_limited = len(results) - len(served)
+    count = len(latencies)
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "requests": len(results),
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "rate_limited": rate_limited,
+        "rate_limited_rate": round(rate_limited / len(results), 4) if results else 0.0,
+        "latency_ms": {
+            "mean": to_ms(sum(latencies) / count) if count else None,
+            "p50": to_ms(percentile(latencies, 50)),
+            "p95": to_ms(percentile(latencies, 95)),
+            "p99": to_ms(percentile(latencies, 99)),
+            "max": to_ms(latencies[-1]) if count else None,
+        },
+        "server_timing_ms": summarize_server_timing(served),
+    }
+
+
+def worker(client, weights, pool, deadline, seed, results):
+    rng = random.Random(seed)
+    names, operation_weights = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        operation = rng.choices(names, operation_weights)[0]
+        vin = pool.take(rng) if operation in ("get", "update", "patch", "delete") else None
+        # Nothing to read or modify yet, create a vehicle instead
+        if operation != "list" and vin is None:
+            operation = "create"
+        if operation == "create":
+            vin = make_vehicle(rng)["vin"]
+
+        start = time.perf_counter()
+        try:
+            response = getattr(client, operation)(rng, vin)
+            elapsed = time.perf_counter() - start
+            limited = response.status_code == 429
+            error = not limited and client.is_error(response)
+            timings = parse_server_timing(response.headers.get("Server-Timing"))
+        except requests.RequestException:
+            elapsed = time.perf_counter() - start
+            error, limited, timings = True, False, {}
+
+        # a created vehicle joins the pool, a taken one goes back unless it was deleted
+        served = not error and not limited
+        if operation == "create" and served or operation in ("get", "update", "patch") \
+                or operation == "delete" and not served:
+            pool.add(vin)
+        results.append((operation, elapsed, error, limited, timings))
+
+
+def run(target, url, weights, concurrency, duration, preload, seed):
+    client_class = RestClient if target == "rest" else GraphQLClient
+    pool = VinPool()
+
+    # Preload some vehicles so reads and updates have rows to work on, these are not measured
+    rng = random.Random(seed)
+    loader = client_class(url)
+    for _ in range(preload):
+        vin = make_vehicle(rng)["vin"]
+        if not loader.is_error(loader.create(rng, vin)):
+            pool.add(vin)
+
+    results = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=worker, args=(client_class(url), weights, pool, deadline, seed + i + 1, results))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    by_operation = defaultdict(list)
+    for result in results:
+        by_operation[result[0]].append(result)
+
+    return {
+        "target": target,
+        "url": url,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "mix": weights,
+        "seed": seed,
+        **summarize_results(results, elapsed),
+        "operations": {
+            operation: summarize_results(operation_results, elapsed)
+            for operation, operation_results in sorted(by_operation.items())
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the vehicle REST and GraphQL servers")
+    parser.add_argument("--target", choices=["rest", "graphql", "both"], default="rest")
+    parser.add_argument("--rest-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--graphql-url", default="http://127.0.0.1:5001/graphql")
+    parser.add_argument("--mix", default="list=1,get=10,create=3,update=2,patch=2,delete=1",
+                        help="comma separated operation=weight pairs")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run each target for")
+    parser.add_argument("--preload", type=int, default=50, help="vehicles to create before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    targets = ["rest", "graphql"] if args.target == "both" else [args.target]
+    reports = []
+    for target in targets:
+        allowed = OPERATIONS if target == "rest" else GRAPHQL_OPERATIONS
+        try:
+            weights = parse_mix(args.mix, allowed)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+        url = args.rest_url if target == "rest" else args.graphql_url
+        reports.append(run(target, url, weights, args.concurrency, args.duration, args.preload, args.seed))
+
+    report = json.dumps(reports if len(reports) > 1 else reports[0], indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
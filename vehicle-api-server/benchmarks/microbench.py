@@ -0,0 +1,176 @@
+"""
+Microbenchmarks for the request hot paths: validation helpers, row conversion,
+JSON serialization of listings and Vehicle construction in the GraphQL resolvers.
+
+Run from vehicle-api-server:
+    python -m benchmarks.microbench --save        # record a baseline
+    python -m benchmarks.microbench               # compare against it, exit 1 on regression
+
+Timings are machine specific, so record the baseline on the machine that runs the comparison.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import timeit
+from unittest.mock import patch
+
+from flask import Flask
+
+from benchmarks.bench_json_provider import build_rows
+from app import graphql_server
+from app.json_provider import VehicleJSONProvider
+from app.server import validate_vin, get_field_errors, find_missing_fields, REQUIRED_FIELDS
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'microbench_baseline.json')
+
+VEHICLE = {
+    "vin": "1HGCM82633A123459",
+    "manufacturer_name": "Honda",
+    "description": "Reliable sedan",
+    "horse_power": 150,
+    "model_name": "Accord",
+    "model_year": 2020,
+    "purchase_price": 25000.50,
+    "fuel_type": "Gasoline"
+}
+
+
+def rows_db(count):
+    # in-memory database holding `count` vehicles, shared by the row based benchmarks
+    rows = build_rows(count)
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute('''CREATE TABLE vehicles (
+        vin TEXT PRIMARY KEY COLLATE NOCASE, manufacturer_name TEXT NOT NULL, description TEXT NOT NULL,
+        horse_power INTEGER NOT NULL, model_name TEXT NOT NULL, model_year INTEGER NOT NULL,
+        purchase_price REAL NOT NULL, fuel_type TEXT NOT NULL)''')
+    db.executemany('INSERT INTO vehicles VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [tuple(row) for row in rows])
+    return db, rows
+
+
+# Only the JSON provider is exercised, a bare app avoids create_app() touching the database
+app = Flask(__name__)
+app.json = VehicleJSONProvider(app)
+
+
+def jsonify_listing(rows):
+    with app.app_context():
+        return app.json.response(rows)
+
+
+def build_vehicles(rows):
+    return [graphql_server.Vehicle(**{field: row[field] for field in REQUIRED_FIELDS}) for row in rows]
+
+
+def benchmarks():
+    """Name -> zero argument callable. Each call is one operation."""
+    db_1k, rows_1k = rows_db(1000)
+    _, rows_10 = rows_db(10)
+    _, rows_10k = rows_db(10000)
+    missing = {key: value for key, value in VEHICLE.items() if key != "fuel_type"}
+
+    def resolve_vehicles():
+        with patch.object(graphql_server, 'get_db', return_value=db_1k):
+            return graphql_server.resolve_vehicles()
+
+    return {
+        "validate_vin.valid": lambda: validate_vin("1HGCM82633A123459"),
+        "validate_vin.invalid": lambda: validate_vin("1HGCM82633A12345!"),
+        "get_field_errors.valid": lambda: get_field_errors(VEHICLE),
+        "get_field_errors.invalid": lambda: get_field_errors({**VEHICLE, "horse_power": "abc", "model_name": " "}),
+        "find_missing_fields": lambda: find_missing_fields(missing, REQUIRED_FIELDS),
+        "row_to_dict.1k": lambda: [dict(row) for row in rows_1k],
+        "jsonify.10": lambda: jsonify_listing(rows_10),
+        "jsonify.1k": lambda: jsonify_listing(rows_1k),
+        "jsonify.10k": lambda: jsonify_listing(rows_10k),
+        "graphql.vehicle_construction.1k": lambda: build_vehicles(rows_1k),
+        "graphql.resolve_vehicles.1k": resolve_vehicles,
+    }
+
+
+def measure(func, repeat):
+    """Best time per call in nanoseconds, taking the minimum over `repeat` autoranged runs."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def compare(results, baseline, threshold):
+    """Return (name, baseline ns, current ns, ratio, regressed) for every benchmark in the baseline."""
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            rows.append((name, None, current, None, False))
+            continue
+        ratio = current / previous
+        rows.append((name, previous, current, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def format_ns(value):
+    if value is None:
+        return '-'
+    for unit, scale in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if value >= scale:
+            return f'{value / scale:.2f}{unit}'
+    return f'{value:.0f}ns'
+
+
+def check_baseline(results, baseline_path, save, threshold, label='benchmark', width=36):
+    """
+    Save the results (name -> nanoseconds) as the baseline with --save, otherwise print them next
+    to the baseline. Returns the exit status, 1 when one of them regressed by more than `threshold`.
+    """
+    if save:
+        with open(baseline_path, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': results}, f, indent=2, sort_keys=True)
+        for name, value in results.items():
+            print(f'{name:<{width}} {format_ns(value):>10}')
+        print(f'Baseline saved to {baseline_path}')
+        return 0
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)['results']
+    else:
+        print(f'No baseline at {baseline_path}, run with --save to record one')
+
+    regressions = 0
+    print(f'{label:<{width}} {"baseline":>10} {"current":>10} {"change":>8}')
+    for name, previous, current, ratio, regressed in compare(results, baseline, threshold):
+        change = f'{(ratio - 1) * 100:+.1f}%' if ratio is not None else 'new'
+        print(f'{name:<{width}} {format_ns(previous):>10} {format_ns(current):>10} {change:>8}'
+              f'{"  REGRESSION" if regressed else ""}')
+        regressions += regressed
+
+    if regressions:
+        print(f'{regressions} {label}(s) regressed by more than {threshold:.0%}')
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the hot path microbenchmarks")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file to compare against or save to")
+    parser.add_argument('--save', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="fail when a benchmark is slower than the baseline by more than this fraction")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default='', help="only run benchmarks whose name contains this text")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, func in benchmarks().items():
+        if args.filter in name:
+            results[name] = measure(func, args.repeat)
+    return check_baseline(results, args.baseline, args.save, args.threshold)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Performance regression gate. Runs a fixed scenario suite against freshly seeded SQLite
+databases, appends the results to a history file and compares them with the rolling
+baseline of the previous runs on the same machine.
+
+Run from vehicle-api-server:
+    python -m benchmarks.regression                       # run, record and compare
+    python -m benchmarks.regression --sizes 1000 --no-record
+
+A scenario fails when it is slower than the median of the last --window runs by more than
+--mad-factor times their (scaled) median absolute deviation and by more than --threshold.
+The MAD term absorbs the normal run to run noise, the threshold stops a perfectly quiet
+history from flagging every small change. Scenarios with fewer than --min-runs previous
+runs are reported but cannot fail yet. Exits with 1 when a scenario fails.
+
+Runs that failed the gate are recorded but left out of the baseline, so a regression that
+stays keeps failing instead of becoming the new normal after --window runs. A slowdown that
+is intended is made the new baseline by recording the run with --accept. The history file is
+ignored by git, its timings only hold for the machine that recorded them.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.microbench import format_ns
+from fire_data_into_database import generate_vehicle
+from seed_database import seed_database
+
+DEFAULT_HISTORY = os.path.join(os.path.dirname(__file__), 'regression_history.jsonl')
+LOOKUPS = 100
+WRITES = 100
+
+GRAPHQL_LIST = '{ vehicles { vin manufacturerName modelName modelYear horsePower purchasePrice fuelType } }'
+GRAPHQL_GET = 'query ($vin: String!) { vehicle(vin: $vin) { vin manufacturerName purchasePrice } }'
+
+
+def create_apps(database):
+    from app import graphql_server, server
+    config = {'TESTING': True, 'DATABASE': database, 'LOG_FILE': None, 'LOG_LEVEL': 'WARNING',
+              'RATELIMIT_ENABLED': False, 'SERVER_TIMING_ENABLED': False, 'COMPRESS_ENABLED': False}
+    return server.create_app(config).test_client(), graphql_server.create_app(config).test_client()
+
+
+def check(response):
+    assert response.status_code in (200, 201), f'{response.status_code}: {response.get_data(as_text=True)[:200]}'
+    return response
+
+
+def scenarios(size, rest, graphql, vins, rng):
+    """Scenario name -> (zero argument callable, operations per call)."""
+    def lookups():
+        for vin in vins:
+            check(rest.get(f'/vehicle/{vin}'))
+
+    # single-row POSTs one after the other, the API has no batch insert to measure
+    def sequential_creates():
+        for _ in range(WRITES):
+            check(rest.post('/vehicle', json=generate_vehicle(rng)))
+
+    def graphql_lookups():
+        for vin in vins:
+            check(graphql.post('/graphql', json={'query': GRAPHQL_GET, 'variables': {'vin': vin}}))
+
+    # writes come last so the reads see exactly `size` rows
+    return {
+        f'rest.list.{size}': (lambda: check(rest.get('/vehicle')), 1),
+        f'rest.get.{size}': (lookups, len(vins)),
+        f'graphql.list.{size}': (lambda: check(graphql.post('/graphql', json={'query': GRAPHQL_LIST})), 1),
+        f'graphql.get.{size}': (graphql_lookups, len(vins)),
+        f'rest.create.{size}': (sequential_creates, WRITES),
+    }
+
+
+def run_suite(sizes, repeat, seed):
+    """scenario name -> median seconds per operation over `repeat` runs"""
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            database = os.path.join(tmp, 'vehicles.db')
+            # the seeder and init_db report their progress on stdout, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                seed_database(size, seed=seed, database=database)
+                rest, graphql = create_apps(database)
+
+            step = max(size // LOOKUPS, 1)
+            vins = [row['vin'] for row in check(rest.get('/vehicle?fields=vin')).json[::step][:LOOKUPS]]
+            # a different stream than the seeder's, so the written VINs do not collide with the seeded ones
+            rng = random.Random(seed + 1)
+            for name, (func, operations) in scenarios(size, rest, graphql, vins, rng).items():
+                # one unmeasured call first, the first request of an app pays for lazy imports and caches
+                func()
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    func()
+                    samples.append((time.perf_counter() - start) / operations)
+                results[name] = statistics.median(samples)
+                print(f'{name:<24} {format_ns(results[name] * 1e9):>10}', file=sys.stderr)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def baseline_stats(history, name, window):
+    """Median and scaled MAD of `name` over the last `window` passed runs that have it, or None."""
+    values = [run['results'][name] for run in history
+              if run.get('passed', True) and name in run['results']][-window:]
+    if not values:
+        return None
+    median = statistics.median(values)
+    # 1.4826 scales the MAD to a standard deviation for normally distributed noise
+    mad = statistics.median(abs(value - median) for value in values) * 1.4826
+    return median, mad, len(values)
+
+
+def compare(results, history, window, mad_factor, threshold, min_runs):
+    """
+    Return (name, baseline median, current, ratio, allowed ratio, status) for every scenario,
+    status is PASS, FAIL, or NEW while the history holds fewer than min_runs runs of it.
+    """
+    rows = []
+    for name, current in results.items():
+        stats = baseline_stats(history, name, window)
+        if stats is None:
+            rows.append((name, None, current, None, None, 'NEW'))
+            continue
+        median, mad, runs = stats
+        limit = median + max(mad_factor * mad, threshold * median)
+        status = 'NEW' if runs < min_runs else 'FAIL' if current > limit else 'PASS'
+        rows.append((name, median, current, current / median, limit / median, status))
+    return rows
+
+
+def trend_table(history, results, runs):
+    lines = []
+    columns = [run.get('commit') or run['timestamp'][:10] for run in history[-runs:]] + ['current']
+    lines.append(f'{"scenario":<24}' + ''.join(f'{column:>11}' for column in columns))
+    for name, current in results.items():
+        values = [run['results'].get(name) for run in history[-runs:]] + [current]
+        lines.append(f'{name:<24}' + ''.join(
+            f'{format_ns(value * 1e9) if value is not None else "-":>11}' for value in values))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the scenario suite and compare it with the stored history")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="table sizes to seed and run the scenarios against")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of every scenario, the median is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help="JSON lines file holding the previous runs")
+    parser.add_argument('--window', type=int, default=10, help="previous runs the baseline is computed from")
+    parser.add_argument('--mad-factor', type=float, default=3.0)
+    parser.add_argument('--min-runs', type=int, default=3, help="previous runs needed before a scenario can fail")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="smallest slowdown, as a fraction of the baseline, that can fail a scenario")
+    parser.add_argument('--trend', type=int, default=8, help="previous runs shown in the trend table")
+    parser.add_argument('--no-record', action='store_true', help="do not append this run to the history")
+    parser.add_argument('--accept', action='store_true',
+                        help="record this run as passed, so an intended slowdown becomes part of the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.repeat, args.seed)
+    machine = {'python': platform.python_version(), 'machine': platform.machine(), 'node': platform.node()}
+    # timings are only comparable with runs on the same machine and interpreter
+    history = [run for run in load_history(args.history) if run.get('environment') == machine]
+
+    print(f'{"scenario":<24} {"baseline":>10} {"current":>10} {"change":>8} {"allowed":>8}  result')
+    failures = 0
+    for name, median, current, ratio, allowed, status in compare(
+            results, history, args.window, args.mad_factor, args.threshold, args.min_runs):
+        if ratio is None:
+            print(f'{name:<24} {"-":>10} {format_ns(current * 1e9):>10} {"-":>8} {"-":>8}  {status}')
+            continue
+        print(f'{name:<24} {format_ns(median * 1e9):>10} {format_ns(current * 1e9):>10} '
+              f'{(ratio - 1) * 100:>+7.1f}% {(allowed - 1) * 100:>+7.1f}%  {status}')
+        failures += status == 'FAIL'
+
+    print()
+    print(trend_table(history, results, args.trend))
+
+    if not args.no_record:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(),
+                                'environment': machine, 'sizes': args.sizes, 'repeat': args.repeat,
+                                'passed': args.accept or not failures, 'results': results}, sort_keys=True) + '\n')
+
+    if failures:
+        print(f'\n{failures} scenario(s) regressed')
+        return 1
+    print('\nNo regressions')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,10 @@ import requests
 import random
 import string
 import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests.adapters import HTTPAdapter
 
 post_url = "http://127.0.0.1:5000/vehicle"
 
@@ -20,30 +24,101 @@ models = {
 }
 fuel_types = ["Gasoline", "Diesel", "Electric", "Hybrid"]
 
+# Retry rate limited (and temporarily unavailable) responses with exponential backoff
+RETRY_STATUS_CODES = (429, 503)
+MAX_RETRIES = 8
+MAX_BACKOFF_SECONDS = 60
+
 # Generate random VIN
-def generate_vin():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=17))
-
-# Generate good random data into the DB
-def feed_good_data():
-    manufacturer = random.choice(manufacturers)
-    model_name = random.choice(models[manufacturer])
-    for _ in range(10):
-        data = {
-        "vin": generate_vin(),
+def generate_vin(rng=random):
+    return ''.join(rng.choices(string.ascii_uppercase + string.digits, k=17))
+
+# Generate one random vehicle, every record gets its own manufacturer and model
+def generate_vehicle(rng=random):
+    manufacturer = rng.choice(manufacturers)
+    model_name = rng.choice(models[manufacturer])
+    return {
+        "vin": generate_vin(rng),
         "manufacturer_name": manufacturer,
         "description": f"A reliable {manufacturer} {model_name} vehicle",
-        "horse_power": random.randint(100, 400),
+        "horse_power": rng.randint(100, 400),
         "model_name": model_name,
-        "model_year": random.randint(2000, 2025),
-        "purchase_price": round(random.uniform(15000, 50000), 2),
-        "fuel_type": random.choice(fuel_types)
-        }
-        response = requests.post(post_url, json=data)
-        if response.status_code == 201:
-            print("Successfully added vehicle")
-        else:
-            print("Failed to add vehicle")
+        "model_year": rng.randint(2000, 2025),
+        "purchase_price": round(rng.uniform(15000, 50000), 2),
+        "fuel_type": rng.choice(fuel_types)
+    }
+
+# One session per worker thread, requests sessions are not thread safe. They all mount the same
+# adapter, whose connection pool is thread safe, so the keep-alive connections are shared
+_thread_local = threading.local()
+
+def get_session(adapter):
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_local.session = session
+    return session
+
+def post_vehicle(session, url, data):
+    """POST one vehicle, backing off on rate limited responses. Returns the final status code (None on connection errors)."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = session.post(url, json=data)
+        except requests.RequestException:
+            return None
+        if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+            return response.status_code
+        retry_after = response.headers.get("Retry-After", "")
+        delay = float(retry_after) if retry_after.isdigit() else min(2 ** attempt * 0.5, MAX_BACKOFF_SECONDS)
+        time.sleep(delay)
+
+def post_batch(url, batch, adapter):
+    # The vehicles of a batch are posted one after the other, the API has no bulk insert
+    session = get_session(adapter)
+    added = 0
+    for data in batch:
+        if post_vehicle(session, url, data) == 201:
+            added += 1
+    return added, len(batch) - added
+
+def generate_batches(count, batch_size, rng):
+    # Records are generated in the main thread, so a seed always gives the same data whatever the concurrency
+    while count > 0:
+        size = min(batch_size, count)
+        yield [generate_vehicle(rng) for _ in range(size)]
+        count -= size
+
+# Generate good random data into the DB. Every vehicle is its own POST, and POST /vehicle is
+# limited to 100 a minute, use seed_database.py to load large datasets
+def feed_good_data(count=10, concurrency=1, batch_size=10, seed=None, url=post_url):
+    rng = random.Random(seed)
+    # one connection per worker thread
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    added = failed = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Keep a bounded number of batches in flight so memory does not grow with --count
+        in_flight = set()
+        for batch in generate_batches(count, batch_size, rng):
+            if len(in_flight) >= concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_added, batch_failed = future.result()
+                    added += batch_added
+                    failed += batch_failed
+            in_flight.add(executor.submit(post_batch, url, batch, adapter))
+        for future in in_flight:
+            batch_added, batch_failed = future.result()
+            added += batch_added
+            failed += batch_failed
+
+    elapsed = time.perf_counter() - start
+    print(f"Successfully added {added} vehicles, failed to add {failed}")
+    print(f"Took {elapsed:.2f}s ({added / elapsed if elapsed else 0:.1f} inserts/second)")
+    return added, failed
 
 # # Generate data with missing values and duplicates into the DB
 # def feed_bad_data():
@@ -99,4 +174,12 @@ def feed_good_data():
 
 
 if __name__ == "__main__":
-    feed_good_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Feed random vehicles into the database through the REST API")
+    parser.add_argument("--count", type=int, default=10, help="number of vehicles to add")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of worker threads")
+    parser.add_argument("--batch-size", type=int, default=10, help="vehicles a worker posts one after the other per task, they are not a bulk insert")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible data")
+    parser.add_argument("--url", default=post_url)
+    args = parser.parse_args()
+    feed_good_data(count=args.count, concurrency=args.concurrency, batch_size=args.batch_size,
+                   seed=args.seed, url=args.url)
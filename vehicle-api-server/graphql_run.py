@@ -1,4 +1,4 @@
-from app.graphql_server import app
+from app.graphql_server import create_app
 
 if __name__ == "__main__":
-    app.run(port=5001, debug=True)
+    create_app().run(port=5001, debug=True)
@@ -1,4 +1,11 @@
-from app.server import app
+import argparse
+
+from app.server import create_app
 
 if __name__ == "__main__":
-    app.run(port=5000, debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the REST API server")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="turn the rate limits off, for load tests that would otherwise measure 429s")
+    args = parser.parse_args()
+    config = {'RATELIMIT_ENABLED': False} if args.no_rate_limit else None
+    create_app(config).run(port=5000, debug=True)
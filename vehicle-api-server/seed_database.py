@@ -0,0 +1,102 @@
+import argparse
+import random
+import sqlite3
+import time
+
+from app.db import DATABASE, init_db
+from fire_data_into_database import generate_vehicle
+
+# Pragmas used only while loading: no fsync, in-memory rollback journal, a big page cache
+# and an exclusive lock. They are restored when the load finishes.
+BULK_LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "MEMORY",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",  # 256 MB
+    "locking_mode": "EXCLUSIVE",
+}
+
+INSERT_VEHICLE = '''INSERT OR IGNORE INTO vehicles (vin, manufacturer_name, description, horse_power,
+                    model_name, model_year, purchase_price, fuel_type)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def vehicle_rows(rng, count):
+    for _ in range(count):
+        vehicle = generate_vehicle(rng)
+        yield (vehicle["vin"], vehicle["manufacturer_name"], vehicle["description"], vehicle["horse_power"],
+               vehicle["model_name"], vehicle["model_year"], vehicle["purchase_price"], vehicle["fuel_type"])
+
+
+def suspend_schema_objects(db, object_type):
+    """Drop the indexes or triggers on vehicles and return their SQL so they can be rebuilt after the load."""
+    objects = db.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = ? AND tbl_name = 'vehicles' AND sql IS NOT NULL",
+        (object_type,)).fetchall()
+    for name, _ in objects:
+        db.execute(f'DROP {object_type.upper()} "{name}"')
+    return [sql for _, sql in objects]
+
+
+def seed_database(rows, seed=0, database=DATABASE, batch_size=100_000, with_change_log=False):
+    """
+    Insert random vehicles directly into the database until the vehicles table holds `rows` rows.
+    The same seed always generates the same vehicles. Returns (inserted rows, elapsed seconds).
+
+    The whole load is one transaction: the triggers are dropped, the rows inserted and the triggers
+    created again before the single COMMIT, so a load that fails or is interrupted rolls back to
+    the database as it was, change log triggers included.
+    """
+    init_db(database)
+    rng = random.Random(seed)
+    db = sqlite3.connect(database, isolation_level=None)
+    try:
+        previous_pragmas = {name: db.execute(f"PRAGMA {name}").fetchone()[0] for name in BULK_LOAD_PRAGMAS}
+        for name, value in BULK_LOAD_PRAGMAS.items():
+            db.execute(f"PRAGMA {name} = {value}")
+
+        start = time.perf_counter()
+        db.execute("BEGIN")
+        # The change log triggers are suspended, unless the seeded rows should show up in it.
+        # Secondary indexes would be rebuilt once at the end too, but vehicles has none today: its
+        # only index is the autoindex of the VIN primary key (sql IS NULL), which cannot be dropped
+        index_sql = suspend_schema_objects(db, "index")
+        trigger_sql = [] if with_change_log else suspend_schema_objects(db, "trigger")
+
+        existing = db.execute("SELECT COUNT(*) FROM vehicles").fetchone()[0]
+        inserted = 0
+        while existing + inserted < rows:
+            # INSERT OR IGNORE skips the rare duplicate VIN, keep going until we reach the target
+            cursor = db.executemany(INSERT_VEHICLE, vehicle_rows(rng, min(batch_size, rows - existing - inserted)))
+            inserted += cursor.rowcount
+            print(f"Inserted {inserted} vehicles ({inserted / (time.perf_counter() - start):.0f} rows/second)")
+
+        for sql in index_sql + trigger_sql:
+            db.execute(sql)
+        db.execute("COMMIT")
+        elapsed = time.perf_counter() - start
+
+        for name, value in previous_pragmas.items():
+            db.execute(f"PRAGMA {name} = {value}")
+        # The exclusive lock is only released by the next read once locking_mode is back to normal
+        db.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+    finally:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        db.close()
+    return inserted, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load random vehicles directly into the SQLite database")
+    parser.add_argument("--rows", type=int, required=True, help="target number of rows in the vehicles table")
+    parser.add_argument("--seed", type=int, default=0, help="seed for reproducible data")
+    parser.add_argument("--database", default=DATABASE, help="SQLite database file (defaults to the one in app.db)")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="rows generated and inserted per executemany() call")
+    parser.add_argument("--with-change-log", action="store_true",
+                        help="record the seeded rows in the vehicle_changes log")
+    args = parser.parse_args()
+
+    inserted, elapsed = seed_database(args.rows, seed=args.seed, database=args.database,
+                                      batch_size=args.batch_size, with_change_log=args.with_change_log)
+    print(f"Seeded {inserted} vehicles in {elapsed:.2f}s ({inserted / elapsed if elapsed else 0:.0f} rows/second)")
@@ -2,7 +2,14 @@ from unittest import TestCase
 from unittest.mock import patch
 import sqlite3
 import json
-from app.graphql_server import app
+import os
+import tempfile
+from app.graphql_server import create_app
+
+
+# A throwaway database, running the tests must not write into the project
+test_dir = tempfile.TemporaryDirectory()
+app = create_app({'TESTING': True, 'DATABASE': os.path.join(test_dir.name, 'vehicles.db')})
 
 
 class TestVehicleGraphQLAPI(TestCase):
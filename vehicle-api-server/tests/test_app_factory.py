@@ -0,0 +1,110 @@
+from unittest import TestCase
+from unittest.mock import patch
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from app import db, server, graphql_server
+
+
+class TestAppFactory(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp.name, 'vehicles.db')
+        self.example_vehicle = {
+            "vin": "1HGCM82633A123459",
+            "manufacturer_name": "Honda",
+            "description": "Reliable sedan",
+            "horse_power": 150,
+            "model_name": "Accord",
+            "model_year": 2020,
+            "purchase_price": 25000.50,
+            "fuel_type": "Gasoline"
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_import_has_no_side_effects(self):
+        # importing the servers must not create a database or a log file
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, '-c', 'import app.server, app.graphql_server'], cwd=self.tmp.name,
+                       env={**os.environ, 'PYTHONPATH': project_dir}, check=True)
+        assert os.listdir(self.tmp.name) == []
+
+    def test_only_the_first_app_configures_logging(self):
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+        first_log, second_log = os.path.join(self.tmp.name, 'first.log'), os.path.join(self.tmp.name, 'second.log')
+        with patch.object(root, 'handlers', []):
+            server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': first_log})
+            handlers = list(root.handlers)
+            server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': second_log})
+            assert root.handlers == handlers
+        for handler in handlers:
+            handler.close()
+        assert os.path.exists(first_log) and not os.path.exists(second_log)
+
+    def test_rest_app_uses_configured_database(self):
+        app = server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': None})
+        client = app.test_client()
+        response = client.post('/vehicle', data=json.dumps(self.example_vehicle), content_type='application/json')
+        assert response.status_code == 201
+        assert client.get(f'/vehicle/{self.example_vehicle["vin"]}').json == self.example_vehicle
+        assert os.path.exists(self.database)
+
+    def test_graphql_app_uses_configured_database(self):
+        server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': None}).test_client().post(
+            '/vehicle', data=json.dumps(self.example_vehicle), content_type='application/json')
+
+        app = graphql_server.create_app({'TESTING': True, 'DATABASE': self.database})
+        response = app.test_client().post('/graphql', json={'query': '{ vehicles { vin } }'})
+        assert response.json['data']['vehicles'] == [{'vin': self.example_vehicle['vin']}]
+        # the schema is only built once, however many apps are created
+        assert graphql_server.get_schema() is graphql_server.get_schema()
+
+    def test_rate_limits_are_per_app(self):
+        limited = server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': None,
+                                     'VEHICLE_LISTING_RATE_LIMIT': '2/hour'})
+        unlimited = server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': None,
+                                       'RATELIMIT_ENABLED': False})
+        assert limited.extensions['rate_limiter'] is not unlimited.extensions['rate_limiter']
+
+        client = limited.test_client()
+        assert [client.get('/vehicle').status_code for _ in range(3)] == [200, 200, 429]
+        client = unlimited.test_client()
+        assert [client.get('/vehicle').status_code for _ in range(3)] == [200, 200, 200]
+
+    def test_pages_share_the_listing_rate_limit(self):
+        app = server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': None,
+                                 'VEHICLE_LISTING_RATE_LIMIT': '2/hour'})
+        client = app.test_client()
+        for i in range(10):
+            client.post('/vehicle', json={**self.example_vehicle, 'vin': f'1HGCM82633A12345{i}'})
+
+        # a page of half the table costs half a full listing
+        assert client.get('/vehicle').status_code == 200
+        walk = [client.get('/vehicle?per_page=5')]
+        walk.append(client.get(f'/vehicle?per_page=5&cursor={walk[0].headers["X-Next-Cursor"]}'))
+        assert [response.status_code for response in walk] == [200, 200]
+        assert 'X-Next-Cursor' not in walk[1].headers
+        assert client.get('/vehicle?per_page=1').status_code == 429
+
+    def test_a_page_uses_one_connection_closed_after_the_request(self):
+        app = server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': None})
+        client = app.test_client()
+        client.post('/vehicle', json=self.example_vehicle)
+        connections = []
+
+        def get_db():
+            connections.append(db.get_db())
+            return connections[-1]
+
+        with patch.object(server, 'get_db', get_db):
+            assert client.get('/vehicle?per_page=5').status_code == 200
+        assert len(connections) == 1
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connections[0].execute('SELECT 1')
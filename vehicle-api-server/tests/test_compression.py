@@ -0,0 +1,55 @@
+from unittest import TestCase
+import gzip
+import json
+from flask import Flask, Response, jsonify
+from app.compression import init_compression
+
+
+class TestResponseCompression(TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['TESTING'] = True
+        init_compression(app)
+
+        @app.route('/large')
+        def large():
+            return jsonify([{"manufacturer_name": "Toyota", "fuel_type": "Gasoline"}] * 200)
+
+        @app.route('/small')
+        def small():
+            return jsonify({"message": "ok"})
+
+        @app.route('/stream')
+        def stream():
+            return Response((json.dumps({"row": i}) + '\n' for i in range(100)), mimetype='application/json')
+
+        self.client = app.test_client()
+
+    def test_large_response_is_gzipped(self):
+        response = self.client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert int(response.headers['Content-Length']) == len(response.data)
+        assert json.loads(gzip.decompress(response.data))[0]["manufacturer_name"] == "Toyota"
+
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+        assert response.json == {"message": "ok"}
+
+    def test_no_accept_encoding(self):
+        response = self.client.get('/large')
+        assert 'Content-Encoding' not in response.headers
+        assert len(response.json) == 200
+
+    def test_refused_encoding(self):
+        response = self.client.get('/large', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+        assert 'Content-Encoding' not in response.headers
+
+    def test_streamed_response_is_compressed(self):
+        response = self.client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        lines = gzip.decompress(response.data).decode().splitlines()
+        assert len(lines) == 100
+        assert json.loads(lines[-1]) == {"row": 99}
@@ -0,0 +1,93 @@
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import sqlite3
+import tempfile
+from app import db
+from app.db import InstrumentedConnection, normalize_sql, parameter_shape
+from app.server import create_app
+
+
+class TestSlowQueryLog(TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:', factory=InstrumentedConnection)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('''CREATE TABLE vehicles (
+            vin TEXT PRIMARY KEY COLLATE NOCASE,
+            manufacturer_name TEXT NOT NULL,
+            model_year INTEGER NOT NULL
+        )''')
+        self.connection.executemany('INSERT INTO vehicles VALUES (?, ?, ?)', [
+            ("1HGCM82633A000001", "Honda", 2020),
+            ("1HGCM82633A000002", "Kia", 2021),
+        ])
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_slow_query_is_logged_with_plan(self):
+        self.connection.slow_query_threshold_ms = 0
+        with self.assertLogs('app.db.slow_queries') as logs:
+            rows = self.connection.execute(
+                "SELECT * FROM vehicles WHERE 1=1 AND manufacturer_name = ?", ("Honda",)).fetchall()
+        assert len(rows) == 1
+        assert len(logs.output) == 1
+        message = logs.output[0]
+        assert "1 rows, full scan" in message
+        assert "SELECT * FROM vehicles WHERE ?=? AND manufacturer_name = ?" in message
+        assert "params: ['str']" in message
+        assert "plan: SCAN vehicles" in message
+        # parameter values are never logged
+        assert "Honda" not in message
+
+    def test_point_lookup_uses_index_and_update_counts_rows(self):
+        self.connection.slow_query_threshold_ms = 0
+        with self.assertLogs('app.db.slow_queries') as logs:
+            self.connection.execute('SELECT * FROM vehicles WHERE vin = ? LIMIT 1', ("1HGCM82633A000001",)).fetchone()
+            cursor = self.connection.execute('UPDATE vehicles SET model_year = ? WHERE model_year >= ?', (2022, 2000))
+            cursor.close()
+        assert "SEARCH vehicles USING INDEX" in logs.output[0]
+        assert "full scan" not in logs.output[0]
+        assert "(2 rows" not in logs.output[0]
+        assert "2 rows, full scan" in logs.output[1]
+
+    def test_fast_queries_are_not_logged(self):
+        self.connection.slow_query_threshold_ms = 10_000
+        with patch.object(db.slow_query_logger, 'warning') as warning:
+            self.connection.execute('SELECT * FROM vehicles').fetchall()
+        warning.assert_not_called()
+
+    def test_executemany_streams_its_parameters(self):
+        consumed = []
+
+        def rows():
+            for i in range(3, 1000):
+                consumed.append(i)
+                yield (f"1HGCM82633A{i:06d}", "Ford", 2019)
+
+        self.connection.slow_query_threshold_ms = 0
+        with self.assertLogs('app.db.slow_queries') as logs:
+            self.connection.executemany('INSERT INTO vehicles VALUES (?, ?, ?)', rows()).close()
+        assert len(consumed) == 997
+        assert self.connection.execute('SELECT COUNT(*) FROM vehicles').fetchone()[0] == 999
+        assert "997 rows" in logs.output[0] and "params: ['str', 'str', 'int']" in logs.output[0]
+        # nothing to insert, nothing to sample
+        self.connection.executemany('INSERT INTO vehicles VALUES (?, ?, ?)', iter([])).close()
+
+    def test_threshold_is_an_app_setting(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for threshold, factory in ((0, InstrumentedConnection), (-1, sqlite3.Connection)):
+                app = create_app({'TESTING': True, 'DATABASE': os.path.join(tmp, 'vehicles.db'), 'LOG_FILE': None,
+                                  'SLOW_QUERY_THRESHOLD_MS': threshold})
+                with app.app_context():
+                    connection = db.get_db()
+                    assert type(connection) is factory
+                    connection.close()
+            assert create_app({'TESTING': True, 'DATABASE': os.path.join(tmp, 'vehicles.db'), 'LOG_FILE': None}) \
+                .config['SLOW_QUERY_THRESHOLD_MS'] == 100
+
+    def test_helpers(self):
+        assert normalize_sql("SELECT *\n  FROM vehicles WHERE vin = 'ABC' AND model_year = 2020") == \
+            "SELECT * FROM vehicles WHERE vin = ? AND model_year = ?"
+        assert parameter_shape(("a", 1, 2.5, None)) == ['str', 'int', 'float', 'NoneType']
+        assert parameter_shape({"vin": "a"}) == {"vin": "str"}
@@ -0,0 +1,47 @@
+from unittest import TestCase
+from unittest.mock import patch
+import sqlite3
+import json
+from flask import Flask
+from app import json_provider
+from app.json_provider import VehicleJSONProvider
+
+
+class TestVehicleJSONProvider(TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.json = VehicleJSONProvider(self.app)
+
+        self.test_db = sqlite3.connect(':memory:')
+        self.test_db.row_factory = sqlite3.Row
+        self.test_db.execute('CREATE TABLE vehicles (vin TEXT, horse_power INTEGER, purchase_price REAL)')
+        self.test_db.execute("INSERT INTO vehicles VALUES ('1HGCM82633A123459', 150, 25000.5)")
+        self.rows = self.test_db.execute('SELECT * FROM vehicles').fetchall()
+        self.expected = [{"vin": "1HGCM82633A123459", "horse_power": 150, "purchase_price": 25000.5}]
+
+    def tearDown(self):
+        self.test_db.close()
+
+    def test_serializes_sqlite_rows(self):
+        with self.app.app_context():
+            response = self.app.json.response(self.rows)
+        assert response.mimetype == 'application/json'
+        assert json.loads(response.get_data()) == self.expected
+
+    def test_stdlib_fallback_matches_fast_path(self):
+        """
+        Without orjson the provider must produce the same document through the stdlib json module.
+        """
+        with self.app.app_context():
+            fast = self.app.json.dumps(self.rows)
+            with patch.object(json_provider, 'orjson', None):
+                fallback = self.app.json.dumps(self.rows)
+                response = self.app.json.response(self.rows[0])
+        assert json.loads(fast) == json.loads(fallback) == self.expected
+        assert json.loads(response.get_data()) == self.expected[0]
+
+    def test_loads_round_trip(self):
+        with self.app.app_context():
+            assert self.app.json.loads(b'{"vin": "1HGCM82633A123459"}') == {"vin": "1HGCM82633A123459"}
+            with self.assertRaises(ValueError):
+                self.app.json.loads('{not json')
@@ -0,0 +1,59 @@
+from unittest import TestCase
+import sqlite3
+import tracemalloc
+from flask import Flask
+from app.memory import init_memory_diagnostics, sqlite_object_counts
+
+
+def create_test_app(**config):
+    app = Flask(__name__)
+    app.config.update(TESTING=True, MEMORY_LOG_INTERVAL=0, **config)
+    init_memory_diagnostics(app)
+    return app
+
+
+class TestMemoryDiagnostics(TestCase):
+    def tearDown(self):
+        tracemalloc.stop()
+
+    def test_disabled_by_default(self):
+        app = create_test_app(MEMORY_DIAGNOSTICS=False)
+        assert not tracemalloc.is_tracing()
+        assert app.test_client().get('/admin/memory').status_code == 404
+
+    def test_report_attributes_growth_to_allocation_site(self):
+        app = create_test_app(MEMORY_DIAGNOSTICS=True, MEMORY_ADMIN_TOKEN='token')
+        client = app.test_client()
+        headers = {'X-Admin-Token': 'token'}
+        assert client.get('/admin/memory', headers=headers).status_code == 200
+
+        leak = [bytearray(1024) for _ in range(1000)]
+        report = client.get('/admin/memory', headers=headers).get_json()
+        assert report['traced_mib'] > 0
+        assert report['rss_mib'] > 0
+        assert any('test_memory.py' in stat['location'] and stat['size_diff_kib'] > 900
+                   for stat in report['growth_since_previous'])
+        assert leak
+
+    def test_counts_open_sqlite_connections(self):
+        before = sqlite_object_counts()
+        connection = sqlite3.connect(':memory:')
+        closed = sqlite3.connect(':memory:')
+        closed.close()
+
+        counts = sqlite_object_counts()
+        assert counts['open_connections'] == before['open_connections'] + 1
+        assert counts['connections'] == before['connections'] + 2
+        connection.close()
+
+    def test_admin_token(self):
+        app = create_test_app(MEMORY_DIAGNOSTICS=True, MEMORY_ADMIN_TOKEN='token')
+        client = app.test_client()
+        assert client.get('/admin/memory').status_code == 403
+        assert client.get('/admin/memory', headers={'X-Admin-Token': 'other'}).status_code == 403
+        assert client.get('/admin/memory?reset=1', headers={'X-Admin-Token': 'token'}).status_code == 200
+
+    def test_no_endpoint_without_admin_token(self):
+        app = create_test_app(MEMORY_DIAGNOSTICS=True, MEMORY_ADMIN_TOKEN=None)
+        assert tracemalloc.is_tracing()
+        assert app.test_client().get('/admin/memory').status_code == 404
@@ -0,0 +1,55 @@
+from unittest import TestCase
+import os
+import pstats
+import tempfile
+from flask import Flask, jsonify
+from app.profiling import init_profiling, sign_request, PROFILE_HEADER
+
+
+def create_test_app(**config):
+    app = Flask(__name__)
+    app.config.update(TESTING=True, **config)
+    init_profiling(app)
+
+    @app.route('/vehicle/<vin>')
+    def get_vehicle(vin):
+        return jsonify({"vin": vin})
+
+    return app
+
+
+class TestRequestProfiling(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.profile_dir.cleanup()
+
+    def test_signed_request_is_profiled(self):
+        app = create_test_app(PROFILE_SECRET='secret', PROFILE_DIR=self.profile_dir.name)
+        path = '/vehicle/1HGCM82633A123459'
+        response = app.test_client().get(path, headers={PROFILE_HEADER: sign_request('secret', 'GET', path)})
+        assert response.status_code == 200
+
+        files = os.listdir(self.profile_dir.name)
+        assert len(files) == 1
+        assert '_GET_vehicle_vin_1HGCM82633A123459_' in files[0]
+        # the file is a regular pstats dump
+        pstats.Stats(os.path.join(self.profile_dir.name, files[0]))
+
+    def test_unsigned_or_badly_signed_request_is_not_profiled(self):
+        app = create_test_app(PROFILE_SECRET='secret', PROFILE_DIR=self.profile_dir.name)
+        client = app.test_client()
+        client.get('/vehicle/1HGCM82633A123459')
+        client.get('/vehicle/1HGCM82633A123459', headers={PROFILE_HEADER: sign_request('wrong', 'GET', '/vehicle/1HGCM82633A123459')})
+        assert os.listdir(self.profile_dir.name) == []
+
+    def test_sample_rate(self):
+        app = create_test_app(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=self.profile_dir.name)
+        app.test_client().get('/vehicle/1HGCM82633A123459')
+        assert len(os.listdir(self.profile_dir.name)) == 1
+
+    def test_disabled_registers_no_hooks(self):
+        app = create_test_app(PROFILE_SECRET=None, PROFILE_SAMPLE_RATE=0.0)
+        assert not app.before_request_funcs
+        assert not app.teardown_request_funcs
@@ -0,0 +1,47 @@
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import sqlite3
+import tempfile
+import seed_database
+from seed_database import seed_database as seed
+
+
+def trigger_names(database):
+    with sqlite3.connect(database) as db:
+        return sorted(row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'"))
+
+
+class TestSeedDatabase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp.name, 'vehicles.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_seed_keeps_the_change_log_triggers(self):
+        inserted, _ = seed(250, seed=1, database=self.database, batch_size=100)
+        assert inserted == 250
+        assert trigger_names(self.database) == ['vehicles_log_delete', 'vehicles_log_insert', 'vehicles_log_update']
+        with sqlite3.connect(self.database) as db:
+            # the seeded rows are not in the change log, later writes are
+            assert db.execute('SELECT COUNT(*) FROM vehicle_changes').fetchone()[0] == 0
+            db.execute('DELETE FROM vehicles WHERE rowid = 1')
+            assert db.execute('SELECT COUNT(*) FROM vehicle_changes').fetchone()[0] == 1
+
+    def test_failed_seed_rolls_back_and_restores_the_triggers(self):
+        rows = seed_database.vehicle_rows
+        calls = []
+
+        def fail_on_second_batch(rng, count):
+            calls.append(count)
+            if len(calls) == 2:
+                raise RuntimeError('interrupted')
+            return rows(rng, count)
+
+        with patch.object(seed_database, 'vehicle_rows', fail_on_second_batch), self.assertRaises(RuntimeError):
+            seed(250, seed=1, database=self.database, batch_size=100)
+        assert trigger_names(self.database) == ['vehicles_log_delete', 'vehicles_log_insert', 'vehicles_log_update']
+        with sqlite3.connect(self.database) as db:
+            assert db.execute('SELECT COUNT(*) FROM vehicles').fetchone()[0] == 0
@@ -0,0 +1,53 @@
+from unittest import TestCase
+import os
+import tempfile
+from flask import Flask, jsonify
+from app import server, graphql_server
+from app.timing import init_server_timing, phase, timed
+from app.compression import init_compression
+
+
+def phase_names(response):
+    return [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+
+
+class TestServerTiming(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp.name, 'vehicles.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rest_phases(self):
+        client = server.create_app({'TESTING': True, 'DATABASE': self.database, 'LOG_FILE': None}).test_client()
+        assert phase_names(client.get('/vehicle')) == ['ratelimit', 'validate', 'db', 'serialize', 'total']
+        # a request rejected by validation never reaches the database
+        assert phase_names(client.get('/vehicle?fields=unknown')) == ['ratelimit', 'validate', 'serialize', 'total']
+
+    def test_graphql_phases(self):
+        client = graphql_server.create_app({'TESTING': True, 'DATABASE': self.database}).test_client()
+        response = client.post('/graphql', json={'query': '{ vehicles { vin } }'})
+        assert phase_names(response) == ['parse', 'validate', 'resolve', 'serialize', 'total']
+
+    def test_nested_phase_resumes_and_compression_is_timed(self):
+        app = Flask(__name__)
+        init_server_timing(app)
+        init_compression(app)
+
+        @app.route('/')
+        def index():
+            phase('work')
+            with timed('inner'):
+                pass
+            return jsonify(['x' * 100] * 100)
+
+        response = app.test_client().get('/', headers={'Accept-Encoding': 'gzip'})
+        assert phase_names(response) == ['work', 'inner', 'compress', 'total']
+
+    def test_disabled(self):
+        app = Flask(__name__)
+        app.config['SERVER_TIMING_ENABLED'] = False
+        init_server_timing(app)
+        app.route('/')(lambda: jsonify({}))
+        assert 'Server-Timing' not in app.test_client().get('/').headers
@@ -2,7 +2,21 @@ from unittest import TestCase
 from unittest.mock import patch
 import sqlite3
 import json
-from app.server import app
+import os
+import tempfile
+from app.server import create_app
+from app.db import init_change_log, compact_change_log, prune_change_log
+
+
+# A throwaway database and no log file, running the tests must not write into the project
+test_dir = tempfile.TemporaryDirectory()
+app = create_app({'TESTING': True, 'DATABASE': os.path.join(test_dir.name, 'vehicles.db'), 'LOG_FILE': None})
+
+
+class SharedConnection(sqlite3.Connection):
+    # The in-memory database outlives every request, the API closes its connection when a request ends
+    def close(self):
+        pass
 
 
 class TestVehicleAPI(TestCase):
@@ -11,7 +25,7 @@ class TestVehicleAPI(TestCase):
         self.client = app.test_client()
 
         # in-memory database connection for testing
-        self.test_db = sqlite3.connect(':memory:')
+        self.test_db = sqlite3.connect(':memory:', factory=SharedConnection)
         self.test_db.row_factory = sqlite3.Row
 
         cursor = self.test_db.cursor()
@@ -44,7 +58,7 @@ class TestVehicleAPI(TestCase):
 
     def tearDown(self):
         self.get_db_patcher.stop()
-        self.test_db.close()
+        sqlite3.Connection.close(self.test_db)
 
     def test_add_vehicle_success(self):
         """
@@ -87,6 +101,151 @@ class TestVehicleAPI(TestCase):
         assert response.status_code == 400 
         assert response.json['error'] == 'VIN format is not valid'
 
+    def test_get_vehicle_by_vin_sparse_fields(self):
+        """
+        Test GET /vehicle/<vin>?fields=... only returns the requested fields.
+        """
+        self.client.post('/vehicle', data=json.dumps(self.example_vehicle), content_type='application/json')
+
+        response = self.client.get(f'/vehicle/{self.example_vehicle["vin"]}?fields=model_name,purchase_price')
+        assert response.status_code == 200
+        assert response.json == {"model_name": "Accord", "purchase_price": 25000.50}
+
+    def test_get_all_vehicles_sparse_fields(self):
+        """
+        Test GET /vehicle?fields=... only returns the requested fields for every vehicle.
+        """
+        self.client.post('/vehicle', data=json.dumps(self.example_vehicle), content_type='application/json')
+
+        response = self.client.get('/vehicle?fields=vin,model_name,purchase_price')
+        assert response.status_code == 200
+        assert response.json == [{"vin": "1HGCM82633A123459", "model_name": "Accord", "purchase_price": 25000.50}]
+
+    def test_get_all_vehicles_unknown_field(self):
+        """
+        Test GET /vehicle?fields=... rejects fields that are not vehicle columns.
+        """
+        response = self.client.get('/vehicle?fields=vin,rowid')
+        assert response.status_code == 400
+        assert "rowid" in response.json['error']
+
+        response = self.client.get('/vehicle?fields=')
+        assert response.status_code == 400
+
+    def test_get_all_vehicles_paginated(self):
+        """
+        Test GET /vehicle?per_page=...&cursor=... walks every vehicle once, in insertion order.
+        """
+        vins = [f"1HGCM82633A00000{i}" for i in range(5)]
+        self.test_db.executemany('''INSERT INTO vehicles VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', [
+            (vin, "Honda", "Sedan", 150, "Accord", 2020, 20000.0, "Gasoline") for vin in vins])
+        self.test_db.commit()
+
+        pages = [self.client.get('/vehicle?fields=vin&per_page=2')]
+        while 'X-Next-Cursor' in pages[-1].headers:
+            pages.append(self.client.get(f'/vehicle?fields=vin&per_page=2&cursor={pages[-1].headers["X-Next-Cursor"]}'))
+        assert all(response.status_code == 200 for response in pages)
+        assert [len(response.json) for response in pages] == [2, 2, 1]
+        assert [row['vin'] for response in pages for row in response.json] == vins
+
+        # a deleted vehicle does not shift the next page
+        self.test_db.execute('DELETE FROM vehicles WHERE vin = ?', (vins[1],))
+        response = self.client.get(f'/vehicle?fields=vin&per_page=2&cursor={pages[0].headers["X-Next-Cursor"]}')
+        assert [row['vin'] for row in response.json] == vins[2:4]
+
+    def test_get_all_vehicles_invalid_page(self):
+        for query in ('cursor=-1', 'cursor=abc', 'per_page=0', 'per_page=100000', 'cursor=1&per_page=-1'):
+            response = self.client.get(f'/vehicle?{query}')
+            assert response.status_code == 400, query
+
+    def test_get_vehicle_stats(self):
+        """
+        Test GET /vehicle/stats aggregates over every vehicle in the database.
+        """
+        self.test_db.executemany('''INSERT INTO vehicles VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', [
+            ("1HGCM82633A000001", "Honda", "Sedan", 150, "Accord", 2020, 20000.0, "Gasoline"),
+            ("1HGCM82633A000002", "Honda", "Sedan", 170, "Civic", 2021, 30000.0, "Hybrid"),
+            ("1HGCM82633A000003", "Kia", "SUV", 200, "Sorento", 2020, 40000.0, "Gasoline"),
+        ])
+        self.test_db.commit()
+
+        response = self.client.get('/vehicle/stats?group_by=model_year&top=2')
+        assert response.status_code == 200
+        stats = response.json
+        assert stats['total_vehicles'] == 3
+        assert stats['most_common_manufacturer'] == "Honda"
+        assert stats['average_purchase_price'] == 30000.0
+        assert stats['fuel_type_distribution'] == {"Gasoline": 2, "Hybrid": 1}
+        assert stats['average_horse_power_by_manufacturer'] == {"Honda": 160.0, "Kia": 200.0}
+        assert stats['average_purchase_price_by_year'] == {"2020": 30000.0, "2021": 30000.0}
+        assert [group['value'] for group in stats['groups']] == [2020, 2021]
+        assert stats['groups'][0]['count'] == 2
+        assert [vehicle['vin'] for vehicle in stats['top_by_price']] == ["1HGCM82633A000003", "1HGCM82633A000002"]
+
+    def test_get_vehicle_stats_empty(self):
+        response = self.client.get('/vehicle/stats')
+        assert response.status_code == 200
+        assert response.json['total_vehicles'] == 0
+        assert response.json['most_common_manufacturer'] is None
+        assert 'groups' not in response.json
+
+    def test_get_vehicle_stats_invalid_params(self):
+        response = self.client.get('/vehicle/stats?group_by=description')
+        assert response.status_code == 400
+
+        response = self.client.get('/vehicle/stats?top=0')
+        assert response.status_code == 400
+
+    def test_get_vehicle_changes(self):
+        """
+        Test GET /vehicle/changes returns inserts, updates and deletes in pages.
+        """
+        init_change_log(self.test_db)
+        vin = self.example_vehicle["vin"]
+        self.client.post('/vehicle', data=json.dumps(self.example_vehicle), content_type='application/json')
+        self.client.patch(f'/vehicle/{vin}', data=json.dumps({"vin": vin, "horse_power": 180}),
+                          content_type='application/json')
+        self.client.delete(f'/vehicle/{vin}')
+
+        response = self.client.get('/vehicle/changes?since=0&limit=2')
+        assert response.status_code == 200
+        page = response.json
+        assert [change['operation'] for change in page['changes']] == ['insert', 'update']
+        assert page['changes'][1]['vehicle']['horse_power'] == 180
+        assert page['has_more'] is True
+        assert page['latest_seq'] == 3
+
+        response = self.client.get(f'/vehicle/changes?since={page["next_since"]}&limit=2')
+        page = response.json
+        assert page['changes'] == [{**page['changes'][0], 'vin': vin, 'operation': 'delete', 'vehicle': None}]
+        assert page['has_more'] is False
+        assert page['next_since'] == 3
+
+    def test_get_vehicle_changes_after_compaction_and_pruning(self):
+        init_change_log(self.test_db)
+        vin = self.example_vehicle["vin"]
+        self.client.post('/vehicle', data=json.dumps(self.example_vehicle), content_type='application/json')
+        self.client.patch(f'/vehicle/{vin}', data=json.dumps({"vin": vin, "horse_power": 180}),
+                          content_type='application/json')
+
+        # only the latest change for the VIN is kept
+        assert compact_change_log(self.test_db) == 1
+        changes = self.client.get('/vehicle/changes').json['changes']
+        assert [(change['seq'], change['operation']) for change in changes] == [(2, 'update')]
+
+        # consumers behind the pruned changes must resync
+        self.test_db.execute("UPDATE vehicle_changes SET changed_at = '2000-01-01T00:00:00.000Z'")
+        assert prune_change_log(self.test_db, 30) == 1
+        response = self.client.get('/vehicle/changes?since=1')
+        assert response.status_code == 410
+        assert response.json['latest_seq'] == 2
+        assert self.client.get('/vehicle/changes?since=2').json['changes'] == []
+
+    def test_get_vehicle_changes_invalid_params(self):
+        init_change_log(self.test_db)
+        assert self.client.get('/vehicle/changes?since=-1').status_code == 400
+        assert self.client.get('/vehicle/changes?limit=0').status_code == 400
+
 
     def test_get_all_vehicles_mocked_empty_result(self):
         """